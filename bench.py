@@ -0,0 +1,1380 @@
+"""
+LMS Bot 성능 측정 스크립트
+
+실제 canvas.kumoh.ac.kr 대신 로컬 가짜 Canvas 서버를 띄워 측정합니다.
+    python bench.py crawl --courses 8 --latency 0.05
+    python bench.py db --rows 3000
+    python bench.py html --rows 500 --kb 8
+    python bench.py diff --rows 200 --kb 8
+    python bench.py history --weeks 16 --courses 8
+    python bench.py search --semesters 4
+    python bench.py commands --courses 8
+    python bench.py pdf --pages 100 --changed 5
+    python bench.py e2e --courses 8 --latency 0.02 --error-rate 0.02
+
+요청 속도 제한(LMS_CRAWL_RATE_LIMIT)도 그대로 적용되므로, 순수 병렬 효과만 보려면
+    LMS_CRAWL_RATE_LIMIT=0 python bench.py crawl
+"""
+import gc
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import shutil
+import sqlite3
+import argparse
+import hashlib
+import tempfile
+import threading
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# main.py는 import 시점에 환경변수와 로그 경로를 확인하므로 먼저 설정
+BENCH_DIR = tempfile.mkdtemp(prefix="lms-bench-")
+os.environ.setdefault("TELEGRAM_TOKEN", "0:bench")
+os.environ.setdefault("CHAT_ID", "0")
+os.environ.setdefault("LMS_API_KEY", "bench")
+os.environ.setdefault("LMS_PARENT_PATH", BENCH_DIR)
+os.environ.setdefault("LMS_FILE_PATH", os.path.join(BENCH_DIR, "Univ"))
+os.environ.setdefault("LMS_QUIET_HOURS", "")  # e2e 측정이 휴식 시간에 멈추지 않도록
+
+import main as lms  # noqa: E402
+from canvasapi import Canvas  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+
+
+class FakeCanvasData:
+    """
+    가짜 Canvas 서버가 돌려줄 합성 데이터.
+    file_kb를 주면 파일마다 실제 본문(다운로드용)을 만들고, 앞의 pdf_files개는 합성 강의자료 PDF로 만듦
+    """
+    def __init__(self, courses=8, announcements=10, assignments=15, files=20, file_kb=None, pdf_files=0, pdf_pages=20):
+        self.courses = []
+        self.announcements = {}
+        self.assignments = {}
+        self.files = {}
+        self.payloads = {}  # file_id -> bytes
+        self.pdf_pages = pdf_pages
+        self._decks = {}  # revision -> PDF bytes
+        now = datetime.now(timezone.utc)
+        for c in range(1, courses + 1):
+            course_id = 1000 + c
+            self.courses.append({
+                "id": course_id,
+                "name": f"과목{c}-01",
+                "course_code": f"2026-1-CS{c:03d}-01",
+            })
+            self.announcements[course_id] = [
+                {
+                    "id": course_id * 1000 + a,
+                    "title": f"공지 {a}",
+                    "message": f"<p>과목{c} 공지 {a} 본문</p>",
+                    "posted_at": f"2026-03-{a % 28 + 1:02d}T00:00:00Z",
+                }
+                for a in range(1, announcements + 1)
+            ]
+            self.assignments[course_id] = [
+                {
+                    "id": course_id * 1000 + a,
+                    "name": f"과제 {a}",
+                    "course_id": course_id,
+                    "unlock_at": None,
+                    "created_at": "2026-03-01T00:00:00Z",
+                    # 마감은 실행 시각 기준으로 앞뒤에 흩어 놓아 planner/마감 알림 예약도 측정되게 함
+                    # (학기 중반처럼 2/3은 이미 마감이 지남 - 증분 수집은 bucket=future로 이 과제들을 받지 않음)
+                    "due_at": canvas_time(now + timedelta(hours=12 * (a - assignments * 2 // 3))),
+                    "lock_at": None,
+                    "description": f"<p>과목{c} 과제 {a} 설명</p>",
+                    "updated_at": f"2026-03-{a % 28 + 1:02d}T00:00:00Z",
+                }
+                for a in range(1, assignments + 1)
+            ]
+            self.files[course_id] = [
+                {
+                    "id": course_id * 1000 + f,
+                    "display_name": f"lecture{f:02d}.pdf",
+                    "size": 1024 * f,
+                    "locked_for_user": False,
+                    "updated_at": f"2026-03-{f % 28 + 1:02d}T00:00:00Z",
+                    "modified_at": f"2026-03-{f % 28 + 1:02d}T00:00:00Z",
+                    "url": "",
+                }
+                for f in range(1, files + 1)
+            ]
+            if file_kb is not None:
+                for index, file in enumerate(self.files[course_id]):
+                    if index < pdf_files:
+                        file["display_name"] = f"lecture{index + 1:02d}.pdf"
+                    else:
+                        file["display_name"] = f"material{index + 1:02d}.zip"
+                    self.set_payload(file, 0, file_kb)
+
+    def deck(self, revision):
+        """revision번째 페이지(1부터)만 바뀐 합성 강의자료 PDF"""
+        if revision not in self._decks:
+            pdf_path = os.path.join(BENCH_DIR, f"served_deck_{revision}.pdf")
+            make_sample_deck(pdf_path, self.pdf_pages, {revision - 1} if revision else (), revision)
+            with open(pdf_path, "rb") as f:
+                self._decks[revision] = f.read()
+        return self._decks[revision]
+
+    def set_payload(self, file, revision, file_kb):
+        if file["display_name"].endswith(".pdf"):
+            payload = self.deck(revision % self.pdf_pages)
+        else:
+            seed = f"{file['id']}:{revision}:".encode("utf-8")
+            payload = (seed * (file_kb * 1024 // len(seed) + 1))[:file_kb * 1024]
+        self.payloads[file["id"]] = payload
+        file["size"] = len(payload)
+        file["revision"] = revision
+
+    def planner_items(self, start):
+        """planner/items: start 이후 마감인 과제 (3개 중 1개는 제출한 것으로 표시)"""
+        items = []
+        for course in self.courses:
+            for assignment in self.assignments[course["id"]]:
+                if assignment["due_at"] < start:
+                    continue
+                items.append({
+                    "course_id": course["id"],
+                    "context_name": course["name"],
+                    "html_url": f"/courses/{course['id']}/assignments/{assignment['id']}",
+                    "plannable": {"title": assignment["name"], "due_at": assignment["due_at"]},
+                    "submissions": {"submitted": assignment["id"] % 3 == 0},
+                })
+        return items
+
+    def apply_changes(self, courses, file_kb):
+        """
+        앞의 courses개 과목에 새 공지 1개, 과제 마감 변경 1개, 파일 수정 1개, 파일 이름 변경 1개씩 반영.
+        반환: 바꾼 항목 수 (이름만 바꾼 파일은 다시 받지 않아야 하므로 제외)
+        """
+        now = canvas_time(datetime.now(timezone.utc))
+        changed = 0
+        for course in self.courses[:courses]:
+            course_id = course["id"]
+            announcements = self.announcements[course_id]
+            announcements.append({
+                "id": course_id * 1000 + len(announcements) + 1,
+                "title": f"공지 {len(announcements) + 1}",
+                "message": f"<p>{course['name']} 추가 공지</p>",
+                "posted_at": now,
+            })
+            assignment = self.assignments[course_id][-1]
+            assignment["due_at"] = canvas_time(datetime.fromisoformat(assignment["due_at"].replace("Z", "+00:00"))
+                                               + timedelta(days=1))
+            assignment["updated_at"] = now
+            changed += 2
+            if self.files[course_id]:
+                file = self.files[course_id][0]
+                file["updated_at"] = file["modified_at"] = now
+                self.set_payload(file, file.get("revision", 0) + 1, file_kb)
+                changed += 1
+            if len(self.files[course_id]) > 1:
+                # LMS에서 이름만 바꾸면 updated_at만 바뀌고 modified_at은 그대로
+                file = self.files[course_id][1]
+                stem, ext = os.path.splitext(file["display_name"])
+                file["display_name"] = f"{stem}_renamed{ext}"
+                file["updated_at"] = now
+        return changed
+
+
+def canvas_time(dt):
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeCanvasServer:
+    """
+    ThreadingHTTPServer 기반의 최소 Canvas REST API 흉내.
+      - page_size를 주면 목록을 Link 헤더(rel="next")로 나눠 보냄
+      - error_rate 비율의 요청에 429/503을 돌려줌 (urllib3 Retry가 다시 보냄)
+      - /files/<id>/download: 파일 본문 (Range 지원), POST /ntfy/<topic>: ntfy 신호 수신
+    """
+    def __init__(self, data: FakeCanvasData, latency: float = 0.0, page_size=0, error_rate=0.0, seed=0):
+        self.data = data
+        self.latency = latency
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.download_count = 0
+        self.errors_injected = 0
+        self.ntfy_count = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def submission(self, assignment_id):
+        return {"assignment_id": assignment_id, "workflow_state": "unsubmitted", "submitted_at": None}
+
+    def route(self, path, query):
+        parts = [p for p in path.split("/") if p][2:]  # /api/v1 제거
+        if parts == ["courses"]:
+            return self.data.courses
+        if parts == ["planner", "items"]:
+            return self.data.planner_items(query.get("start_date", [""])[0][:19] + "Z")
+        if len(parts) >= 3 and parts[0] == "courses":
+            course_id = int(parts[1])
+            if parts[2] == "discussion_topics":
+                announcements = self.data.announcements.get(course_id, [])
+                if query.get("order_by") == ["recent_activity"]:
+                    announcements = sorted(announcements, key=lambda a: a["posted_at"], reverse=True)
+                return announcements
+            if parts[2] == "files":
+                files = [dict(f, url=f"{self.url}/files/{f['id']}/download")
+                         for f in self.data.files.get(course_id, [])]
+                if query.get("sort") == ["updated_at"]:
+                    files.sort(key=lambda f: f["updated_at"], reverse=query.get("order") == ["desc"])
+                return files
+            if parts[2] == "assignments" and len(parts) == 3:
+                assignments = self.data.assignments.get(course_id, [])
+                if query.get("bucket") == ["future"]:
+                    # Canvas의 future 버킷: 마감이 없거나 아직 지나지 않은 과제
+                    now = canvas_time(datetime.now(timezone.utc))
+                    assignments = [a for a in assignments if a["due_at"] is None or a["due_at"] >= now]
+                if "submission" in query.get("include[]", []):
+                    return [dict(a, submission=self.submission(a["id"])) for a in assignments]
+                return assignments
+            if parts[2] == "assignments" and parts[4:] == ["submissions", "self"]:
+                return self.submission(int(parts[3]))
+        return None
+
+    def paginate(self, split, query, body):
+        """목록을 page_size씩 나누고 다음 페이지가 있으면 Link 헤더 값도 반환"""
+        if not self.page_size or not isinstance(body, list):
+            return body, None
+        # Canvas처럼 per_page 요청값을 서버 최대 페이지 크기로 제한 (canvasapi는 per_page=100을 보냄)
+        per_page = min(int(query.get("per_page", [self.page_size])[0]), self.page_size)
+        page = int(query.get("page", ["1"])[0])
+        chunk = body[(page - 1) * per_page:page * per_page]
+        if page * per_page >= len(body):
+            return chunk, None
+        next_query = {key: values for key, values in query.items() if key not in ("page", "per_page")}
+        next_query.update(page=[str(page + 1)], per_page=[str(per_page)])
+        return chunk, f'<{self.url}{split.path}?{urlencode(next_query, doseq=True)}>; rel="next"'
+
+    def inject_error(self):
+        """error_rate 확률로 돌려줄 오류 상태 코드 (429 또는 503), 아니면 None"""
+        with self._lock:
+            if self.error_rate <= 0 or self.random.random() >= self.error_rate:
+                return None
+            self.errors_injected += 1
+            return 429 if self.errors_injected % 2 else 503
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive (requests 세션의 연결 재사용)
+
+            def send_empty(self, status, headers=()):
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.startswith("/ntfy/"):
+                    self.send_empty(404)
+                    return
+                with server._lock:
+                    server.ntfy_count += 1
+                self.send_empty(200)
+
+            def send_file(self, file_id):
+                payload = server.data.payloads.get(file_id)
+                if payload is None:
+                    self.send_empty(404)
+                    return
+                start = 0
+                match = (self.headers.get("Range") or "").removeprefix("bytes=").split("-")[0]
+                if match.isdigit() and int(match) < len(payload):
+                    start = int(match)
+                with server._lock:
+                    server.download_count += 1
+                    server.bytes_sent += len(payload) - start
+                self.send_response(206 if start else 200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(payload) - start))
+                self.end_headers()
+                self.wfile.write(payload[start:])
+
+            def do_GET(self):
+                with server._lock:
+                    server.request_count += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                status = server.inject_error()
+                if status is not None:
+                    self.send_empty(status, [("Retry-After", "0")] if status == 429 else [])
+                    return
+                split = urlsplit(self.path)
+                parts = [p for p in split.path.split("/") if p]
+                if len(parts) == 3 and parts[0] == "files" and parts[2] == "download":
+                    self.send_file(int(parts[1]))
+                    return
+                query = parse_qs(split.query)
+                body = server.route(split.path, query)
+                if body is None:
+                    self.send_empty(404)
+                    return
+                body, link = server.paginate(split, query, body)
+                payload = json.dumps(body).encode("utf-8")
+                etag = f'W/"{hashlib.sha1(payload).hexdigest()}"'
+                headers = [("ETag", etag)] + ([("Link", link)] if link else [])
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_empty(304, headers)
+                    return
+                with server._lock:
+                    server.bytes_sent += len(payload)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def summarize_crawl(results):
+    return [
+        (course.id, course_name, course_code, announcements, assignments, [f.id for f in files])
+        for course, course_name, course_code, announcements, assignments, files, _ in results
+    ]
+
+
+async def run_crawl(server, mode, concurrency, http_cache=None):
+    canvas = Canvas(server.url, lms.API_KEY)
+    lms.configure_canvas_session(canvas._Canvas__requester._session, http_cache)
+    before = server.request_count
+    started = time.perf_counter()
+    results = await lms.crawl_courses(canvas, {}, mode=mode, concurrency=concurrency)
+    elapsed = time.perf_counter() - started
+    return summarize_crawl(results), elapsed, server.request_count - before
+
+
+def bench_crawl(args):
+    data = FakeCanvasData(args.courses, args.announcements, args.assignments, args.files)
+    with FakeCanvasServer(data, latency=args.latency) as server:
+        serial, serial_time, serial_requests = asyncio.run(run_crawl(server, "serial", args.concurrency))
+        concurrent, concurrent_time, concurrent_requests = asyncio.run(run_crawl(server, "concurrent", args.concurrency))
+
+        # HTTP 캐시: 처음 주기에 ETag를 저장하고, 두 번째 주기는 조건부 요청(304)으로 본문을 받지 않음
+        http_cache = lms.HttpCacheDB(os.path.join(BENCH_DIR, "http_cache.db"))
+        http_cache.prune(lms.timedelta(0))
+        asyncio.run(run_crawl(server, "concurrent", args.concurrency, http_cache))
+        lms.crawl_stats.reset()
+        bytes_before = server.bytes_sent
+        cached, cached_time, cached_requests = asyncio.run(run_crawl(server, "concurrent", args.concurrency, http_cache))
+        cached_bytes = server.bytes_sent - bytes_before
+    print(f"serial     : {serial_time:7.2f}s, requests={serial_requests}")
+    print(f"concurrent : {concurrent_time:7.2f}s, requests={concurrent_requests} (concurrency={args.concurrency})")
+    print(f"speedup    : {serial_time / concurrent_time:7.2f}x")
+    print(f"http cache : {cached_time:7.2f}s, requests={cached_requests}, "
+          f"304={lms.crawl_stats.get('http_cache_hits')}, miss={lms.crawl_stats.get('http_cache_misses')}, "
+          f"본문 전송 {cached_bytes}B (절약 {lms.crawl_stats.get('http_cache_bytes_saved')}B)")
+    print(f"submission : 개별 요청 {lms.crawl_stats.get('submission_requests')}건, "
+          f"일괄 조회로 절약 {lms.crawl_stats.get('submission_requests_avoided')}건")
+    if not (serial == concurrent == cached):
+        print("❌ serial / concurrent / http cache 결과가 다릅니다")
+        return 1
+    print("✅ serial / concurrent / http cache 결과 동일")
+    return 0
+
+
+def legacy_assignment_set_database(db_path, tr_list):
+    """비교용: 공유 연결 도입 이전 AssignmentDB.set_database (행마다 autocommit, 개별 SELECT/UPDATE)"""
+    con = sqlite3.connect(db_path, isolation_level=None)
+    cur = con.cursor()
+    cur.execute("""CREATE TABLE IF NOT EXISTS assignment (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    assignment_id INT,
+                    course_id INT,
+                    course_name TEXT,
+                    assignment_name TEXT,
+                    start_date TEXT NULL,
+                    end_date TEXT NULL,
+                    description TEXT NULL,
+                    submitted INTEGER NOT NULL DEFAULT 0)""")
+    changed_rows = []
+    for assignment_id, course_id, course_name, assignment_name, start_date, end_date, description, submitted in tr_list:
+        submitted_value = None if submitted is None else int(bool(submitted))
+        new_values = (course_id, course_name, assignment_name, start_date, end_date, description)
+        cur.execute("""SELECT id, course_id, course_name, assignment_name, start_date, end_date, description, submitted
+                       FROM assignment WHERE assignment_id=:Id""", {"Id": assignment_id})
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("""INSERT INTO assignment
+                        (assignment_id, course_id, course_name, assignment_name, start_date, end_date, description, submitted)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                        (assignment_id, *new_values, submitted_value or 0))
+            continue
+        if submitted_value is None:
+            submitted_value = row[7]
+        if tuple(row[1:7]) != new_values or row[7] != submitted_value:
+            cur.execute("""UPDATE assignment
+                           SET course_id=?, course_name=?, assignment_name=?, start_date=?, end_date=?, description=?, submitted=?
+                           WHERE assignment_id=?""",
+                        (*new_values, submitted_value, assignment_id))
+            changed_rows.append(assignment_id)
+    con.close()
+    return changed_rows
+
+
+def synthetic_assignments(count, revision=0, changed_ratio=0.0):
+    changed_until = int(count * changed_ratio)
+    return [
+        (
+            100000 + i,
+            1000 + i % 8,
+            f"과목{i % 8}",
+            f"과제 {i}" + (f" (rev {revision})" if i < changed_until else ""),
+            "2026-03-01T00:00:00Z",
+            f"2026-04-{i % 28 + 1:02d}T14:59:59Z",
+            f"<p>과제 {i} 설명</p>" * 20,
+            i % 3 == 0,
+        )
+        for i in range(count)
+    ]
+
+
+def bench_db(args):
+    cycles = [
+        ("insert", synthetic_assignments(args.rows)),
+        ("unchanged", synthetic_assignments(args.rows)),
+        (f"{int(args.changed * 100)}% changed", synthetic_assignments(args.rows, 1, args.changed)),
+    ]
+    legacy_path = os.path.join(BENCH_DIR, "legacy.db")
+    shared_path = os.path.join(BENCH_DIR, "shared.db")
+    assignment_db = lms.AssignmentDB(shared_path)
+    print(f"rows={args.rows}")
+    for label, rows in cycles:
+        started = time.perf_counter()
+        legacy_assignment_set_database(legacy_path, rows)
+        legacy_time = time.perf_counter() - started
+        started = time.perf_counter()
+        assignment_db.set_database(rows)
+        shared_time = time.perf_counter() - started
+        print(f"{label:12}: before {legacy_time * 1000:8.1f}ms, after {shared_time * 1000:8.1f}ms "
+              f"({legacy_time / shared_time:5.1f}x)")
+    return 0
+
+
+def syllabus_html(index, kb, revision=0):
+    """강의계획서처럼 긴 과제 설명 HTML (약 kb KB)"""
+    week = (f"<tr><td>{{week}}주차</td><td><p><strong>주제</strong> 과제 {index} 관련 내용 "
+            f"<span style=\"color: #333333;\">rev {revision}</span></p><ul><li>읽기 자료</li><li>실습</li></ul></td></tr>")
+    rows = []
+    while sum(map(len, rows)) < kb * 1024:
+        rows.append(week.format(week=len(rows) + 1))
+    return (f"<div><h2>과제 {index}</h2><p><a href=\"https://zoom.us/j/{900000 + index}\">Zoom 강의실</a></p>"
+            f"<table>{''.join(rows)}</table></div>")
+
+
+def html_rows(count, kb, revision=0, changed_ratio=0.0):
+    changed_until = int(count * changed_ratio)
+    return [
+        (200000 + i, 1000 + i % 8, f"과목{i % 8}", f"과제 {i}", "2026-03-01T00:00:00Z",
+         f"2026-04-{i % 28 + 1:02d}T14:59:59Z", syllabus_html(i, kb, revision if i < changed_until else 0), None)
+        for i in range(count)
+    ]
+
+
+def legacy_html_cycle(db_path, rows, previous):
+    """
+    비교용: 평문 컬럼 도입 이전 한 주기 - HTML 원문을 문자열로 비교/저장하고,
+    새 과제 알림과 변경 알림(이전/새 본문)마다 html.parser로 다시 파싱
+    """
+    changed = set(legacy_assignment_set_database(db_path, rows))
+    for assignment_id, *_, description, _ in rows:
+        if assignment_id not in previous:
+            BeautifulSoup(description or "없음", "html.parser").get_text().strip()
+        elif assignment_id in changed:
+            BeautifulSoup(previous[assignment_id], "html.parser").get_text("\n", strip=True)
+            BeautifulSoup(description, "html.parser").get_text("\n", strip=True)
+        previous[assignment_id] = description
+
+
+def current_html_cycle(assignment_db, watcher, rows):
+    """현재 방식 한 주기: 저장할 때 새/바뀐 본문만 파싱하고, 알림은 저장된 평문을 읽음"""
+    for changed in assignment_db.set_database(rows):
+        lms.build_change_message("[과제 변경 알림]", changed["course_name"], changed["assignment_name"],
+                                 changed["changed_fields"], {"description": "내용"}, diff_fields={"description"})
+    for *_, description_text in watcher.iter_new_rows():
+        description_text or "없음"
+
+
+def bench_html(args):
+    cycles = [
+        ("insert", html_rows(args.rows, args.kb)),
+        ("unchanged", html_rows(args.rows, args.kb)),
+        ("unchanged", html_rows(args.rows, args.kb)),
+        (f"{int(args.changed * 100)}% changed", html_rows(args.rows, args.kb, 1, args.changed)),
+    ]
+    legacy_path = os.path.join(BENCH_DIR, "legacy_html.db")
+    assignment_db = lms.AssignmentDB(os.path.join(BENCH_DIR, "html.db"))
+    watcher = lms.DatabaseWatcher(assignment_db, ("assignment_id", "description_text"))
+    previous = {}
+    print(f"rows={args.rows}, 설명 {args.kb}KB, 파서={'lxml' if lms.lxml else 'html.parser'}")
+    totals = [0.0, 0.0]
+    for label, rows in cycles:
+        gc.collect()  # 이전 주기의 BeautifulSoup 순환 참조 정리 비용이 다음 측정에 섞이지 않게 함
+        started = time.process_time()
+        legacy_html_cycle(legacy_path, rows, previous)
+        legacy_cpu = time.process_time() - started
+        gc.collect()
+        started = time.process_time()
+        current_html_cycle(assignment_db, watcher, rows)
+        current_cpu = time.process_time() - started
+        totals[0] += legacy_cpu
+        totals[1] += current_cpu
+        print(f"{label:12}: CPU before {legacy_cpu * 1000:8.1f}ms, after {current_cpu * 1000:8.1f}ms")
+    print(f"{'total':12}: CPU before {totals[0] * 1000:8.1f}ms, after {totals[1] * 1000:8.1f}ms "
+          f"({totals[0] / totals[1]:5.1f}x)")
+    return 0
+
+
+def edit_syllabus(html, kind, index):
+    """
+    과제 설명 HTML 수정: word(가운데쯤 주차 한 단어), whitespace(공백/줄바꿈만), markup(태그/스타일만),
+    link(글은 그대로 Zoom 링크 주소만)
+    """
+    if kind == "word":
+        week = html.count("주차") * 2 // 3
+        target = f"<td>{week}주차</td><td><p><strong>주제</strong> 과제 {index} 관련"
+        return html.replace(target, target.replace("관련", "보충"), 1)
+    if kind == "whitespace":
+        return html.replace("</tr>", "</tr>\n  ").replace("<li>", "<li> ")
+    if kind == "link":
+        return html.replace(f"zoom.us/j/{900000 + index}", f"zoom.us/j/{800000 + index}", 1)
+    return html.replace("<strong>주제</strong>", "<b>주제</b>").replace("#333333", "#000000")
+
+
+def bench_diff(args):
+    assignment_db = lms.AssignmentDB(os.path.join(BENCH_DIR, "diff.db"))
+    base = html_rows(args.rows, args.kb)
+    assignment_db.set_database(base)
+    labels = {"description": "내용"}
+    print(f"rows={args.rows}, 설명 {args.kb}KB")
+    failures = []
+    for kind in ("word", "whitespace", "markup", "link"):
+        rows = [row[:6] + (edit_syllabus(row[6], kind, row[0] - 200000), row[7]) for row in base]
+        changed = assignment_db.set_database(rows)
+        diff_times, sizes, visible = [], [0, 0], [0, 0]
+        for item in changed:
+            legacy = lms.build_change_message("[과제 변경 알림]", item["course_name"], item["assignment_name"],
+                                              item["changed_fields"], labels)
+            started = time.perf_counter()
+            message = lms.build_change_message("[과제 변경 알림]", item["course_name"], item["assignment_name"],
+                                               item["changed_fields"], labels, diff_fields={"description"})
+            diff_times.append(time.perf_counter() - started)
+            for position, text in enumerate((legacy, message)):
+                sizes[position] += len(text)
+                # 링크는 주소의 바뀐 숫자만 단어 단위로 표시 ({+800123+})
+                visible[position] += ("{+8" in text or "/j/8" in text) if kind == "link" else "보충" in text
+        count = max(1, len(changed))
+        print(f"{kind:10}: 알림 {len(changed):4}건, 메시지 생성 평균 {sum(diff_times) / count * 1000:6.2f}ms "
+              f"(최대 {max(diff_times, default=0) * 1000:6.2f}ms), 메시지 길이 before {sizes[0] / count:6.0f}자 "
+              f"after {sizes[1] / count:6.0f}자, 바뀐 단어 표시 before {visible[0]}건 after {visible[1]}건")
+        if kind in ("word", "link") and (len(changed) != len(rows) or visible[1] != len(rows)):
+            failures.append(f"{kind} 변경이 알림에 모두 표시되지 않았습니다")
+        if kind in ("whitespace", "markup") and changed:
+            failures.append(f"{kind} 변경인데 알림이 {len(changed)}건 생겼습니다")
+        assignment_db.set_database(base)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        return 1
+    print("✅ 한 단어/링크 주소 변경은 바뀐 부분만, 공백/태그 변경은 알림 없음")
+    return 0
+
+
+SEMESTER_WORDS = ("과제", "제출", "기한", "강의", "실습", "보고서", "시험", "범위", "참고", "자료", "공지", "변경",
+                  "온라인", "출석", "팀", "발표", "평가", "기준", "질문", "게시판", "연장", "안내", "주의", "형식")
+
+
+def semester_body(rng, label, kb):
+    """과제 설명/공지 본문처럼 문단이 여러 개인 HTML (약 kb KB)"""
+    paragraphs = []
+    while sum(map(len, paragraphs)) < kb * 1024:
+        words = " ".join(rng.choice(SEMESTER_WORDS) for _ in range(24))
+        paragraphs.append(f"<p>{label} 안내 {len(paragraphs) + 1}: {words}</p>\n")
+    return "".join(paragraphs)
+
+
+def edit_body(rng, history, week):
+    """한 학기 동안 실제로 자주 있는 본문 수정 (오타 수정, 문단 추가, 스타일만 변경, 이전 내용으로 되돌리기)"""
+    body = history[-1]
+    edit = rng.choice(("typo", "typo", "append", "markup", "revert") if len(history) > 1 else ("typo", "append"))
+    if edit == "typo":
+        old_word, new_word = rng.sample(SEMESTER_WORDS, 2)
+        position = body.find(old_word, rng.randrange(len(body)))
+        if position < 0:
+            position = body.find(old_word)
+        if position >= 0:
+            return body[:position] + new_word + body[position + len(old_word):]
+        return body + f"<p>{new_word}</p>\n"
+    if edit == "append":
+        return body + f"<p>{week}주차 추가 안내: " + " ".join(rng.choice(SEMESTER_WORDS) for _ in range(16)) + "</p>\n"
+    if edit == "markup":
+        return body.replace("<p>", '<p style="margin: 0;">', 1) if "<p>" in body else body.replace(' style="margin: 0;"', "", 1)
+    return history[-2]
+
+
+def db_bytes(storage):
+    page_count = storage.con.execute("PRAGMA page_count").fetchone()[0]
+    return page_count * storage.con.execute("PRAGMA page_size").fetchone()[0]
+
+
+def bench_history(args):
+    rng = random.Random(args.seed)
+    lms.HISTORY_ENABLED = False
+    plain = (lms.AssignmentDB(os.path.join(BENCH_DIR, "history_off.db")),
+             lms.AnnouncementDB(os.path.join(BENCH_DIR, "history_off.db")))
+    lms.HISTORY_ENABLED = True
+    tracked = (lms.AssignmentDB(os.path.join(BENCH_DIR, "history_on.db")),
+               lms.AnnouncementDB(os.path.join(BENCH_DIR, "history_on.db")))
+    history = tracked[0].history
+    assignments, announcements = {}, {}
+    checkpoints, seconds = [], [0.0, 0.0]
+    start = datetime(2026, 3, 2, tzinfo=timezone.utc)
+    for week in range(1, args.weeks + 1):
+        for course in range(args.courses):
+            for _ in range(args.announcements):
+                announcement_id = 300000 + len(announcements)
+                announcements[announcement_id] = {
+                    "course": course, "title": f"{week}주차 공지 {announcement_id}",
+                    "history": [semester_body(rng, f"공지 {announcement_id}", args.kb / 2)]}
+            for _ in range(args.assignments):
+                assignment_id = 400000 + len(assignments)
+                assignments[assignment_id] = {
+                    "course": course, "name": f"{week}주차 과제 {assignment_id}",
+                    "end": start + timedelta(weeks=week + 1), "history": [semester_body(rng, f"과제 {assignment_id}", args.kb)]}
+        for item in assignments.values():
+            if rng.random() < args.edit_rate:
+                if rng.random() < 0.3:
+                    item["end"] += timedelta(days=rng.choice((1, 2, 7)))
+                else:
+                    item["history"].append(edit_body(rng, item["history"], week))
+        for item in announcements.values():
+            if rng.random() < args.edit_rate / 2:
+                item["history"].append(edit_body(rng, item["history"], week))
+
+        assignment_rows = [
+            (assignment_id, 1000 + item["course"], f"과목{item['course']}", item["name"], start.isoformat(),
+             item["end"].isoformat(), item["history"][-1], None)
+            for assignment_id, item in assignments.items()
+        ]
+        announcement_rows = [
+            (announcement_id, 1000 + item["course"], f"과목{item['course']}", item["title"], item["history"][-1],
+             start.isoformat())
+            for announcement_id, item in announcements.items()
+        ]
+        for index, (assignment_db, announcement_db) in enumerate((plain, tracked)):
+            started = time.perf_counter()
+            assignment_db.set_database(assignment_rows)
+            announcement_db.set_database(announcement_rows)
+            seconds[index] += time.perf_counter() - started
+        with history.storage.cursor() as cur:
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM revision")
+            revision_id = cur.fetchone()[0]
+        # 나중에 이 시점 값으로 복원되는지 확인할 표본 (과제 5개 중 1개)
+        checkpoints.append((revision_id, {
+            assignment_id: {"assignment_name": item["name"], "start_date": start.isoformat(),
+                            "end_date": item["end"].isoformat(), "description": item["history"][-1]}
+            for assignment_id, item in assignments.items() if assignment_id % 5 == 0
+        }))
+
+    stats = history.stats()
+    with history.storage.cursor() as cur:
+        cur.execute("SELECT blob_id FROM revision WHERE blob_id IS NOT NULL")
+        zlib_bytes = sum(len(lms.zlib.compress(history.blob_text(cur, blob_id).encode("utf-8"), 9))
+                         for blob_id, in cur.fetchall())
+    growth = db_bytes(tracked[0].storage) - db_bytes(plain[0].storage)
+
+    failures, restore_times = 0, []
+    for revision_id, expected in checkpoints:
+        for assignment_id, values in expected.items():
+            history._text_cache.clear()  # 캐시 없이 delta 체인을 끝까지 푸는 경우로 측정
+            started = time.perf_counter()
+            restored = history.version("assignment", assignment_id, revision_id=revision_id)
+            restore_times.append(time.perf_counter() - started)
+            failures += restored != values
+
+    print(f"{args.weeks}주, 과목 {args.courses}개: 과제 {len(assignments)}개, 공지 {len(announcements)}개, "
+          f"리비전 {stats['revisions']}개 (본문 {stats['blobs']}개)")
+    print(f"전체 사본          : {stats['logical_bytes'] / 1024:9.1f}KB")
+    print(f"리비전마다 zlib    : {zlib_bytes / 1024:9.1f}KB")
+    print(f"중복 제거 + delta  : {stats['stored_bytes'] / 1024:9.1f}KB (DB 파일 증가 {growth / 1024:.1f}KB)")
+    print(f"DB 반영 시간       : 이력 없음 {seconds[0]:.2f}s, 이력 저장 {seconds[1]:.2f}s")
+    print(f"복원 ({len(restore_times)}회, 캐시 없음): 평균 {sum(restore_times) / len(restore_times) * 1000:.2f}ms, "
+          f"최대 {max(restore_times) * 1000:.2f}ms")
+    if failures:
+        print(f"❌ 복원한 값이 기록 시점과 다른 경우 {failures}건")
+        return 1
+    print("✅ 모든 표본 시점 복원 결과 일치")
+    return 0
+
+
+SEARCH_TOPICS = ("트리 순회", "해시 테이블", "동적 계획법", "그래프 탐색", "정렬 알고리즘", "스택과 큐", "프로세스 스케줄링",
+                 "가상 메모리", "TCP handshake", "정규화", "트랜잭션", "Python 실습")
+
+
+def bench_search(args):
+    rng = random.Random(args.seed)
+    db_path = os.path.join(BENCH_DIR, "search.db")
+    announcement_db, assignment_db = lms.AnnouncementDB(db_path), lms.AssignmentDB(db_path)
+    search_index = announcement_db.search_index
+    if search_index is None:
+        print("SQLite FTS5를 사용할 수 없습니다")
+        return 1
+    announcement_rows, assignment_rows, lectures = [], [], []
+    for semester in range(args.semesters):
+        for course in range(args.courses):
+            course_name = f"{2023 + semester // 2}-{semester % 2 + 1} 과목{course}"
+            for index in range(args.announcements):
+                body = semester_body(rng, rng.choice(SEARCH_TOPICS), 1)
+                announcement_rows.append((len(announcement_rows) + 1, semester * 100 + course, course_name,
+                                          f"{index + 1}주차 공지", body, None))
+            for index in range(args.assignments):
+                body = semester_body(rng, rng.choice(SEARCH_TOPICS), 2)
+                assignment_rows.append((len(assignment_rows) + 1, semester * 100 + course, course_name,
+                                        f"{index + 1}주차 과제", None, None, body, None))
+            for index in range(args.pdfs):
+                pages = [lms.html_plain_text(semester_body(rng, rng.choice(SEARCH_TOPICS), 1.5))
+                         for _ in range(args.pdf_pages)]
+                lectures.append((f"{semester}-{course}-{index}", course_name, f"{index + 1}주차 강의.pdf", "\f".join(pages)))
+    # 드물게 나오는 단어: 강의자료 한 개의 마지막 페이지에만 넣음
+    digest, course_name, file_name, text = lectures[len(lectures) // 2]
+    lectures[len(lectures) // 2] = (digest, course_name, file_name, text + " 레드블랙트리 삽입")
+
+    started = time.perf_counter()
+    announcement_db.set_database(announcement_rows)
+    assignment_db.set_database(assignment_rows)
+    with search_index.storage.transaction() as cur:
+        search_index.index_documents(cur, "lecture", lectures)
+    build_seconds = time.perf_counter() - started
+    text_bytes = sum(len(text.encode("utf-8")) for *_, text in lectures) + sum(
+        len(lms.html_plain_text(row[4]).encode("utf-8")) for row in announcement_rows) + sum(
+        len(lms.html_plain_text(row[6]).encode("utf-8")) for row in assignment_rows)
+
+    # 다시 색인: 바뀌지 않은 행은 건너뛰고, 1%만 바뀐 경우 그 문서만 다시 색인
+    changed_rows = list(announcement_rows)
+    for index in rng.sample(range(len(changed_rows)), max(1, len(changed_rows) // 100)):
+        row = changed_rows[index]
+        changed_rows[index] = row[:4] + (row[4] + "<p>시험 범위 변경</p>",) + row[5:]
+    reindex = []
+    for rows in (announcement_rows, changed_rows):
+        before = dict(search_index.storage.con.execute("SELECT id, content_hash || indexed_at FROM search_doc"))
+        started = time.perf_counter()
+        announcement_db.set_database(rows)
+        seconds = time.perf_counter() - started
+        after = dict(search_index.storage.con.execute("SELECT id, content_hash || indexed_at FROM search_doc"))
+        reindex.append((seconds, sum(before.get(doc_id) != value for doc_id, value in after.items())))
+
+    # 비교용: 평문 전체를 LIKE로 훑는 방식
+    naive = sqlite3.connect(os.path.join(BENCH_DIR, "search_naive.db"))
+    naive.execute("CREATE TABLE IF NOT EXISTS doc (title TEXT, body TEXT)")
+    naive.executemany("INSERT INTO doc VALUES (?, ?)", [(title, text) for _, _, title, text in lectures] + [
+        (row[3], lms.html_plain_text(row[4])) for row in changed_rows] + [
+        (row[3], lms.html_plain_text(row[6])) for row in assignment_rows])
+    naive.commit()
+
+    index_bytes = sum(size for size, in search_index.storage.con.execute(
+        "SELECT pgsize FROM dbstat WHERE name LIKE 'search_%'"))
+    print(f"{args.semesters}학기 x 과목 {args.courses}개: 공지 {len(announcement_rows)}개, 과제 {len(assignment_rows)}개, "
+          f"강의자료 {len(lectures)}개 (평문 {text_bytes / 1024 / 1024:.1f}MB)")
+    print(f"처음 색인      : {build_seconds:.2f}s, 색인 크기 {index_bytes / 1024 / 1024:.1f}MB (본문 압축 사본 포함)")
+    print(f"다시 색인      : 변경 없음 {reindex[0][0] * 1000:.1f}ms (색인 {reindex[0][1]}건), "
+          f"공지 1% 변경 {reindex[1][0] * 1000:.1f}ms (색인 {reindex[1][1]}건)")
+    failures = []
+    # "블"/"리"처럼 한 글자 검색은 bigram의 둘째 글자(테이블, 트리)로 나오는 곳도 LIKE와 같이 찾아야 함
+    for query in ("레드블랙트리", "해시 테이블", "시험 범위 변경", "handshake", "과제 제출 기한", "블", "리"):
+        times = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            hits = search_index.search(query, limit=10)
+            times.append(time.perf_counter() - started)
+        total = search_index.storage.con.execute(
+            "SELECT COUNT(*) FROM search_index WHERE search_index MATCH ?", (lms.search_match_query(query),)).fetchone()[0]
+        started = time.perf_counter()
+        like_terms = query.split()
+        naive_count = naive.execute("SELECT COUNT(*) FROM doc WHERE " + " AND ".join(
+            "(title LIKE ? OR body LIKE ?)" for _ in like_terms), [f"%{term}%" for term in like_terms for _ in range(2)]
+        ).fetchone()[0]
+        naive_seconds = time.perf_counter() - started
+        times.sort()
+        print(f"{query:12}: FTS5 상위 {len(hits)}/{total}건 중앙값 {times[len(times) // 2] * 1000:6.2f}ms "
+              f"(최대 {times[-1] * 1000:6.2f}ms), LIKE 전체 훑기 {naive_count}건 {naive_seconds * 1000:7.1f}ms")
+        if total != naive_count:
+            failures.append(f"'{query}' 검색 결과 수가 다릅니다 (FTS5 {total}, LIKE {naive_count})")
+    if reindex[0][1] != 0 or reindex[1][1] != max(1, len(changed_rows) // 100):
+        failures.append(f"다시 색인한 문서 수가 바뀐 문서 수와 다릅니다 ({reindex[0][1]}, {reindex[1][1]})")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        return 1
+    print("✅ 검색 결과 수가 LIKE와 같고, 바뀐 문서만 다시 색인")
+    return 0
+
+
+def bench_commands(args):
+    rng = random.Random(args.seed)
+    db_path = os.path.join(BENCH_DIR, "commands.db")
+    assignment_db, announcement_db = lms.AssignmentDB(db_path), lms.AnnouncementDB(db_path)
+    lecture_db, course_db = lms.LectureDB(db_path), lms.CourseDB(db_path)
+    for db_class in (lms.AccountDB, lms.NotificationDB, lms.OutboxDB):
+        db_class(db_path)
+    now = datetime.now(timezone.utc)
+    course_rows, assignment_rows, announcement_rows, lecture_rows = [], [], [], []
+    for course in range(args.courses):
+        course_name = f"과목{course}"
+        course_rows.append((course, course_name, f"C{course}"))
+        for index in range(args.assignments):
+            due_at = now + timedelta(hours=rng.uniform(-24 * 90, 24 * 30))
+            assignment_rows.append((len(assignment_rows) + 1, course, course_name, f"{index + 1}주차 과제", None,
+                                    canvas_time(due_at), semester_body(rng, rng.choice(SEARCH_TOPICS), 1),
+                                    rng.random() < 0.7))
+        for index in range(args.announcements):
+            announcement_rows.append((len(announcement_rows) + 1, course, course_name, f"{index + 1}번째 공지",
+                                      semester_body(rng, rng.choice(SEARCH_TOPICS), 0.5),
+                                      canvas_time(now - timedelta(hours=rng.uniform(0, 24 * 120)))))
+        for index in range(args.files):
+            lecture_rows.append((course, course_name, f"{index + 1}주차 강의.pdf", rng.randint(100_000, 5_000_000)))
+    course_db.set_database(course_rows)
+    assignment_db.set_database(assignment_rows)
+    announcement_db.set_database(announcement_rows)
+    lecture_db.set_database(lecture_rows)
+    lecture_db.set_file_states([(course, file_name, None, None, canvas_time(now - timedelta(days=rng.uniform(0, 120))),
+                                 "application/pdf", None, None) for course, _, file_name, _ in lecture_rows])
+    lms.crawl_stats.record("cycle", seconds=12.3, calls=1)
+    lms.MetricsDB(db_path).save(datetime.now(lms.KST).strftime("%Y-%m-%d %H:%M:%S"), lms.crawl_stats.drain()[1])
+
+    bot = FakeTelegramBot()
+    reader = lms.CommandReader(db_path)
+    statements = []
+    reader.con.set_trace_callback(statements.append)
+    handler = lms.TelegramCommandHandler(bot, reader, lms.PollScheduler(quiet_hours=""))
+    chat = str(lms.chat_id)
+    # /files는 실제로 있는 과목으로 조회해야 목록 조회 경로가 측정됨 (없는 과목은 바로 반환)
+    commands = ["/due", "/recent 10", f"/files {course_rows[len(course_rows) // 2][1]}", "/search 해시 테이블", "/status"]
+    print(f"과목 {args.courses}개: 과제 {len(assignment_rows)}개, 공지 {len(announcement_rows)}개, "
+          f"강의자료 {len(lecture_rows)}개")
+
+    async def ask(command):
+        started = time.perf_counter()
+        reply = await handler.handle(chat, command)
+        return time.perf_counter() - started, reply
+
+    async def run_idle():
+        results = {}
+        for command in commands:
+            times = []
+            for _ in range(args.repeat):
+                seconds, reply = await ask(command)
+                times.append(seconds)
+            times.sort()
+            results[command] = (times[len(times) // 2], times[-1], reply)
+        return results
+
+    failures = []
+    for command, (median, worst, reply) in asyncio.run(run_idle()).items():
+        print(f"{command:18}: 중앙값 {median * 1000:6.2f}ms (최대 {worst * 1000:6.2f}ms), 응답 {len(reply)}자, "
+              f"첫 줄 '{reply.splitlines()[0][:40]}'")
+        if reply.startswith("❗"):
+            failures.append(f"{command} 응답 에러")
+
+    # 인덱스 확인: 과제/공지/강의자료를 전부 훑거나 정렬용 임시 B-tree를 만드는 조회가 없어야 함
+    # (/status의 행 수 세기, 검색의 bm25 정렬은 제외)
+    plans = set()
+    for statement in set(statements):
+        statement = " ".join(statement.split())
+        if not statement.startswith("SELECT") or statement.startswith("SELECT COUNT(*) FROM") or "search_" in statement:
+            continue
+        for *_, detail in reader.con.execute("EXPLAIN QUERY PLAN " + statement):
+            plans.add(detail)
+            if (detail.startswith("SCAN") and "INDEX" not in detail) or "TEMP B-TREE" in detail:
+                failures.append(f"인덱스를 쓰지 않는 조회: {detail} ← {statement[:80]}")
+    print("조회 계획      : " + "; ".join(sorted(plans)))
+
+    # 수집 주기의 DB 반영(공유 연결 트랜잭션)이 길게 걸리는 동안의 명령 응답 시간과 이벤트 루프 지연
+    async def run_during_upsert():
+        hold = threading.Event()
+
+        def long_upsert():
+            with assignment_db.storage.transaction() as cur:
+                cur.execute("UPDATE assignment SET submitted=submitted")
+                hold.set()
+                time.sleep(args.hold)
+
+        def shared_due():
+            with assignment_db.storage.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM assignment WHERE end_date > ? AND submitted=0", (canvas_time(now),))
+                return cur.fetchone()[0]
+
+        lag = []
+
+        async def ticker():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.005)
+                lag.append(time.perf_counter() - started - 0.005)
+
+        loop = asyncio.get_running_loop()
+        upsert = loop.run_in_executor(None, long_upsert)
+        await loop.run_in_executor(None, hold.wait)
+        tick = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        replies = [await ask(command) for command in commands]
+        command_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        await loop.run_in_executor(None, shared_due)
+        shared_seconds = time.perf_counter() - started
+        await upsert
+        tick.cancel()
+        return command_seconds, replies, shared_seconds, max(lag, default=0)
+
+    command_seconds, replies, shared_seconds, max_lag = asyncio.run(run_during_upsert())
+    print(f"DB 반영 {args.hold:.1f}초 중: 명령 {len(commands)}개 {command_seconds * 1000:.1f}ms "
+          f"(최대 {max(seconds for seconds, _ in replies) * 1000:.1f}ms), 이벤트 루프 최대 지연 {max_lag * 1000:.1f}ms / "
+          f"공유 연결로 읽으면 {shared_seconds * 1000:.0f}ms 대기")
+    if max(seconds for seconds, _ in replies) > args.hold / 2:
+        failures.append("DB 반영 중 명령 응답이 잠금을 기다렸습니다")
+    handler.close()
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        return 1
+    print("✅ 모든 명령이 인덱스 조회로 답하고, DB 반영 중에도 기다리지 않음")
+    return 0
+
+
+def make_sample_deck(pdf_path, pages, changed=(), revision=0, moved=(), grown=()):
+    """
+    페이지마다 제목/본문/도형이 있는 합성 강의자료 PDF 생성.
+    changed 페이지만 revision 반영, moved 페이지는 도형만 이동, grown 페이지는 작은 검은 상자만 30x30 → 30x60
+    """
+    doc = lms.pymupdf.open()
+    for index in range(pages):
+        page = doc.new_page()
+        suffix = f" (rev {revision})" if index in changed else ""
+        page.insert_text((72, 72), f"Lecture slide {index + 1}{suffix}", fontsize=24)
+        for line in range(20):
+            page.insert_text((72, 120 + line * 18), f"line {line}: lorem ipsum dolor sit amet {index}", fontsize=11)
+        rect = lms.pymupdf.Rect(300, 300, 528, 480) if index in moved else lms.pymupdf.Rect(72, 520, 300, 700)
+        page.draw_rect(rect, color=(0, 0, 1), fill=(0.8, 0.8, 1))
+        box_height = 60 if index in grown else 30
+        page.draw_rect(lms.pymupdf.Rect(450, 540, 480, 540 + box_height), color=(0, 0, 0), fill=(0, 0, 0))
+    doc.save(pdf_path)
+    doc.close()
+
+
+def bench_pdf(args):
+    if lms.pymupdf is None:
+        print("PyMuPDF(pymupdf)가 설치되어 있지 않습니다")
+        return 1
+    if args.old and args.new:
+        old_pdf, new_pdf = args.old, args.new
+    else:
+        old_pdf = os.path.join(BENCH_DIR, "old_deck.pdf")
+        new_pdf = os.path.join(BENCH_DIR, "new_deck.pdf")
+        changed = set(range(0, args.pages, max(1, args.pages // max(1, args.changed))))
+        make_sample_deck(old_pdf, args.pages)
+        make_sample_deck(new_pdf, args.pages, changed, revision=1)
+
+    started = time.perf_counter()
+    in_process, error = lms.diff_pdf_pages(old_pdf, new_pdf)
+    in_process_time = time.perf_counter() - started
+    print(f"in-process : {in_process_time:7.2f}s, changed={in_process}, error={error}")
+    if not (args.old and args.new):
+        # 텍스트는 같고 도형만 옮긴 페이지는 렌더링 비교로 찾아야 함 (dHash 잡음 무시에 걸리면 안 됨)
+        moved_pdf = os.path.join(BENCH_DIR, "moved_deck.pdf")
+        moved = sorted(changed)[:2]
+        make_sample_deck(moved_pdf, args.pages, moved=moved)
+        moved_pages, error = lms.diff_pdf_pages(old_pdf, moved_pdf)
+        print(f"shape only : changed={moved_pages}, error={error}")
+        if moved_pages != [lms.page_label(index, args.pages) for index in moved]:
+            print("❌ 도형만 바뀐 페이지를 찾지 못했습니다")
+            return 1
+        # 9x8 dHash로는 구분되지 않는 작은 그림 변경도 기본 설정에서 변경으로 보고해야 함
+        grown_pdf = os.path.join(BENCH_DIR, "grown_deck.pdf")
+        make_sample_deck(grown_pdf, args.pages, grown=moved)
+        grown_pages, error = lms.diff_pdf_pages(old_pdf, grown_pdf)
+        print(f"small figure: changed={grown_pages}, error={error}")
+        if grown_pages != [lms.page_label(index, args.pages) for index in moved]:
+            print("❌ 텍스트가 같고 작은 그림만 바뀐 페이지를 찾지 못했습니다")
+            return 1
+        # 페이지만 늘거나 줄어든 PDF도 변경으로 보고해야 함
+        short_pdf = os.path.join(BENCH_DIR, "short_deck.pdf")
+        make_sample_deck(short_pdf, 3)
+        long_pdf = os.path.join(BENCH_DIR, "long_deck.pdf")
+        make_sample_deck(long_pdf, 6)
+        added, error = lms.diff_pdf_pages(short_pdf, long_pdf)
+        removed, _ = lms.diff_pdf_pages(long_pdf, short_pdf)
+        print(f"page count : 3→6 {added}, 6→3 {removed}, error={error}")
+        if added != ["4-6 추가"] or removed != ["4-6 삭제"]:
+            print("❌ 추가/삭제된 페이지를 보고하지 않았습니다")
+            return 1
+
+    if shutil.which("pdftoppm") is None or shutil.which("compare") is None:
+        print("pdftoppm/compare가 없어 subprocess 방식 비교는 생략합니다")
+        return 0
+    os.makedirs(os.path.join(lms.linux_parent_path, "tmp"), exist_ok=True)
+    started = time.perf_counter()
+    subprocess_pages, error = lms.diff_pdf_pages_subprocess(old_pdf, new_pdf)
+    subprocess_time = time.perf_counter() - started
+    print(f"subprocess : {subprocess_time:7.2f}s, changed={subprocess_pages}, error={error}")
+    print(f"speedup    : {subprocess_time / in_process_time:7.2f}x")
+    if subprocess_pages != in_process:
+        print("❌ 변경 페이지 목록이 다릅니다")
+        return 1
+    return 0
+
+
+
+def bench_pdf_batch(args):
+    if lms.pymupdf is None:
+        print("PyMuPDF(pymupdf)가 설치되어 있지 않습니다")
+        return 1
+    tmp_dir = os.path.join(BENCH_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    pairs = []
+    for index in range(args.files):
+        old_pdf = os.path.join(BENCH_DIR, f"old_deck_{index}.pdf")
+        new_pdf = os.path.join(BENCH_DIR, f"new_deck_{index}.pdf")
+        make_sample_deck(old_pdf, args.pages)
+        make_sample_deck(new_pdf, args.pages, {index % args.pages}, revision=1)
+        pairs.append((index, old_pdf, new_pdf))
+
+    started = time.perf_counter()
+    serial = {index: lms.diff_pdf_pages(old_pdf, new_pdf) for index, old_pdf, new_pdf in pairs}
+    serial_time = time.perf_counter() - started
+    print(f"serial   : {serial_time:7.2f}s ({args.files} files x {args.pages} pages)")
+
+    async def run_pipeline():
+        results, first_result_at = {}, None
+        with lms.PdfDiffPipeline(tmp_dir, workers=args.workers, album=False) as pipeline:
+            for index, old_pdf, new_pdf in pairs:
+                pipeline.submit(index, old_pdf, new_pdf)
+            async for index, changed_pages, error, _ in pipeline.results():
+                first_result_at = first_result_at or time.perf_counter()
+                results[index] = (changed_pages, error)
+        return results, first_result_at
+
+    started = time.perf_counter()
+    pooled, first_result_at = asyncio.run(run_pipeline())
+    pooled_time = time.perf_counter() - started
+    print(f"pipeline : {pooled_time:7.2f}s (workers={args.workers or lms.PDF_DIFF_WORKERS}, "
+          f"첫 결과 {first_result_at - started:.2f}s)")
+    print(f"speedup  : {serial_time / pooled_time:7.2f}x")
+    if pooled != serial:
+        print("❌ 변경 페이지 목록이 다릅니다")
+        return 1
+    return 0
+
+class FakeTelegramBot:
+    """telegram.Bot 대신 보낸 메시지/사진 수만 기록 (latency로 전송 지연 흉내)"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = 0
+        self.photos = 0
+        self.text_bytes = 0
+
+    async def _deliver(self, text, photos=0):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.messages += 1
+        self.photos += photos
+        self.text_bytes += len((text or "").encode("utf-8"))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._deliver(text)
+
+    async def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        await self._deliver(caption, 1)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        await self._deliver(media[0].caption if media else "", len(media))
+
+    async def get_updates(self, offset=None, timeout=None, **kwargs):
+        """명령 수신 long polling 흉내: 받은 명령 없이 timeout 동안 대기"""
+        await asyncio.sleep(timeout or 0)
+        return ()
+
+    async def set_my_commands(self, commands, **kwargs):
+        return True
+
+
+def max_rss_kb():
+    """프로세스 최대 RSS (KB, resource 모듈이 없으면 None)"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def count_rows(table):
+    with sqlite3.connect(lms.db_path) as con:
+        return con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+async def run_e2e_cycle(label, server, bot, args):
+    """loop_main을 한 주기만 실행하고 서버/봇/측정값 차이를 모음"""
+    before = (server.request_count, server.download_count, server.errors_injected, server.ntfy_count,
+              server.bytes_sent, bot.messages, bot.photos)
+    if args.tracemalloc:
+        tracemalloc.start()
+    started, cpu_started = time.perf_counter(), time.process_time()
+    _, phases = await lms.loop_main(max_cycles=1)
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+    heap_peak = None
+    if args.tracemalloc:
+        heap_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    after = (server.request_count, server.download_count, server.errors_injected, server.ntfy_count,
+             server.bytes_sent, bot.messages, bot.photos)
+    requests_, downloads, errors, ntfy, sent, messages, photos = (b - a for a, b in zip(before, after))
+    by_phase = {}
+    for (phase, _), values in phases.items():
+        entry = by_phase.setdefault(phase, dict.fromkeys(lms.METRIC_FIELDS, 0))
+        for field in lms.METRIC_FIELDS:
+            entry[field] += values[field]
+    return {
+        "label": label,
+        "seconds": elapsed,
+        "cpu_seconds": cpu,  # 이 프로세스의 CPU 시간 (PDF 비교 프로세스와 가짜 서버 스레드 포함)
+        "requests": requests_,
+        "downloads": downloads,
+        "errors_injected": errors,
+        "retries": sum(values["retries"] for phase, values in by_phase.items() if phase != "telegram_send"),
+        "bytes_sent": sent,
+        "db_seconds": sum(by_phase.get(phase, {}).get("seconds", 0) for phase in ("db_upsert", "reminders")),
+        "telegram_messages": messages,
+        "telegram_photos": photos,
+        "ntfy": ntfy,
+        "max_rss_kb": max_rss_kb(),
+        "heap_peak_kb": None if heap_peak is None else heap_peak // 1024,
+        "phases": by_phase,
+    }
+
+
+def print_e2e_cycle(result):
+    rss = f"{result['max_rss_kb'] / 1024:.1f}MB" if result["max_rss_kb"] is not None else "-"
+    heap = f", 힙 피크 {result['heap_peak_kb'] / 1024:.1f}MB" if result["heap_peak_kb"] is not None else ""
+    print(f"[{result['label']}] {result['seconds']:.2f}s (CPU {result['cpu_seconds']:.2f}s), 요청 {result['requests']}건 "
+          f"(다운로드 {result['downloads']}, 주입 오류 {result['errors_injected']}, 재시도 {result['retries']}), "
+          f"전송 {result['bytes_sent'] / 1024:.1f}KB, DB {result['db_seconds'] * 1000:.0f}ms, "
+          f"텔레그램 {result['telegram_messages']}건(사진 {result['telegram_photos']}), ntfy {result['ntfy']}건, "
+          f"최대 RSS {rss}{heap}")
+    slowest = sorted(result["phases"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+    print("    " + ", ".join(f"{phase} {values['seconds']:.2f}s/{values['requests']}req"
+                             for phase, values in slowest if phase != "cycle"))
+
+
+def compare_baseline(results, baseline, tolerance):
+    """baseline(JSON)과 주기별 소요 시간/요청 수 비교. 반환: 회귀 목록"""
+    regressions = []
+    previous = {cycle["label"]: cycle for cycle in baseline["cycles"]}
+    for cycle in results:
+        old = previous.get(cycle["label"])
+        if old is None:
+            continue
+        for field in ("seconds", "cpu_seconds", "requests", "db_seconds"):
+            if old.get(field) and cycle[field] > old[field] * (1 + tolerance):
+                regressions.append(f"{cycle['label']} {field}: {old[field]:.3f} → {cycle[field]:.3f}")
+    return regressions
+
+
+def bench_e2e(args):
+    if args.pdf_files and lms.pymupdf is None:
+        print("PyMuPDF(pymupdf)가 없어 PDF 파일 없이 측정합니다")
+        args.pdf_files = 0
+    data = FakeCanvasData(args.courses, args.announcements, args.assignments, args.files,
+                          file_kb=args.file_kb, pdf_files=args.pdf_files, pdf_pages=args.pdf_pages)
+    bot = FakeTelegramBot(args.telegram_latency)
+    # 실제 텔레그램 전송 한도 대신 가짜 봇의 지연만 반영
+    lms.bot = bot
+    lms.TELEGRAM_MIN_INTERVAL = 0
+    lms.TELEGRAM_MAX_PER_MINUTE = 10 ** 9
+    lms.TELEGRAM_DIGEST_WINDOW = 0
+    results = []
+    with FakeCanvasServer(data, latency=args.latency, page_size=args.page_size,
+                          error_rate=args.error_rate, seed=args.seed) as server:
+        lms.API_URL = server.url
+        lms.NTFY_URL = f"{server.url}/ntfy"
+        print(f"과목 {args.courses}개 x (공지 {args.announcements}, 과제 {args.assignments}, 파일 {args.files}), "
+              f"페이지 크기 {args.page_size}, 지연 {args.latency * 1000:.0f}ms, 오류 비율 {args.error_rate:.0%}")
+        results.append(asyncio.run(run_e2e_cycle("cold", server, bot, args)))
+        print_e2e_cycle(results[-1])
+        results.append(asyncio.run(run_e2e_cycle("warm", server, bot, args)))
+        print_e2e_cycle(results[-1])
+        changed = data.apply_changes(args.changed_courses, args.file_kb)
+        # 메타데이터는 그대로인데 로컬에서 지워진 파일은 다시 받아야 함
+        lost_paths = [state["local_path"] for state in lms.LectureDB(lms.db_path).get_file_states()[0].values()
+                      if state["local_path"] and os.path.exists(state["local_path"])][-1:]
+        for lost_path in lost_paths:
+            os.remove(lost_path)
+        results.append(asyncio.run(run_e2e_cycle("changed", server, bot, args)))
+        print_e2e_cycle(results[-1])
+
+    failures = []
+    expected_files = sum(len(files) for files in data.files.values())
+    if results[0]["downloads"] != expected_files:
+        failures.append(f"처음 주기 다운로드 {results[0]['downloads']}건 (예상 {expected_files}건)")
+    if count_rows("lecture") != expected_files or count_rows("assignment") != sum(map(len, data.assignments.values())):
+        failures.append("DB 행 수가 가짜 Canvas 데이터와 다릅니다")
+    if results[1]["downloads"] or results[1]["telegram_messages"]:
+        failures.append("변경 없는 주기에 다운로드/알림이 발생했습니다")
+    if changed and not results[2]["telegram_messages"]:
+        failures.append("변경한 주기에 알림이 없습니다")
+    expected_downloads = sum(1 for course in data.courses[:args.changed_courses] if data.files[course["id"]]) + len(lost_paths)
+    if results[2]["downloads"] != expected_downloads:
+        failures.append(f"변경한 주기 다운로드 {results[2]['downloads']}건 (내용이 바뀐 파일과 로컬에서 지운 파일 "
+                        f"{expected_downloads}건, 이름만 바뀐 파일은 다시 받지 않아야 함)")
+    if any(not os.path.exists(lost_path) for lost_path in lost_paths):
+        failures.append("로컬에서 지운 파일을 다시 받지 않았습니다")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args) | {"func": None}, "cycles": results}, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"⚠️ 기준 대비 회귀: {regression}")
+        failures.extend(regressions)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        return 1
+    print("✅ 처음/변경 없음/변경 주기 결과 정상")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="LMS Bot 성능 측정")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    crawl = sub.add_parser("crawl", help="serial / concurrent 과목 수집 시간 비교")
+    crawl.add_argument("--courses", type=int, default=8)
+    crawl.add_argument("--announcements", type=int, default=10)
+    crawl.add_argument("--assignments", type=int, default=15)
+    crawl.add_argument("--files", type=int, default=20)
+    crawl.add_argument("--latency", type=float, default=0.05, help="요청당 서버 지연 (초)")
+    crawl.add_argument("--concurrency", type=int, default=lms.CRAWL_CONCURRENCY)
+    crawl.set_defaults(func=bench_crawl)
+
+    db = sub.add_parser("db", help="과제 테이블 반영 시간 비교 (행마다 autocommit vs 공유 연결 배치 트랜잭션)")
+    db.add_argument("--rows", type=int, default=3000)
+    db.add_argument("--changed", type=float, default=0.1, help="세 번째 주기에서 변경할 행 비율")
+    db.set_defaults(func=bench_db)
+
+    html = sub.add_parser("html", help="긴 과제 설명의 주기별 CPU 시간 비교 (알림마다 파싱 vs 저장 시 평문/해시)")
+    html.add_argument("--rows", type=int, default=500)
+    html.add_argument("--kb", type=int, default=8, help="과제 설명 HTML 크기 (KB)")
+    html.add_argument("--changed", type=float, default=0.1, help="마지막 주기에서 설명을 바꿀 행 비율")
+    html.set_defaults(func=bench_html)
+
+    diff = sub.add_parser("diff", help="본문 변경 알림 (한 단어/공백만/태그만 변경) 메시지 생성 시간과 길이")
+    diff.add_argument("--rows", type=int, default=200)
+    diff.add_argument("--kb", type=int, default=8, help="과제 설명 HTML 크기 (KB)")
+    diff.set_defaults(func=bench_diff)
+
+    history = sub.add_parser("history", help="한 학기 분량 공지/과제 수정의 이력 저장 용량과 복원 시간")
+    history.add_argument("--weeks", type=int, default=16)
+    history.add_argument("--courses", type=int, default=8)
+    history.add_argument("--announcements", type=int, default=2, help="과목마다 주당 새 공지 수")
+    history.add_argument("--assignments", type=int, default=1, help="과목마다 주당 새 과제 수")
+    history.add_argument("--kb", type=float, default=4, help="과제 설명 크기 (KB, 공지는 절반)")
+    history.add_argument("--edit-rate", type=float, default=0.3, help="주마다 과제가 수정될 확률 (공지는 절반)")
+    history.add_argument("--seed", type=int, default=0)
+    history.set_defaults(func=bench_history)
+
+    search = sub.add_parser("search", help="여러 학기 분량 공지/과제/강의자료 전문 검색 시간 (FTS5 vs LIKE)")
+    search.add_argument("--semesters", type=int, default=4)
+    search.add_argument("--courses", type=int, default=8)
+    search.add_argument("--announcements", type=int, default=20, help="과목마다 공지 수")
+    search.add_argument("--assignments", type=int, default=10, help="과목마다 과제 수")
+    search.add_argument("--pdfs", type=int, default=15, help="과목마다 강의자료 PDF 수")
+    search.add_argument("--pdf-pages", type=int, default=10)
+    search.add_argument("--repeat", type=int, default=20)
+    search.add_argument("--seed", type=int, default=0)
+    search.set_defaults(func=bench_search)
+    commands = sub.add_parser("commands", help="텔레그램 명령 응답 시간과 DB 반영 중 대기 여부")
+    commands.add_argument("--courses", type=int, default=8)
+    commands.add_argument("--assignments", type=int, default=60, help="과목마다 과제 수")
+    commands.add_argument("--announcements", type=int, default=120, help="과목마다 공지 수")
+    commands.add_argument("--files", type=int, default=60, help="과목마다 강의자료 수")
+    commands.add_argument("--hold", type=float, default=1.0, help="DB 반영 트랜잭션을 잡고 있을 시간 (초)")
+    commands.add_argument("--repeat", type=int, default=50)
+    commands.add_argument("--seed", type=int, default=0)
+    commands.set_defaults(func=bench_commands)
+
+    pdf = sub.add_parser("pdf", help="PDF 페이지 비교 시간 (프로세스 내 PyMuPDF vs pdftoppm/diff/compare)")
+    pdf.add_argument("--old", help="기존 PDF (없으면 합성 강의자료 생성)")
+    pdf.add_argument("--new", help="새 PDF")
+    pdf.add_argument("--pages", type=int, default=100)
+    pdf.add_argument("--changed", type=int, default=5, help="합성 강의자료에서 바꿀 페이지 수")
+    pdf.set_defaults(func=bench_pdf)
+
+    pdf_batch = sub.add_parser("pdf-batch", help="여러 PDF 비교 시간 (순차 vs 프로세스 풀 파이프라인)")
+    pdf_batch.add_argument("--files", type=int, default=8)
+    pdf_batch.add_argument("--pages", type=int, default=60)
+    pdf_batch.add_argument("--workers", type=int, default=None)
+    pdf_batch.set_defaults(func=bench_pdf_batch)
+
+    e2e = sub.add_parser("e2e", help="가짜 Canvas/텔레그램/ntfy로 loop_main 주기 전체 측정 (처음/변경 없음/변경)")
+    e2e.add_argument("--courses", type=int, default=8)
+    e2e.add_argument("--announcements", type=int, default=10)
+    e2e.add_argument("--assignments", type=int, default=15)
+    e2e.add_argument("--files", type=int, default=6)
+    e2e.add_argument("--file-kb", type=int, default=256, help="PDF가 아닌 파일 크기 (KB)")
+    e2e.add_argument("--pdf-files", type=int, default=1, help="과목마다 합성 강의자료 PDF 수 (PyMuPDF 필요)")
+    e2e.add_argument("--pdf-pages", type=int, default=20)
+    e2e.add_argument("--page-size", type=int, default=10, help="서버 최대 목록 페이지 크기 (0이면 한 번에)")
+    e2e.add_argument("--latency", type=float, default=0.02, help="요청당 서버 지연 (초)")
+    e2e.add_argument("--error-rate", type=float, default=0.0, help="429/503으로 응답할 요청 비율")
+    e2e.add_argument("--seed", type=int, default=0)
+    e2e.add_argument("--telegram-latency", type=float, default=0.05, help="가짜 텔레그램 전송 지연 (초)")
+    e2e.add_argument("--changed-courses", type=int, default=2, help="세 번째 주기에서 바꿀 과목 수")
+    e2e.add_argument("--tracemalloc", action="store_true", help="주기별 Python 힙 피크 측정 (느려짐)")
+    e2e.add_argument("--json", help="결과를 저장할 JSON 경로 (--baseline으로 비교)")
+    e2e.add_argument("--baseline", help="이전 --json 결과와 비교해 회귀가 있으면 실패")
+    e2e.add_argument("--tolerance", type=float, default=0.25, help="회귀로 볼 증가 비율")
+    e2e.set_defaults(func=bench_e2e)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
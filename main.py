@@ -12,9 +12,37 @@ from datetime import datetime, timezone, timedelta
 import subprocess
 import shutil  # 추가
 import requests
+import hashlib
+import difflib
+import re
+import json
+import zlib
+import httpx
+import threading
+import heapq
+import time
+from collections import deque, namedtuple
+import argparse
+import getpass
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import tempfile
+from urllib.parse import urlsplit
 from canvasapi.exceptions import CanvasException
 from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
 from urllib3.util.retry import Retry
+try:
+    import pymupdf  # 선택: 설치되어 있으면 PDF 비교를 프로세스 안에서 처리
+except ImportError:
+    pymupdf = None
+try:
+    import lxml.html  # 선택: 설치되어 있으면 BeautifulSoup 대신 lxml로 본문 평문을 추출 (약 10배 빠름)
+    import lxml.etree
+except ImportError:
+    lxml = None
 
 telegram_token = os.environ.get('TELEGRAM_TOKEN')
 chat_id = os.environ.get('CHAT_ID')
@@ -23,13 +51,14 @@ if telegram_token is None or chat_id is None:
     raise ValueError("환경변수 'TELEGRAM_TOKEN' 또는 'CHAT_ID'가 설정되지 않았습니다.")
 
 windows_path = r'C:\Users\barah\Desktop\Univ' # windows에서 실행 시
-linux_path = '/Univ/Univ/2-1/' # linux에서 실행 시
+linux_path = os.environ.get('LMS_FILE_PATH', '/Univ/Univ/2-1/') # linux에서 실행 시
 # linux_path = '/discord/Univ/2-1/' # linux에서 실행 시
-linux_parent_path = '/Univ/' # 로그 파일 저장 위치
+linux_parent_path = os.environ.get('LMS_PARENT_PATH', '/Univ/') # 로그 파일 저장 위치
 path = windows_path if os.name == 'nt' else linux_path # 사용 운영체제에 따라 경로 설정
 parent_path = linux_parent_path if os.name != 'nt' else windows_path
 logging.basicConfig(filename=os.path.join(linux_parent_path, 'lms.log'), level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s', encoding='utf-8')
-logging.info("LMS Bot 시작")
+if multiprocessing.parent_process() is None:  # PDF 비교 프로세스가 모듈을 다시 불러올 때는 기록하지 않음
+    logging.info("LMS Bot 시작")
 
 db_path = os.path.join(linux_parent_path, "LMS.db")
 API_URL = "https://canvas.kumoh.ac.kr"
@@ -38,16 +67,128 @@ KST = timezone(timedelta(hours=9))
 API_REQUEST_TIMEOUT = (10, 30)  # connect timeout, read timeout
 API_REQUEST_RETRIES = 3
 API_RETRY_BACKOFF_SECONDS = 5
+# 다른 사람과 겹치지 않는 고유한 토픽명을 설정하세요
+NTFY_URL = os.environ.get('NTFY_URL', 'https://ntfy.sh')
+NTFY_TOPIC = os.environ.get('NTFY_TOPIC', 'barah-univ-lms-2026')
+NTFY_PRIORITY = os.environ.get('NTFY_PRIORITY', 'default')  # min, low, default, high, max
+DOWNLOAD_CONCURRENCY = int(os.environ.get('LMS_DOWNLOAD_CONCURRENCY', '3'))  # 동시에 받을 파일 수
+DOWNLOAD_BANDWIDTH_LIMIT = float(os.environ.get('LMS_DOWNLOAD_BANDWIDTH_KB', '0')) * 1024  # 전체 다운로드 속도 제한 (0이면 제한 없음)
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+PDF_DIFF_DPI = int(os.environ.get('LMS_PDF_DIFF_DPI', '50'))  # 해시가 다른 페이지를 렌더링해 비교할 해상도
+PDF_DIFF_WORKERS = int(os.environ.get('LMS_PDF_DIFF_WORKERS', str(os.cpu_count() or 2)))  # PDF 비교 프로세스 수
+PDF_ALBUM_MAX_IMAGES = 10  # 텔레그램 앨범(media group) 최대 사진 수
+PDF_ALBUM_MAX_SIDE = int(os.environ.get('LMS_PDF_ALBUM_MAX_SIDE', '1280'))  # 비교 이미지 긴 변 최대 픽셀
+PDF_ALBUM_JPEG_QUALITY = int(os.environ.get('LMS_PDF_ALBUM_JPEG_QUALITY', '70'))
+PDF_ALBUM_CELL = 8  # 변경 영역을 찾는 칸 크기 (PDF_DIFF_DPI 렌더링 기준 픽셀)
+PDF_FINGERPRINT_CACHE_FILES = int(os.environ.get('LMS_PDF_FINGERPRINT_CACHE_FILES', '500'))  # 페이지 지문을 보관할 최대 PDF 수
+PDF_DHASH_NOISE_BITS = int(os.environ.get('LMS_PDF_DHASH_NOISE_BITS', '-1'))  # 텍스트가 같고 dHash 차이가 이 비트 수 이하면 렌더링 잡음으로 보고 무시 (-1이면 사용 안 함, 9x8 dHash는 작은 도형 변경을 구분하지 못함)
+TELEGRAM_MESSAGE_LIMIT = 4000  # 텔레그램 최대 4096자, 여유 포함
+TELEGRAM_MIN_INTERVAL = 1.0  # 같은 채팅방 연속 전송 최소 간격 (초)
+TELEGRAM_MAX_PER_MINUTE = 20  # 같은 채팅방 분당 최대 전송 수
+TELEGRAM_DIGEST_WINDOW = 3.0  # 새 메시지가 들어온 뒤 묶어서 보내기 위해 기다리는 시간 (초)
+TELEGRAM_MAX_ATTEMPTS = 8
+NOTIFY_FLUSH_TIMEOUT = 30.0  # loop_main(max_cycles) 종료 전 남은 알림을 보내며 기다릴 최대 시간 (초)
+DIFF_CONTEXT_LINES = int(os.environ.get('LMS_DIFF_CONTEXT_LINES', '1'))  # 본문 변경 알림에서 바뀐 줄 앞뒤로 보여 줄 줄 수
+DIFF_CONTEXT_CHARS = 40  # 바뀐 단어 앞뒤로 남길 글자 수
+DIFF_MAX_CHARS = 1500  # 본문 변경 내용 최대 길이
+DIFF_MAX_WORD_TOKENS = 3000  # 단어 단위로 비교할 블록의 최대 토큰 수 (넘으면 줄 단위로 표시)
+CRAWL_MODE = os.environ.get('LMS_CRAWL_MODE', 'concurrent')  # concurrent | serial
+CRAWL_CONCURRENCY = int(os.environ.get('LMS_CRAWL_CONCURRENCY', '4'))  # 동시에 실행할 Canvas 요청 작업 수
+CRAWL_RATE_LIMIT = float(os.environ.get('LMS_CRAWL_RATE_LIMIT', '5'))  # 호스트당 초당 최대 요청 수 (0이면 제한 없음)
+SYNC_MODE = os.environ.get('LMS_SYNC_MODE', 'incremental')  # incremental | full
+FULL_SYNC_INTERVAL = timedelta(hours=float(os.environ.get('LMS_FULL_SYNC_HOURS', '6')))  # 증분 수집 중 전체 재검증 주기
+SYNC_RESOURCES = ("announcements", "assignments", "files")
+ANNOUNCEMENT_RECHECK_COUNT = int(os.environ.get('LMS_ANNOUNCEMENT_RECHECK', '10'))  # 증분 수집 때 커서 이전이어도 다시 비교할 최근 공지 수 (본문 수정 확인용)
+REMINDER_OFFSETS = os.environ.get('LMS_REMINDER_OFFSETS', '72h,24h,3h,1h')  # 미제출 과제 마감 몇 시간(h)/분(m)/일(d) 전에 알릴지
+POLL_INTERVALS = {"announcements": 600.0, "assignments": 600.0, "files": 1800.0}  # 리소스별 기본 수집 간격 (초)
+POLL_INTERVALS.update(  # 예: LMS_POLL_INTERVALS="announcements=300,files=3600"
+    (name.strip(), float(seconds)) for name, seconds in
+    (part.split("=", 1) for part in os.environ.get('LMS_POLL_INTERVALS', '').split(",") if "=" in part))
+POLL_URGENT_WINDOW = timedelta(hours=float(os.environ.get('LMS_POLL_URGENT_HOURS', '48')))  # 미제출 과제 마감이 이 안에 있으면 자주 수집
+POLL_URGENT_INTERVAL = float(os.environ.get('LMS_POLL_URGENT_SECONDS', '180'))
+POLL_IDLE_AFTER = timedelta(days=float(os.environ.get('LMS_POLL_IDLE_DAYS', '14')))  # 이 기간 동안 바뀐 항목이 없으면 드물게 수집
+POLL_IDLE_FACTOR = 4
+POLL_MAX_INTERVAL = 3 * 3600.0
+POLL_MIN_SLEEP = 30.0
+QUIET_HOURS = os.environ.get('LMS_QUIET_HOURS', '2-6')  # 수집하지 않는 시간대 (KST, 예: "1-7", "23-6", 빈 값이면 없음)
+HTTP_CACHE_ENABLED = os.environ.get('LMS_HTTP_CACHE', '1') != '0'  # Canvas API 조건부 요청(ETag/Last-Modified) 사용 여부
+HTTP_CACHE_MAX_AGE = timedelta(days=float(os.environ.get('LMS_HTTP_CACHE_DAYS', '14')))  # 이 기간 동안 쓰지 않은 캐시는 삭제
+METRICS_MAX_AGE = timedelta(days=float(os.environ.get('LMS_METRICS_DAYS', '30')))  # 수집 주기 측정값 보관 기간
+OUTBOX_MAX_AGE = timedelta(days=float(os.environ.get('LMS_OUTBOX_DAYS', '7')))  # 전송 완료/포기한 텔레그램 outbox 행 보관 기간
+OUTBOX_PRUNE_INTERVAL = 3600  # 디스패처가 오래된 outbox 행을 정리하는 간격 (초)
+METRICS_PORT = int(os.environ.get('LMS_METRICS_PORT', '0'))  # Prometheus 형식 측정값을 제공할 로컬 포트 (0이면 사용 안 함)
+HISTORY_ENABLED = os.environ.get('LMS_HISTORY', '1') != '0'  # 공지/과제 변경 이력(revision 테이블) 저장 여부
+HISTORY_MAX_DELTA_CHAIN = 16  # 이전 리비전 기준 delta를 연속으로 쌓을 최대 단계 (넘으면 전체 압축본 저장)
+HISTORY_TEXT_CACHE = 128  # 복원한 리비전 본문을 메모리에 둘 개수
+SEARCH_ENABLED = os.environ.get('LMS_SEARCH', '1') != '0'  # 공지/과제/강의자료 전문 검색 색인(search_index) 사용 여부
+SEARCH_PDF_BATCH = int(os.environ.get('LMS_SEARCH_PDF_BATCH', '20'))  # 주기마다 본문을 추출해 색인할 최대 PDF 수
+SEARCH_SNIPPET_CHARS = 40  # 검색 결과에서 찾은 단어 앞뒤로 보여 줄 글자 수
+SEARCH_TOKENIZER_VERSION = 2  # search_tokens() 규칙 버전 (다르면 저장된 평문으로 색인을 다시 만듦)
+TELEGRAM_COMMANDS = os.environ.get('LMS_TELEGRAM_COMMANDS', '1') != '0'  # 텔레그램 명령(/due, /recent, /files, /status, /search) 응답 여부
+TELEGRAM_POLL_TIMEOUT = 30  # 명령 수신 long polling 대기 시간 (초)
+COMMAND_LIST_LIMIT = 15  # 명령 응답 목록의 최대 항목 수
+COMMAND_MAX_AGE = timedelta(minutes=10)  # 이보다 오래된 명령은 답하지 않음 (봇이 꺼져 있던 동안 쌓인 명령)
+METRIC_FIELDS = ("seconds", "calls", "requests", "bytes", "retries")
 
-def send_ntfy_signal(message, priority="default"):
-    """ntfy.sh로 푸시 알림 및 윈도우 동기화 신호 전송"""
-    # 다른 사람과 겹치지 않는 고유한 토픽명을 설정하세요
-    topic = "barah-univ-lms-2026"
-    url = f"https://ntfy.sh/{topic}"
+class NtfyNotifier:
+    """
+    ntfy 신호를 큐에 넣고 백그라운드에서 전송 (fire-and-forget).
+    하나의 httpx.AsyncClient로 keep-alive 연결을 재사용하고, 신호마다 대기+전송 지연 시간을 기록
+    """
+    def __init__(self, url=None, topic=None, priority=None):
+        self.url = f"{url or NTFY_URL}/{topic or NTFY_TOPIC}"
+        self.priority = priority or NTFY_PRIORITY
+        self.queue = asyncio.Queue()
+        self.stats = {"sent": 0, "failed": 0, "latency_total": 0.0, "latency_max": 0.0}
+
+    def enqueue(self, message, priority=None):
+        self.queue.put_nowait((message, priority or self.priority, time.monotonic()))
+
+    async def _send(self, client, message, priority, queued_at):
+        headers = {
+            "Title": "LMS Bot Notification",
+            "Priority": priority, # min, low, default, high, max
+            "Encoding": "utf-8"
+        }
+        try:
+            # ntfy는 POST 요청의 Body 데이터를 알림 내용으로 사용합니다.
+            response = await client.post(self.url, content=message.encode('utf-8'), headers=headers)
+        except Exception as e:
+            self.stats["failed"] += 1
+            logging.error(f"❌ ntfy 전송 중 에러 발생: {e}")
+            return
+        latency = time.monotonic() - queued_at
+        if response.status_code == 200:
+            self.stats["sent"] += 1
+            self.stats["latency_total"] += latency
+            self.stats["latency_max"] = max(self.stats["latency_max"], latency)
+            logging.info(f"📢 ntfy 신호 전송 성공 ({latency * 1000:.0f}ms)")
+        else:
+            self.stats["failed"] += 1
+            logging.warning(f"⚠️ ntfy 전송 실패 (Status: {response.status_code})")
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=4, max_keepalive_connections=4)
+        async with httpx.AsyncClient(timeout=5, limits=limits) as client:
+            while True:
+                message, priority, queued_at = await self.queue.get()
+                try:
+                    await self._send(client, message, priority, queued_at)
+                finally:
+                    self.queue.task_done()
+
+ntfy_notifier = None  # loop_main에서 NtfyNotifier 실행 시 설정
 
+def send_ntfy_signal(message, priority=None):
+    """ntfy.sh로 푸시 알림 및 윈도우 동기화 신호 전송 (NtfyNotifier가 실행 중이면 큐에 넣고 바로 반환)"""
+    if ntfy_notifier is not None:
+        ntfy_notifier.enqueue(message, priority)
+        return
+
+    url = f"{NTFY_URL}/{NTFY_TOPIC}"
     headers = {
         "Title": "LMS Bot Notification",
-        "Priority": priority, # min, low, default, high, max
+        "Priority": priority or NTFY_PRIORITY, # min, low, default, high, max
         "Encoding": "utf-8"
     }
 
@@ -81,19 +222,181 @@ if API_KEY is None:
 
 bot = telegram.Bot(token=telegram_token)
 
-async def send_telegram_message(message):
-    await bot.send_message(chat_id=chat_id, text=message)
+telegram_dispatcher = None  # loop_main에서 TelegramDispatcher 실행 시 설정
+course_chats = {}  # 여러 계정 모드: 과목명 -> 그 과목을 듣는 계정들의 채팅방 ID (main에서 주기마다 갱신)
+
+def message_targets(course_name=None, target_chat_id=None):
+    """알림을 보낼 채팅방 목록: 지정한 채팅방 > 과목을 듣는 계정들의 채팅방 > 기본 CHAT_ID"""
+    if target_chat_id is not None:
+        return [target_chat_id]
+    return course_chats.get(course_name) or [chat_id]
+
+def enqueue_telegram_message(message, course_name=None, target_chat_id=None):
+    """
+    디스패처가 실행 중이면 outbox에 동기적으로 기록하고 True (await가 없어 DB 트랜잭션 안에서 써도 됨),
+    디스패처가 없으면 아무것도 하지 않고 False
+    """
+    if telegram_dispatcher is None:
+        return False
+    for target in message_targets(course_name, target_chat_id):
+        telegram_dispatcher.enqueue(message, course_name, chat_id=target)
+    return True
+
+async def send_telegram_message(message, course_name=None, target_chat_id=None):
+    """
+    디스패처가 실행 중이면 outbox에 넣고 바로 반환 (전송은 백그라운드에서 묶음/속도 제한/재시도 처리),
+    아니면 즉시 전송. course_name이 같은 메시지는 디스패처가 하나의 요약 메시지로 합칠 수 있음
+    """
+    if enqueue_telegram_message(message, course_name, target_chat_id):
+        return
+    for target in message_targets(course_name, target_chat_id):
+        await bot.send_message(chat_id=target, text=message)
+
+async def send_album(target_bot, target_chat_id, caption, media):
+    """
+    media: [{"path", "caption"}] - 사진 한 장은 send_photo, 여러 장은 하나의 media group으로 전송.
+    caption은 첫 사진에 붙이고, 이미지 파일이 모두 사라졌으면 글만 보냄
+    """
+    media = [item for item in media if os.path.exists(item["path"])]
+    if not media:
+        await target_bot.send_message(chat_id=target_chat_id, text=caption)
+        return
+    photos = []
+    for index, item in enumerate(media):
+        with open(item["path"], "rb") as f:
+            data = f.read()
+        text = f"{caption}\n{item['caption']}" if index == 0 else item["caption"]
+        photos.append((data, truncate_text(text, 1000)))
+    if len(photos) == 1:
+        await target_bot.send_photo(chat_id=target_chat_id, photo=photos[0][0], caption=photos[0][1])
+    else:
+        await target_bot.send_media_group(chat_id=target_chat_id, media=[
+            telegram.InputMediaPhoto(media=data, caption=text) for data, text in photos])
+
+def remove_album_files(media):
+    """전송했거나 포기한 앨범의 이미지와 (비었으면) 앨범 디렉터리 삭제"""
+    for item in media or []:
+        try:
+            os.remove(item["path"])
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(os.path.dirname(item["path"]))
+        except OSError:
+            pass
+
+def link_album_files(media, suffix):
+    """같은 앨범을 여러 채팅방에 보낼 때 채팅방마다 따로 정리할 수 있도록 이미지를 하드 링크(안 되면 복사)"""
+    copies = []
+    for item in media:
+        root, ext = os.path.splitext(item["path"])
+        path = f"{root}-{suffix}{ext}"
+        try:
+            os.link(item["path"], path)
+        except OSError:
+            shutil.copyfile(item["path"], path)
+        copies.append(dict(item, path=path))
+    return copies
+
+async def send_telegram_album(caption, media, course_name=None):
+    """PDF 비교 이미지 앨범 전송. 디스패처가 있으면 outbox에 넣어 순서/재시도를 맡김"""
+    targets = message_targets(course_name)
+    albums = [media] + [link_album_files(media, index) for index in range(1, len(targets))]
+    for target, album in zip(targets, albums):
+        if telegram_dispatcher is not None:
+            telegram_dispatcher.enqueue(caption, course_name, chat_id=target, media=album)
+            continue
+        try:
+            await send_album(bot, target, caption, album)
+        finally:
+            remove_album_files(album)
+
+class HostRateLimiter:
+    """호스트별로 요청 간격을 최소 1/rate 초로 유지 (여러 스레드에서 공유)"""
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def acquire(self, host: str) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
 class TimeoutHTTPAdapter(HTTPAdapter):
-    def __init__(self, *args, timeout=API_REQUEST_TIMEOUT, **kwargs):
+    """
+    기본 timeout, 호스트별 요청 속도 제한, (http_cache가 있으면) Canvas API GET 응답의 조건부 요청 처리.
+    캐시된 응답이 있으면 If-None-Match/If-Modified-Since를 붙여 보내고, 304면 저장해 둔 본문으로 200 응답을 만들어 돌려줌
+    """
+    def __init__(self, *args, timeout=API_REQUEST_TIMEOUT, rate_limiter=None, http_cache=None, **kwargs):
         self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.http_cache = http_cache
         super().__init__(*args, **kwargs)
 
+    def cacheable(self, request, stream=False):
+        """Canvas API 목록/조회 GET만 캐시 (파일 다운로드처럼 stream/Range 요청은 제외)"""
+        return (self.http_cache is not None and request.method == "GET" and not stream
+                and "Range" not in request.headers and urlsplit(request.url).path.startswith("/api/v1/"))
+
     def send(self, request, **kwargs):
         kwargs.setdefault("timeout", self.timeout)
-        return super().send(request, **kwargs)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(urlsplit(request.url).netloc)
+        if not self.cacheable(request, kwargs.get("stream", False)):
+            response = super().send(request, **kwargs)
+            # stream 응답(파일 다운로드)의 본문 크기는 FileDownloader가 받으면서 기록
+            self.record_request(response, 0 if kwargs.get("stream") else len(response.content))
+            return response
+
+        cache_key = HttpCacheDB.cache_key(request)
+        entry = self.http_cache.get(cache_key)
+        if entry is not None:
+            if entry["etag"]:
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+        response = super().send(request, **kwargs)
+        self.record_request(response, len(response.content))
+
+        if response.status_code == 304 and entry is not None:
+            crawl_stats.add("http_cache_hits")
+            crawl_stats.add("http_cache_bytes_saved", entry["body_size"])
+            self.http_cache.record_hit(cache_key, entry["body_size"])
+            return self.cached_response(response, entry)
+        crawl_stats.add("http_cache_misses")
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if response.status_code == 200 and (etag or last_modified):
+            self.http_cache.put(cache_key, etag, last_modified, dict(response.headers), response.content)
+        return response
+
+    @staticmethod
+    def record_request(response, received_bytes):
+        """요청 수/받은 바이트/urllib3 Retry가 다시 보낸 횟수를 현재 측정 단계에 기록"""
+        retries = getattr(getattr(response.raw, "retries", None), "history", None) or ()
+        crawl_stats.record_request(received_bytes, len(retries))
 
-def configure_canvas_session(session):
+    @staticmethod
+    def cached_response(response, entry):
+        """304 응답을 캐시된 본문/헤더(Link 페이지 정보 포함)의 200 응답으로 바꿈"""
+        response.content  # 빈 본문을 읽어 연결을 풀에 반환
+        headers = CaseInsensitiveDict(entry["headers"])
+        for name in ("ETag", "Last-Modified", "Date"):
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = headers
+        response.encoding = get_encoding_from_headers(headers)
+        response._content = entry["body"]
+        return response
+
+def configure_canvas_session(session, http_cache=None):
     retry = Retry(
         total=API_REQUEST_RETRIES,
         connect=API_REQUEST_RETRIES,
@@ -104,17 +407,35 @@ def configure_canvas_session(session):
         allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
         raise_on_status=False,
     )
-    adapter = TimeoutHTTPAdapter(max_retries=retry)
+    adapter = TimeoutHTTPAdapter(
+        max_retries=retry,
+        rate_limiter=HostRateLimiter(CRAWL_RATE_LIMIT),
+        http_cache=http_cache,
+        pool_maxsize=max(10, CRAWL_CONCURRENCY),
+    )
     session.mount("https://", adapter)
     session.mount("http://", adapter)
 
 async def get_planner_items(session, url, headers, params):
+    """planner/items 전체 (Link 헤더의 rel="next"를 따라 모든 페이지). 실패하면 빈 목록"""
+    items = []
+    while url:
+        page = await get_planner_page(session, url, headers, params)
+        if page is None:
+            return []
+        data, url = page
+        items.extend(data)
+        params = None  # 다음 페이지 URL에 쿼리가 포함됨
+    return items
+
+async def get_planner_page(session, url, headers, params):
+    """반환: (항목 목록, 다음 페이지 URL 또는 None), 실패하면 None"""
     last_error = None
     for attempt in range(1, API_REQUEST_RETRIES + 1):
         try:
             response = session.get(url, headers=headers, params=params, timeout=API_REQUEST_TIMEOUT)
             response.raise_for_status()
-            return response.json()
+            return response.json(), response.links.get("next", {}).get("url")
         except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
             last_error = e
             logging.warning(f"Canvas planner 요청 연결 실패 ({attempt}/{API_REQUEST_RETRIES}): {e}")
@@ -123,49 +444,58 @@ async def get_planner_items(session, url, headers, params):
             status_code = e.response.status_code if e.response is not None else None
             if status_code is not None and status_code < 500 and status_code != 429:
                 logging.error(f"Canvas planner 요청 실패(status={status_code}), 재시도하지 않음: {e}")
-                return []
+                return None
             logging.warning(f"Canvas planner 요청 HTTP 실패 ({attempt}/{API_REQUEST_RETRIES}): {e}")
         except requests.exceptions.RequestException as e:
             last_error = e
             logging.warning(f"Canvas planner 요청 실패 ({attempt}/{API_REQUEST_RETRIES}): {e}")
         except ValueError as e:
             logging.error(f"Canvas planner 응답 JSON 파싱 실패: {e}")
-            return []
+            return None
 
         if attempt < API_REQUEST_RETRIES:
+            crawl_stats.record_retry()
             await asyncio.sleep(API_RETRY_BACKOFF_SECONDS * attempt)
 
     logging.error(f"Canvas planner 요청 재시도 실패, 이번 planner 알림은 건너뜁니다: {last_error}")
-    return []
+    return None
 
 def parse_canvas_dt(s: str | None):
     if not s:
         return None
     return datetime.fromisoformat(s.replace("Z", "+00:00"))  # aware(UTC)
 
-def decide_d_day(now_kst: datetime, due_at_utc, has_submitted: bool):
-    """
-    반환: 3/1/0 중 하나 또는 None
-    규칙:
-      - unlock_at이 None 이거나 now < unlock → None (스킵)
-      - has_submitted True → None (스킵)
-      - now > due → None (스킵)
-      - KST 날짜 기준으로 D-값 계산하여 {3,1,0}이면 그 값을 반환
-    """
-    if has_submitted:
-        return None
-    if due_at_utc is None:
-        return None
-
-    due_kst    = due_at_utc.astimezone(KST)
+def parse_reminder_offsets(spec):
+    """'72h,24h,3h,1h' → [4320, 1440, 180, 60] (분, 큰 순서). 단위가 없으면 시간"""
+    units = {"d": 1440, "h": 60, "m": 1}
+    offsets = set()
+    for part in spec.split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        unit = units.get(part[-1])
+        offsets.add(int(float(part[:-1]) * unit) if unit else int(float(part) * 60))
+    return sorted(offsets, reverse=True)
 
-    if now_kst > due_kst:
-        return None
+def reminder_label(offset_minutes):
+    """4320 → 'D-3', 180 → '3시간 전', 30 → '30분 전'"""
+    if offset_minutes == 0:
+        return "D-day"
+    if offset_minutes % 1440 == 0:
+        return f"D-{offset_minutes // 1440}"
+    if offset_minutes % 60 == 0:
+        return f"{offset_minutes // 60}시간 전"
+    return f"{offset_minutes}분 전"
 
-    d_days = (due_kst.date() - now_kst.date()).days
-    if d_days in (3, 1, 0):
-        return d_days
-    return None
+def remaining_label(seconds):
+    """남은 시간: 200000 → '2일 7시간', 5400 → '1시간 30분', 600 → '10분'"""
+    minutes = max(0, int(seconds // 60))
+    days, hours, minutes = minutes // 1440, minutes % 1440 // 60, minutes % 60
+    if days:
+        return f"{days}일 {hours}시간" if hours else f"{days}일"
+    if hours:
+        return f"{hours}시간 {minutes}분" if minutes else f"{hours}시간"
+    return f"{minutes}분"
 
 def planner_submission_status(item):
     submissions = item.get("submissions")
@@ -179,6 +509,76 @@ def planner_submission_status(item):
         )
     return bool(submissions)
 
+def submission_status(submission):
+    """Canvas submission(dict 또는 객체)의 제출 여부. 정보가 없으면 None"""
+    if submission is None:
+        return None
+    if isinstance(submission, dict):
+        get = submission.get
+    else:
+        get = lambda key: getattr(submission, key, None)
+    return bool(get("submitted_at") or get("workflow_state") in {"submitted", "graded", "pending_review"})
+
+class CrawlStats:
+    """
+    수집 중 여러 스레드에서 올리는 카운터와 단계별 측정값 (주기마다 drain/reset).
+    phases: {(단계, 과목명 또는 ""): {seconds, calls, requests, bytes, retries}}
+      - phase() 블록 안에서 같은 스레드가 보낸 HTTP 요청은 그 단계/과목으로 집계됨 (TimeoutHTTPAdapter가 기록)
+      - 블록 밖의 요청은 ("other", "")로 집계
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counts = {}
+        self.phases = {}
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def get(self, name):
+        with self._lock:
+            return self.counts.get(name, 0)
+
+    def record(self, phase, course_name=None, **values):
+        with self._lock:
+            entry = self.phases.setdefault((phase, course_name or ""), dict.fromkeys(METRIC_FIELDS, 0))
+            for field, value in values.items():
+                entry[field] += value
+
+    def current_phase(self):
+        return getattr(self._local, "phase", None) or ("other", None)
+
+    @contextmanager
+    def phase(self, name, course_name=None):
+        """블록의 소요 시간을 (단계, 과목)에 더하고, 블록 안에서 이 스레드가 보낸 요청을 그 단계로 집계"""
+        previous = getattr(self._local, "phase", None)
+        self._local.phase = (name, course_name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.phase = previous
+            self.record(name, course_name, seconds=time.perf_counter() - started, calls=1)
+
+    def record_request(self, received_bytes=0, retries=0):
+        self.record(*self.current_phase(), requests=1, bytes=received_bytes, retries=retries)
+
+    def record_retry(self, retries=1):
+        self.record(*self.current_phase(), retries=retries)
+
+    def drain(self):
+        """지금까지의 (counts, phases)를 반환하고 초기화"""
+        with self._lock:
+            snapshot = (self.counts, self.phases)
+            self.counts, self.phases = {}, {}
+        return snapshot
+
+    def reset(self):
+        self.drain()
+
+crawl_stats = CrawlStats()
+
 def to_str(dt):
     if dt is None: return None
     if isinstance(dt, str): return dt
@@ -195,21 +595,224 @@ def truncate_text(text, limit=700):
         return text
     return text[:limit].rstrip() + "..."
 
-def html_to_text(html):
+def html_plain_text(html):
+    """HTML 본문의 정규화된 평문 (블록마다 줄바꿈, 앞뒤 공백 제거). 비어 있으면 빈 문자열"""
     if not html:
-        return "없음"
-    return BeautifulSoup(html, 'html.parser').get_text("\n", strip=True) or "없음"
+        return ""
+    if lxml is not None:
+        try:
+            root = lxml.html.fragment_fromstring(html, create_parent="div")
+        except (ValueError, lxml.etree.ParserError):
+            pass
+        else:
+            # BeautifulSoup get_text와 같은 결과가 나오도록 주석/스크립트/스타일은 제외
+            lxml.etree.strip_elements(root, lxml.etree.Comment, "script", "style", with_tail=False)
+            return "\n".join(text.strip() for text in root.itertext() if text.strip())
+    return BeautifulSoup(html, "html.parser").get_text("\n", strip=True)
+
+def html_links(html):
+    """HTML 본문의 링크/이미지/첨부 주소 (href, src) 목록, 문서 순서. 평문이 같아도 주소가 바뀌면 내용 변경으로 봄"""
+    if not html:
+        return []
+    if lxml is not None:
+        try:
+            root = lxml.html.fragment_fromstring(html, create_parent="div")
+        except (ValueError, lxml.etree.ParserError):
+            pass
+        else:
+            return [link.strip() for _, attribute, link, _ in root.iterlinks() if attribute in ("href", "src")]
+    return [tag[attribute].strip() for tag in BeautifulSoup(html, "html.parser").find_all(True)
+            for attribute in ("href", "src") if tag.has_attr(attribute)]
+
+def link_lines(links):
+    return "\n".join(f"🔗 {link}" for link in links)
+
+def html_to_text(html):
+    return html_plain_text(html) or "없음"
+
+def content_hash(value):
+    """변경 비교용 본문 해시 (None과 빈 문자열은 같은 값)"""
+    return hashlib.sha256(("" if value is None else str(value)).encode("utf-8")).hexdigest()
+
+def text_key(text):
+    """공백/줄바꿈을 모두 뺀 비교용 문자열 (공백이나 태그 구조만 바뀐 본문은 같은 값)"""
+    return "".join((text or "").split())
+
+# 한글/한자는 띄어쓰기와 관계없이 찾을 수 있도록 두 글자(bigram) 단위로 색인
+CJK_RUN = r"\u3131-\u318e\uac00-\ud7a3\u3400-\u4dbf\u4e00-\u9fff"
+SEARCH_TOKEN_PATTERN = re.compile(rf"([{CJK_RUN}]+)|([^\W_{CJK_RUN}]+)")
+
+def search_terms(text):
+    """[(구분, 토큰 목록)]: 한글/한자 연속 구간은 ("cjk", bigram 목록), 나머지 단어는 ("word", [소문자 단어])"""
+    terms = []
+    for cjk, word in SEARCH_TOKEN_PATTERN.findall((text or "").lower()):
+        if cjk:
+            terms.append(("cjk", [cjk[i:i + 2] for i in range(len(cjk) - 1)] or [cjk]))
+        else:
+            terms.append(("word", [word]))
+    return terms
+
+def search_tokens(text):
+    """
+    FTS5(unicode61)에 넣을 공백 구분 토큰 문자열.
+    한글 구간은 bigram 뒤에 마지막 글자를 한 번 더 넣음: 구간의 다른 글자는 모두 어떤 bigram의 첫 글자이므로
+    한 글자 검색("X"*)이 어느 위치의 글자든 찾음 (바꾸면 SEARCH_TOKENIZER_VERSION을 올려 다시 색인)
+    """
+    tokens = []
+    for kind, terms in search_terms(text):
+        tokens.extend(terms)
+        if kind == "cjk" and len(terms[0]) > 1:
+            tokens.append(terms[-1][-1])
+    return " ".join(tokens)
+
+def search_match_query(query):
+    """
+    검색어를 FTS5 MATCH 식으로 변환 (단어끼리는 AND).
+    한글 구간은 bigram 구(phrase)라 부분 문자열로 찾고, 한 글자면 접두어(bigram 첫 글자 또는 구간 끝 글자),
+    영문/숫자 단어는 접두어 검색.
+    찾을 단어가 없으면 None
+    """
+    parts = []
+    for kind, tokens in search_terms(query):
+        if kind == "cjk" and len(tokens[0]) > 1:
+            parts.append('"' + " ".join(tokens) + '"')
+        else:
+            parts.append(f'"{tokens[0]}"*')
+    return " AND ".join(parts) or None
+
+def search_snippet(text, query, context=SEARCH_SNIPPET_CHARS):
+    """
+    본문에서 검색어가 처음 나오는 곳 주변 (공백 차이는 무시). 반환: (스니펫, 페이지 번호)
+    페이지는 \f로 나눈 PDF 본문의 몇 번째 페이지인지 (1부터)
+    """
+    lowered = text.lower()
+    position = -1
+    for _, tokens in search_terms(query):
+        term = tokens[0] if len(tokens) == 1 else tokens[0][0] + "".join(token[1] for token in tokens)
+        position = lowered.find(term)
+        if position >= 0:
+            break
+    if position < 0:
+        position = 0
+    start, end = max(0, position - context), min(len(text), position + context * 2)
+    snippet = " ".join(text[start:end].split())
+    return ("…" if start else "") + snippet + ("…" if end < len(text) else ""), text.count("\f", 0, position) + 1
+
+SEARCH_SOURCE_LABELS = {"announcement": "공지", "assignment": "과제", "lecture": "강의자료"}
+
+def format_search_hit(hit):
+    page = f" p.{hit['page']}" if hit["page"] else ""
+    return (f"[{SEARCH_SOURCE_LABELS.get(hit['source'], hit['source'])}] {hit['course_name'] or ''} - "
+            f"{hit['title']}{page}\n  {hit['snippet']}")
+
+def _word_tokens(text):
+    """[(앞 공백, 단어 또는 문장부호)] - 비교는 토큰끼리 하고 출력할 때 공백을 되살림"""
+    return re.findall(r"(\s*)(\w+|[^\w\s])", text)
+
+def _shorten_context(text, head, tail):
+    """바뀐 부분 주변 문맥만 남김 (head: 앞쪽 글자 수, tail: 뒤쪽 글자 수, 0이면 그쪽은 자름)"""
+    if len(text) <= head + tail + 1:
+        return text
+    return (text[:head] if head else "") + "…" + (text[-tail:] if tail else "")
+
+def _inline_diff(old_text, new_text, context_chars):
+    """
+    한 블록 안의 단어 단위 차이를 "[-이전-]{+새+}" 표시가 들어간 한 줄로 만듦.
+    토큰 수가 너무 많으면 None (줄 단위로 보여 줌)
+    """
+    # 공백 단위 단어 수는 토큰 수보다 적으므로 토큰으로 나누기 전에 먼저 거름
+    if len(old_text.split()) > DIFF_MAX_WORD_TOKENS or len(new_text.split()) > DIFF_MAX_WORD_TOKENS:
+        return None
+    old_tokens, new_tokens = _word_tokens(old_text), _word_tokens(new_text)
+    if len(old_tokens) > DIFF_MAX_WORD_TOKENS or len(new_tokens) > DIFF_MAX_WORD_TOKENS:
+        return None
+    matcher = difflib.SequenceMatcher(None, [token for _, token in old_tokens],
+                                      [token for _, token in new_tokens], autojunk=False)
+    opcodes = matcher.get_opcodes()
+    parts = []
+    for index, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+        if tag == "equal":
+            text = "".join(space + token for space, token in new_tokens[j1:j2])
+            parts.append(_shorten_context(text, context_chars if index else 0,
+                                          context_chars if index < len(opcodes) - 1 else 0))
+            continue
+        removed = "".join(space + token for space, token in old_tokens[i1:i2])
+        added = "".join(space + token for space, token in new_tokens[j1:j2])
+        leading = removed or added
+        space = leading[:len(leading) - len(leading.lstrip())]
+        parts.append(space + (f"[-{removed.strip()}-]" if removed else "") + (f"{{+{added.strip()}+}}" if added else ""))
+    return "".join(parts).strip()
+
+def text_diff(old_text, new_text, context=DIFF_CONTEXT_LINES, limit=DIFF_MAX_CHARS):
+    """
+    저장된 평문 두 개의 바뀐 부분만 문맥과 함께 보여 주는 문자열.
+      - 줄 단위로 맞춘 뒤, 바뀐 블록은 단어 단위로 "~ ...[-이전-]{+새+}..." 한 줄로 표시
+      - 통째로 추가/삭제된 줄은 "+ " / "- ", 문맥 줄은 "  "
+      - 공백이나 줄 나눔만 바뀐 부분은 표시하지 않음 (모두 그렇다면 빈 문자열)
+    """
+    old_lines, new_lines = (old_text or "").splitlines(), (new_text or "").splitlines()
+    old_keys, new_keys = [text_key(line) for line in old_lines], [text_key(line) for line in new_lines]
+    # 앞뒤로 같은 줄은 문맥만 남기고 잘라 냄. 반복되는 줄이 많은 긴 본문에서 SequenceMatcher가 느려지는 것을 막음
+    prefix = 0
+    while prefix < min(len(old_keys), len(new_keys)) and old_keys[prefix] == new_keys[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < min(len(old_keys), len(new_keys)) - prefix
+           and old_keys[-1 - suffix] == new_keys[-1 - suffix]):
+        suffix += 1
+    start, end = max(0, prefix - context), max(0, suffix - context)
+    old_lines, old_keys = old_lines[start:len(old_lines) - end], old_keys[start:len(old_keys) - end]
+    new_lines, new_keys = new_lines[start:len(new_lines) - end], new_keys[start:len(new_keys) - end]
+    # 줄 단위 비교는 autojunk를 켬: 같은 줄(표 머리, "관련 내용" 등)이 많이 반복되는 긴 본문에서 autojunk=False는
+    # 반복 줄마다 모든 위치를 훑어 느려짐. 자주 나오는 줄은 일치 구간의 시작점으로만 쓰지 않을 뿐 구간 확장에는 포함됨
+    matcher = difflib.SequenceMatcher(None, old_keys, new_keys)
+    hunks = []
+    for group in matcher.get_grouped_opcodes(context):
+        hunk, has_change = [], False
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                hunk.extend("  " + _shorten_context(line, DIFF_CONTEXT_CHARS * 2, 0) for line in new_lines[j1:j2])
+                continue
+            old_block, new_block = " ".join(old_lines[i1:i2]), " ".join(new_lines[j1:j2])
+            if text_key(old_block) == text_key(new_block):
+                # 줄 나눔만 달라짐 (태그 구조 변경 등)
+                hunk.extend("  " + _shorten_context(line, DIFF_CONTEXT_CHARS * 2, 0) for line in new_lines[j1:j2])
+                continue
+            has_change = True
+            inline = _inline_diff(old_block, new_block, DIFF_CONTEXT_CHARS) if tag == "replace" else None
+            if inline is not None:
+                hunk.append("~ " + inline)
+                continue
+            hunk.extend("- " + _shorten_context(line, DIFF_CONTEXT_CHARS * 4, 0) for line in old_lines[i1:i2])
+            hunk.extend("+ " + _shorten_context(line, DIFF_CONTEXT_CHARS * 4, 0) for line in new_lines[j1:j2])
+        if has_change:
+            hunks.append("\n".join(hunk))
+    # 앞쪽 줄 들여쓰기(문맥 표시)가 지워지지 않도록 truncate_text 대신 직접 자름
+    diff = "\n ⋯\n".join(hunks)
+    return diff if len(diff) <= limit else diff[:limit].rstrip() + "\n ⋯"
 
-def build_change_message(title, course_name, item_name, changed_fields, field_labels, html_fields=None, date_fields=None):
+def build_change_message(title, course_name, item_name, changed_fields, field_labels, html_fields=None, date_fields=None,
+                         diff_fields=None):
+    """
+    changed_fields: upsert가 돌려준 [(컬럼, 이전 값, 새 값)].
+    html_columns가 있는 테이블의 HTML 컬럼은 저장할 때 만든 평문이 들어오므로 다시 파싱하지 않음
+    (html_fields는 HTML 원문이 들어오는 경우에만 지정)
+    diff_fields: 긴 본문 컬럼. 이전/새 값을 통째로 보내지 않고 text_diff로 바뀐 부분만 보냄
+    """
     html_fields = html_fields or set()
     date_fields = date_fields or set()
+    diff_fields = diff_fields or set()
     lines = [title, f"과목: {course_name}", f"항목: {item_name}", "변경 내용:"]
     for field, old_value, new_value in changed_fields:
         label = field_labels.get(field, field)
         if field in html_fields:
-            old_text = truncate_text(html_to_text(old_value), 350)
-            new_text = truncate_text(html_to_text(new_value), 350)
-        elif field in date_fields:
+            old_value, new_value = html_plain_text(old_value) or None, html_plain_text(new_value) or None
+        if field in diff_fields and old_value is not None and new_value is not None:
+            diff = text_diff(old_value, new_value)
+            if diff:
+                lines.append(f"- {label}:\n{diff}")
+            continue
+        if field in date_fields:
             old_text = format_to_kst(old_value)
             new_text = format_to_kst(new_value)
         else:
@@ -218,319 +821,2010 @@ def build_change_message(title, course_name, item_name, changed_fields, field_la
         lines.append(f"- {label}: {old_text} → {new_text}")
     return truncate_text("\n".join(lines), 3900)
 
+class Storage:
+    """
+    db_path별로 하나의 SQLite 연결을 공유.
+      - WAL 모드, synchronous=NORMAL
+      - transaction(): 중첩 가능한 배치 트랜잭션 (가장 바깥에서만 COMMIT)
+      - 같은 SQL 문자열을 쓰면 sqlite3 모듈이 prepared statement를 재사용
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # PDF 비교 프로세스와 같은 DB를 쓰므로 잠금 대기 시간을 넉넉하게 둠
+        self.con = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False, cached_statements=256, timeout=30)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    @classmethod
+    def shared(cls, db_path: str):
+        with cls._shared_lock:
+            if db_path not in cls._shared:
+                cls._shared[db_path] = cls(db_path)
+            return cls._shared[db_path]
+
+    @contextmanager
+    def cursor(self):
+        with self._lock:
+            cur = self.con.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            cur = self.con.cursor()
+            if self._depth == 0:
+                cur.execute("BEGIN")
+            self._depth += 1
+            try:
+                yield cur
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    cur.execute("ROLLBACK")
+                raise
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    cur.execute("COMMIT")
+            finally:
+                cur.close()
+
 class DatabaseBase:
+    schema = ()             # 테이블 생성/마이그레이션 SQL
+    key_columns = ()        # 행을 찾는 자연 키
+    value_columns = ()      # 비교/갱신 대상 컬럼 (changed_fields 순서)
+    keep_old_if_none = ()   # 새 값이 None이면 기존 값 유지
+    insert_defaults = {}    # 새 행 삽입 시 값이 비어 있으면 사용할 기본값
+    html_columns = {}       # HTML 컬럼 -> (평문 컬럼, 해시 컬럼): 새 행/바뀐 행만 파싱하고 비교는 해시로
+    history_columns = ()    # 값이 바뀔 때마다 RevisionDB에 이력을 남길 컬럼 (키의 첫 컬럼을 항목 ID로 사용)
+    search_columns = ()     # (제목 컬럼, 평문 컬럼): 새 행/바뀐 행을 SearchIndexDB에 색인 (키의 첫 컬럼을 항목 ID로 사용)
+
     def __init__(self, db_path: str):
         self.db_path = db_path
         self.table_name = None
+        self.storage = Storage.shared(db_path)
+        self.history = RevisionDB(db_path) if self.history_columns and HISTORY_ENABLED else None
+        self.search_index = open_search_index(db_path) if self.search_columns else None
+
+    def _ensure_table(self):
+        with self.storage.transaction() as cur:
+            for statement in self.schema:
+                cur.execute(statement)
+            self._migrate(cur)
+            self._ensure_key_index(cur)
+            if self.search_index is not None and not self.search_index.has_source(cur, self.table_name):
+                # 색인 기능이 생기기 전부터 있던 행을 한 번 색인
+                self._index_rows(cur, self.get_search_rows(cur))
+
+    def get_search_rows(self, cur):
+        title_column, text_column = self.search_columns
+        cur.execute(f"SELECT {self.key_columns[0]}, course_name, {title_column}, {text_column} FROM {self.table_name}")
+        return cur.fetchall()
+
+    def _index_rows(self, cur, rows):
+        """rows: [(항목 ID, 과목명, 제목, 평문)]"""
+        indexed = self.search_index.index_documents(cur, self.table_name, rows)
+        if indexed:
+            logging.info(f"{self.table_name} 검색 색인 {indexed}건 갱신")
+
+    def _migrate(self, cur):
+        pass
+
+    def _migrate_html_columns(self, cur):
+        """html_columns의 평문/해시 컬럼이 없으면 추가하고 기존 행을 한 번 파싱해 채움"""
+        columns = {row[1] for row in cur.execute(f"PRAGMA table_info({self.table_name})")}
+        for html_column, (text_column, hash_column) in self.html_columns.items():
+            if hash_column in columns:
+                continue
+            cur.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {text_column} TEXT NULL")
+            cur.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {hash_column} TEXT NULL")
+            rows = cur.execute(f"SELECT id, {html_column} FROM {self.table_name}").fetchall()
+            cur.executemany(f"UPDATE {self.table_name} SET {text_column}=?, {hash_column}=? WHERE id=?",
+                            [(html_plain_text(html), content_hash(html), row_id) for row_id, html in rows])
+            if rows:
+                logging.info(f"{self.table_name}.{html_column} 평문/해시 {len(rows)}행 생성")
+
+    def snapshot_columns(self):
+        """비교용으로 읽을 컬럼: HTML 원문 대신 해시 (평문은 바뀐 행만 old_text로 읽음)"""
+        return tuple(column for column in self.value_columns if column not in self.html_columns) + tuple(
+            hash_column for _, hash_column in self.html_columns.values())
+
+    def old_text(self, cur, key, text_column):
+        cur.execute(f"SELECT {text_column} FROM {self.table_name} "
+                    f"WHERE {' AND '.join(f'{column}=?' for column in self.key_columns)}", tuple(key))
+        row = cur.fetchone()
+        return row[0] if row is not None else None
+
+    def with_html_derived(self, values):
+        """values에 HTML 컬럼의 평문/해시를 채움 (파싱은 여기서만 함)"""
+        for html_column, (text_column, hash_column) in self.html_columns.items():
+            html = values.get(html_column)
+            values[text_column] = html_plain_text(html)
+            values[hash_column] = content_hash(html)
+        return values
+
+    def _ensure_key_index(self, cur):
+        """자연 키에 UNIQUE 인덱스 생성. 인덱스가 없던 기존 DB는 중복 행(가장 먼저 들어온 행만 유지)을 정리한 뒤 생성"""
+        if not self.key_columns:
+            return
+        index_name = f"idx_{self.table_name}_key"
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name=?", (index_name,))
+        if cur.fetchone() is not None:
+            return
+        keys = ", ".join(self.key_columns)
+        cur.execute(f"DELETE FROM {self.table_name} WHERE id NOT IN (SELECT MIN(id) FROM {self.table_name} GROUP BY {keys})")
+        if cur.rowcount:
+            logging.warning(f"{self.table_name} 테이블 중복 행 {cur.rowcount}개 정리")
+        cur.execute(f"CREATE UNIQUE INDEX {index_name} ON {self.table_name} ({keys})")
+
+    def load_snapshot(self, cur, keys):
+        """keys에 해당하는 기존 행을 임시 테이블 조인 한 번으로 읽어 {key: {column: value}}로 반환"""
+        batch_table = f"temp.batch_{self.table_name}"
+        key_list = ", ".join(self.key_columns)
+        cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS batch_{self.table_name} ({key_list})")
+        cur.execute(f"DELETE FROM {batch_table}")
+        cur.executemany(f"INSERT INTO {batch_table} VALUES ({', '.join('?' for _ in self.key_columns)})", keys)
+        join_on = " AND ".join(f"t.{column}=k.{column}" for column in self.key_columns)
+        snapshot_columns = self.snapshot_columns()
+        columns = ", ".join(f"t.{column}" for column in self.key_columns + snapshot_columns)
+        cur.execute(f"SELECT DISTINCT {columns} FROM {self.table_name} t JOIN {batch_table} k ON {join_on}")
+        width = len(self.key_columns)
+        snapshot = {tuple(row[:width]): dict(zip(snapshot_columns, row[width:])) for row in cur.fetchall()}
+        cur.execute(f"DELETE FROM {batch_table}")
+        return snapshot
 
     def get_database(self):
-        con = sqlite3.connect(self.db_path, isolation_level=None)
-        cur = con.cursor()
-        try:
-            cur.execute(f"SELECT * FROM {self.table_name} ORDER BY id")
-        except sqlite3.OperationalError:
-            con.close()
-            return None
-        temp = cur.fetchall()
-        con.close()
-        return temp
+        with self.storage.cursor() as cur:
+            try:
+                cur.execute(f"SELECT * FROM {self.table_name} ORDER BY id")
+            except sqlite3.OperationalError:
+                return None
+            return cur.fetchall()
 
     def get_latest_data_id(self):
-        all_db = self.get_database()
-        if not all_db:
-            return None
-        return all_db[-1][0]
+        with self.storage.cursor() as cur:
+            try:
+                cur.execute(f"SELECT MAX(id) FROM {self.table_name}")
+            except sqlite3.OperationalError:
+                return None
+            return cur.fetchone()[0]
+
+    def _record_history(self, cur, inserted, updated):
+        """
+        새 행과 바뀐 행의 history_columns 값을 RevisionDB에 기록 (UPDATE 전에 호출).
+        이력 저장을 켜기 전부터 있던 행은 덮어쓰기 전 값을 먼저 한 리비전으로 남김
+        """
+        columns = ", ".join(self.history_columns)
+        key_where = " AND ".join(f"{column}=?" for column in self.key_columns)
+        rows = []
+        for key, values in updated:
+            if not self.history.has_item(cur, self.table_name, key[0]):
+                cur.execute(f"SELECT {columns} FROM {self.table_name} WHERE {key_where}", tuple(key))
+                old_row = cur.fetchone()
+                if old_row is not None:
+                    rows.append((key[0], dict(zip(self.history_columns, old_row))))
+            rows.append((key[0], values))
+        rows.extend((key[0], values) for key, values in inserted)
+        self.history.record(cur, self.table_name, self.history_columns, rows)
+
+    def upsert(self, items):
+        """
+        items: [(key tuple, {column: value})]
+        기존 행은 load_snapshot으로 한 번에 읽어 비교하고,
+        새 행은 INSERT, 값이 달라진 행은 UPDATE 하되 한 트랜잭션에서 executemany로 일괄 반영.
+        반환: [(key, 반영된 값, changed_fields)] - 값이 바뀐 기존 행만
+        html_columns의 컬럼은 해시로 비교하고, changed_fields에는 (컬럼, 이전 평문, 새 평문)으로 넣음.
+        해시는 달라도 평문이 공백까지 빼고 같고 링크/이미지 주소도 같으면(공백/서식만 바뀜) 저장만 하고 changed_fields에 넣지 않음.
+        평문은 같고 주소만 바뀌었으면 (컬럼, 이전 주소 목록, 새 주소 목록)으로 넣음
+        """
+        key_where = " AND ".join(f"{column}=?" for column in self.key_columns)
+        stored_columns = self.value_columns + tuple(
+            column for derived in self.html_columns.values() for column in derived)
+        insert_columns = self.key_columns + stored_columns
+        insert_sql = (f"INSERT INTO {self.table_name} ({', '.join(insert_columns)}) "
+                      f"VALUES ({', '.join('?' for _ in insert_columns)})")
+        update_sql = (f"UPDATE {self.table_name} SET {', '.join(f'{column}=?' for column in stored_columns)} "
+                      f"WHERE {key_where}")
+
+        changed, inserts, updates, updated, markup_only_rows = [], {}, [], [], 0
+        with self.storage.transaction() as cur:
+            # 기존 스냅샷을 한 번에 읽어 두고 메모리에서 비교 (배치 안의 중복 키는 직전 값과 비교)
+            current = self.load_snapshot(cur, list({key: None for key, _ in items}))
+            for key, new_values in items:
+                old_values = current.get(key)
+                if old_values is None:
+                    values = {
+                        column: self.insert_defaults[column]
+                        if column in self.insert_defaults and not new_values.get(column)
+                        else new_values.get(column)
+                        for column in self.value_columns
+                    }
+                    current[key] = inserts[key] = self.with_html_derived(values)
+                    continue
+
+                values = {
+                    column: old_values[column]
+                    if column in self.keep_old_if_none and new_values.get(column) is None
+                    else new_values.get(column)
+                    for column in self.value_columns
+                }
+                changed_fields, derived, markup_only = [], None, False
+                for column in self.value_columns:
+                    if column in self.html_columns:
+                        text_column, hash_column = self.html_columns[column]
+                        if content_hash(values[column]) == old_values[hash_column]:
+                            continue
+                        # HTML 컬럼은 원문이 바뀐 행에서만 파싱
+                        derived = derived or self.with_html_derived(dict(values))
+                        # 배치 안에서 이미 반영한 행이면 그 평문, 아니면 DB의 평문
+                        old_text = old_values[text_column] if text_column in old_values \
+                            else self.old_text(cur, key, text_column)
+                        if text_key(old_text) == text_key(derived[text_column]):
+                            old_html = old_values[column] if column in old_values else self.old_text(cur, key, column)
+                            old_links, new_links = html_links(old_html), html_links(values[column])
+                            if old_links == new_links:
+                                # 공백/서식만 바뀜: 새 원문은 저장하되 변경으로 알리지 않음
+                                markup_only = True
+                            else:
+                                # 글은 같고 Zoom 링크, 이미지, 첨부 주소만 바뀜
+                                changed_fields.append((column, link_lines(old_links), link_lines(new_links)))
+                            continue
+                        changed_fields.append((column, old_text or None, derived[text_column] or None))
+                    elif values_differ(old_values[column], values[column]):
+                        changed_fields.append((column, old_values[column], values[column]))
+                if not changed_fields and not markup_only:
+                    continue
+                current[key] = values = derived or self.with_html_derived(values)
+                if key in inserts:
+                    inserts[key] = values
+                else:
+                    updates.append(tuple(values[column] for column in stored_columns) + tuple(key))
+                    updated.append((key, values))
+                if changed_fields:
+                    changed.append((key, values, changed_fields))
+                else:
+                    markup_only_rows += 1
+
+            if self.history is not None:
+                # 기존 행을 덮어쓰기 전에 기록 (이력이 없던 행의 이전 값을 읽어야 함)
+                self._record_history(cur, list(inserts.items()), updated)
+            if self.search_index is not None:
+                title_column, text_column = self.search_columns
+                self._index_rows(cur, [
+                    (key[0], values["course_name"], values[title_column], values[text_column])
+                    for key, values in list(inserts.items()) + updated
+                ])
+            cur.executemany(insert_sql, [
+                tuple(key) + tuple(values[column] for column in stored_columns)
+                for key, values in inserts.items()
+            ])
+            cur.executemany(update_sql, updates)
+        if markup_only_rows:
+            logging.info(f"{self.table_name}: 공백/서식만 바뀐 본문 {markup_only_rows}건은 알림 없이 저장")
+        return changed
+
+class RevisionDB(DatabaseBase):
+    """
+    공지/과제 컬럼별 변경 이력 (append-only). upsert가 덮어쓰기 전에 DatabaseBase.history_columns 값을 기록.
+      - revision: (항목, 컬럼)마다 값이 바뀐 시점과 본문 ID
+      - revision_blob: 본문을 sha256당 한 번만 저장 (되돌린 글, 여러 과목에 같은 공지 등은 공유).
+        기준 본문(같은 컬럼의 직전 리비전, 새 항목이면 같은 종류 항목의 최근 본문)을 zlib preset dictionary로 넣어
+        압축한 delta, 전체 zlib 압축, 원문 중 가장 작은 것으로 저장
+    """
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS revision (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_type TEXT NOT NULL,     -- 원본 테이블 (announcement, assignment)
+            item_id INTEGER NOT NULL,    -- announcement_id, assignment_id
+            field TEXT NOT NULL,
+            blob_id INTEGER NULL,        -- revision_blob.id (값이 None이면 NULL)
+            recorded_at TEXT NOT NULL    -- 기록 시각 (KST)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_revision_item
+        ON revision (item_type, item_id, field, id)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS revision_blob (
+            id INTEGER PRIMARY KEY,
+            digest BLOB NOT NULL UNIQUE, -- 원문 sha256 (32바이트)
+            kind TEXT NOT NULL,          -- raw | zlib | delta
+            base_id INTEGER NULL,        -- delta의 기준 본문
+            depth INTEGER NOT NULL DEFAULT 0,  -- 전체 본문이 나올 때까지 따라갈 delta 수
+            size INTEGER NOT NULL,       -- 원문 바이트 수
+            data BLOB NOT NULL
+        )
+        """,
+    )
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.table_name = "revision"
+        self._ensure_table()
+        self._text_cache = {}
+        self._recent_blob = {}  # (item_type, field) -> 최근에 저장한 본문 ID (새 항목의 delta 기준)
+
+    def _remember(self, blob_id, text):
+        if len(self._text_cache) >= HISTORY_TEXT_CACHE:
+            self._text_cache.pop(next(iter(self._text_cache)))
+        self._text_cache[blob_id] = text
+
+    def has_item(self, cur, item_type, item_id) -> bool:
+        cur.execute("SELECT 1 FROM revision WHERE item_type=? AND item_id=? LIMIT 1", (item_type, item_id))
+        return cur.fetchone() is not None
+
+    def latest_blobs(self, cur, item_type, item_id, at=None, revision_id=None):
+        """컬럼별 마지막 리비전의 본문 ID {field: blob_id} (at/revision_id가 있으면 그 시점까지)"""
+        conditions, params = ["item_type=?", "item_id=?"], [item_type, item_id]
+        if at is not None:
+            conditions.append("recorded_at<=?")
+            params.append(at)
+        if revision_id is not None:
+            conditions.append("id<=?")
+            params.append(revision_id)
+        # SQLite는 MAX()와 함께 고른 나머지 컬럼을 최댓값 행에서 가져옴
+        cur.execute(f"SELECT field, blob_id, MAX(id) FROM revision WHERE {' AND '.join(conditions)} GROUP BY field",
+                    params)
+        return {field: blob_id for field, blob_id, _ in cur.fetchall()}
+
+    def record(self, cur, item_type, columns, rows):
+        """
+        rows: [(item_id, {column: value})]. 마지막 리비전과 값이 다른 컬럼만 추가 (처음 기록할 때 None은 생략).
+        반환: 추가한 리비전 수
+        """
+        recorded_at = datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S")
+        added = 0
+        for item_id, values in rows:
+            latest = self.latest_blobs(cur, item_type, item_id)
+            for field in columns:
+                value = values.get(field)
+                if value is None:
+                    if latest.get(field) is None:
+                        continue
+                    blob_id = None
+                else:
+                    data = str(value).encode("utf-8")
+                    digest = hashlib.sha256(data).digest()
+                    cur.execute("SELECT id FROM revision_blob WHERE digest=?", (digest,))
+                    row = cur.fetchone()
+                    blob_id = row[0] if row is not None else None
+                    if field in latest and blob_id is not None and latest[field] == blob_id:
+                        continue
+                    if blob_id is None:
+                        base_id = latest.get(field) or self._recent_blob.get((item_type, field))
+                        blob_id = self._store_blob(cur, data, digest, base_id)
+                    self._recent_blob[(item_type, field)] = blob_id
+                cur.execute("INSERT INTO revision (item_type, item_id, field, blob_id, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                            (item_type, item_id, field, blob_id, recorded_at))
+                added += 1
+        return added
+
+    def _store_blob(self, cur, data, digest, base_id):
+        """반환: 새 본문 ID"""
+        candidates = [("raw", None, 0, data), ("zlib", None, 0, zlib.compress(data, 9))]
+        if base_id is not None:
+            cur.execute("SELECT depth FROM revision_blob WHERE id=?", (base_id,))
+            row = cur.fetchone()
+            if row is not None and row[0] < HISTORY_MAX_DELTA_CHAIN:
+                compressor = zlib.compressobj(9, zdict=self.blob_text(cur, base_id).encode("utf-8"))
+                candidates.append(("delta", base_id, row[0] + 1, compressor.compress(data) + compressor.flush()))
+        kind, base_id, depth, payload = min(candidates, key=lambda candidate: len(candidate[3]))
+        cur.execute("INSERT INTO revision_blob (digest, kind, base_id, depth, size, data) VALUES (?, ?, ?, ?, ?, ?)",
+                    (digest, kind, base_id, depth, len(data), payload))
+        self._remember(cur.lastrowid, data.decode("utf-8"))
+        return cur.lastrowid
+
+    def blob_text(self, cur, blob_id):
+        """본문 복원 (delta는 기준 본문부터 차례로 풀어 냄)"""
+        chain, current = [], blob_id
+        while current not in self._text_cache:
+            cur.execute("SELECT kind, base_id, data FROM revision_blob WHERE id=?", (current,))
+            kind, base_id, data = cur.fetchone()
+            chain.append((current, kind, data))
+            if kind != "delta":
+                break
+            current = base_id
+        text = self._text_cache.get(current)
+        for chain_id, kind, data in reversed(chain):
+            if kind == "raw":
+                text = data.decode("utf-8")
+            elif kind == "zlib":
+                text = zlib.decompress(data).decode("utf-8")
+            else:
+                decompressor = zlib.decompressobj(zdict=text.encode("utf-8"))
+                text = (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+            self._remember(chain_id, text)
+        return text
+
+    def version(self, item_type, item_id, at=None, revision_id=None):
+        """
+        항목의 과거 값 복원: at(KST "YYYY-MM-DD HH:MM:SS") 또는 revision_id 시점까지의 컬럼별 마지막 값 (둘 다 없으면 최신).
+        반환: {field: value} - 기록이 없으면 빈 dict
+        """
+        with self.storage.cursor() as cur:
+            latest = self.latest_blobs(cur, item_type, item_id, at, revision_id)
+            return {field: None if blob_id is None else self.blob_text(cur, blob_id) for field, blob_id in latest.items()}
+
+    def revisions(self, item_type, item_id):
+        """반환: [(revision_id, field, recorded_at, 원문 크기, 저장 방식, 저장 크기)] - 오래된 순"""
+        with self.storage.cursor() as cur:
+            cur.execute("""SELECT r.id, r.field, r.recorded_at, b.size, b.kind, LENGTH(b.data)
+                           FROM revision r LEFT JOIN revision_blob b ON b.id = r.blob_id
+                           WHERE r.item_type=? AND r.item_id=? ORDER BY r.id""", (item_type, item_id))
+            return cur.fetchall()
+
+    def stats(self):
+        """반환: {revisions, blobs, logical_bytes(리비전마다 전체 사본일 때), original_bytes(중복 제거 후), stored_bytes}"""
+        with self.storage.cursor() as cur:
+            cur.execute("""SELECT COUNT(*), COALESCE(SUM(b.size), 0)
+                           FROM revision r LEFT JOIN revision_blob b ON b.id = r.blob_id""")
+            revisions, logical_bytes = cur.fetchone()
+            cur.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM revision_blob")
+            blobs, original_bytes, stored_bytes = cur.fetchone()
+        return {"revisions": revisions, "blobs": blobs, "logical_bytes": logical_bytes,
+                "original_bytes": original_bytes, "stored_bytes": stored_bytes}
+
+def open_search_index(db_path):
+    """SearchIndexDB 또는 None (LMS_SEARCH=0이거나 SQLite가 FTS5 없이 빌드된 경우 검색만 비활성)"""
+    if not SEARCH_ENABLED:
+        return None
+    try:
+        return SearchIndexDB(db_path)
+    except sqlite3.OperationalError as e:
+        logging.warning(f"전문 검색 색인 비활성 (SQLite FTS5 사용 불가): {e}")
+        return None
+
+class SearchIndexDB(DatabaseBase):
+    """
+    공지/과제/강의자료 PDF 전문 검색 색인 (SQLite FTS5).
+      - search_doc: 문서마다 제목, 과목, zlib 압축 평문, 내용 해시. 해시가 같으면 다시 색인하지 않음
+      - search_index: search_tokens()로 나눈 토큰만 담는 contentless FTS5 테이블 (rowid = search_doc.id).
+        문서를 지울 때는 저장해 둔 평문을 같은 방식으로 다시 나눠 'delete' 명령에 넘김
+    공지/과제는 upsert에서, 강의자료 PDF는 index_lecture_texts()가 파일 sha256을 키로 색인
+    """
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS search_doc (
+            id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,        -- announcement | assignment | lecture
+            item_key TEXT NOT NULL,      -- announcement_id, assignment_id, 강의자료는 파일 sha256
+            course_name TEXT NULL,
+            title TEXT NOT NULL,
+            body BLOB NOT NULL,          -- 평문 zlib 압축 (스니펫, 색인 삭제용). PDF는 페이지 사이에 \f
+            content_hash TEXT NOT NULL,  -- 제목 + 평문 해시
+            indexed_at TEXT NOT NULL,    -- KST
+            UNIQUE (source, item_key)
+        )
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(title, body, content='', tokenize='unicode61')
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS search_meta (
+            key TEXT PRIMARY KEY,        -- tokenizer_version
+            value TEXT NOT NULL
+        )
+        """,
+    )
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.table_name = "search_doc"
+        self._ensure_table()
+
+    def _migrate(self, cur):
+        """토큰 규칙이 바뀌었으면 contentless 색인을 비우고 search_doc의 평문으로 다시 색인 ('delete'가 같은 토큰을 요구하므로)"""
+        cur.execute("SELECT value FROM search_meta WHERE key='tokenizer_version'")
+        row = cur.fetchone()
+        if row is not None and int(row[0]) == SEARCH_TOKENIZER_VERSION:
+            return
+        cur.execute("INSERT INTO search_index (search_index) VALUES ('delete-all')")
+        cur.execute("SELECT id, title, body FROM search_doc")
+        rows = cur.fetchall()
+        cur.executemany("INSERT INTO search_index (rowid, title, body) VALUES (?, ?, ?)",
+                        [(doc_id, search_tokens(title), search_tokens(zlib.decompress(body).decode("utf-8")))
+                         for doc_id, title, body in rows])
+        cur.execute("INSERT OR REPLACE INTO search_meta (key, value) VALUES ('tokenizer_version', ?)",
+                    (str(SEARCH_TOKENIZER_VERSION),))
+        if rows:
+            logging.info(f"검색 토큰 규칙 변경: 문서 {len(rows)}개 다시 색인")
+
+    def has_source(self, cur, source) -> bool:
+        cur.execute("SELECT 1 FROM search_doc WHERE source=? LIMIT 1", (source,))
+        return cur.fetchone() is not None
+
+    def indexed_keys(self, source):
+        with self.storage.cursor() as cur:
+            cur.execute("SELECT item_key FROM search_doc WHERE source=?", (source,))
+            return {item_key for item_key, in cur.fetchall()}
+
+    def _delete(self, cur, doc_id, title, body):
+        cur.execute("INSERT INTO search_index (search_index, rowid, title, body) VALUES ('delete', ?, ?, ?)",
+                    (doc_id, search_tokens(title), search_tokens(zlib.decompress(body).decode("utf-8"))))
+
+    def index_documents(self, cur, source, rows):
+        """
+        rows: [(item_key, 과목명, 제목, 평문)]. 내용 해시가 바뀐 문서만 다시 색인.
+        반환: 색인한 문서 수
+        """
+        indexed_at = datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S")
+        indexed = 0
+        for item_key, course_name, title, text in rows:
+            title, text = title or "", text or ""
+            digest = content_hash(f"{title}\0{text}")
+            cur.execute("SELECT id, title, body, content_hash FROM search_doc WHERE source=? AND item_key=?",
+                        (source, str(item_key)))
+            row = cur.fetchone()
+            if row is not None:
+                doc_id, old_title, old_body, old_hash = row
+                if old_hash == digest:
+                    if course_name is not None:
+                        cur.execute("UPDATE search_doc SET course_name=? WHERE id=? AND course_name IS NOT ?",
+                                    (course_name, doc_id, course_name))
+                    continue
+                self._delete(cur, doc_id, old_title, old_body)
+                cur.execute("""UPDATE search_doc SET course_name=?, title=?, body=?, content_hash=?, indexed_at=?
+                               WHERE id=?""",
+                            (course_name, title, zlib.compress(text.encode("utf-8")), digest, indexed_at, doc_id))
+            else:
+                cur.execute("""INSERT INTO search_doc (source, item_key, course_name, title, body, content_hash, indexed_at)
+                               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                            (source, str(item_key), course_name, title, zlib.compress(text.encode("utf-8")), digest,
+                             indexed_at))
+                doc_id = cur.lastrowid
+            cur.execute("INSERT INTO search_index (rowid, title, body) VALUES (?, ?, ?)",
+                        (doc_id, search_tokens(title), search_tokens(text)))
+            indexed += 1
+        return indexed
+
+    def sync_source(self, source, documents):
+        """
+        documents: {item_key: (과목명, 제목)} - 현재 있어야 할 문서.
+        목록에 없는 문서는 색인에서 지우고, 내용은 같지만 과목명/제목이 바뀐 문서(이름만 바뀐 파일)는 정보만 갱신.
+        반환: 삭제한 문서 수
+        """
+        with self.storage.transaction() as cur:
+            cur.execute("SELECT id, item_key, course_name, title FROM search_doc WHERE source=?", (source,))
+            removed = 0
+            for doc_id, item_key, course_name, title in cur.fetchall():
+                if item_key in documents and documents[item_key] == (course_name, title):
+                    continue
+                cur.execute("SELECT body FROM search_doc WHERE id=?", (doc_id,))
+                body = cur.fetchone()[0]
+                if item_key not in documents:
+                    self._delete(cur, doc_id, title, body)
+                    cur.execute("DELETE FROM search_doc WHERE id=?", (doc_id,))
+                    removed += 1
+                else:
+                    # 제목이 바뀌면 제목 토큰도 달라지므로 다시 색인
+                    self._delete(cur, doc_id, title, body)
+                    new_course, new_title = documents[item_key]
+                    text = zlib.decompress(body).decode("utf-8")
+                    cur.execute("UPDATE search_doc SET course_name=?, title=?, content_hash=? WHERE id=?",
+                                (new_course, new_title, content_hash(f"{new_title}\0{text}"), doc_id))
+                    cur.execute("INSERT INTO search_index (rowid, title, body) VALUES (?, ?, ?)",
+                                (doc_id, search_tokens(new_title), search_tokens(text)))
+            return removed
+
+    def search(self, query, limit=10, course=None):
+        """
+        반환: [{source, item_key, course_name, title, snippet, page, score}] - 관련도(bm25, 제목 가중치 4) 순.
+        page는 강의자료 PDF에서 처음 찾은 페이지 (1부터), 그 외 None
+        """
+        with self.storage.cursor() as cur:
+            return self.query(cur, query, limit, course)
+
+    @staticmethod
+    def query(cur, query, limit=10, course=None, courses=None):
+        """search()와 같지만 주어진 커서로 조회 (텔레그램 명령은 별도 읽기 전용 연결 사용). courses: 과목명 목록으로 제한"""
+        match = search_match_query(query)
+        if match is None:
+            return []
+        sql = """SELECT d.source, d.item_key, d.course_name, d.title, d.body, bm25(search_index, 4.0, 1.0) AS score
+                 FROM search_index JOIN search_doc d ON d.id = search_index.rowid
+                 WHERE search_index MATCH ?"""
+        params = [match]
+        if course:
+            sql += " AND d.course_name LIKE ?"
+            params.append(f"%{course}%")
+        if courses is not None:
+            sql += f" AND d.course_name IN ({', '.join('?' * len(courses))})"
+            params.extend(courses)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        hits = []
+        for source, item_key, course_name, title, body, score in rows:
+            snippet, page = search_snippet(zlib.decompress(body).decode("utf-8"), query)
+            hits.append({"source": source, "item_key": item_key, "course_name": course_name, "title": title,
+                         "snippet": snippet, "page": page if source == "lecture" else None, "score": score})
+        return hits
 
 class AssignmentDB(DatabaseBase):
+    schema = ("""CREATE TABLE IF NOT EXISTS assignment (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    assignment_id INT,
+                    course_id INT,
+                    course_name TEXT,
+                    assignment_name TEXT,
+                    start_date TEXT NULL,
+                    end_date TEXT NULL,
+                    description TEXT NULL,
+                    submitted INTEGER NOT NULL DEFAULT 0,
+                    description_text TEXT NULL,   -- description의 평문 (저장할 때 한 번만 파싱)
+                    description_hash TEXT NULL)""",)
+    key_columns = ("assignment_id",)
+    value_columns = ("course_id", "course_name", "assignment_name", "start_date", "end_date", "description", "submitted")
+    keep_old_if_none = ("submitted",)
+    insert_defaults = {"submitted": 0}
+    html_columns = {"description": ("description_text", "description_hash")}
+    history_columns = ("assignment_name", "start_date", "end_date", "description")
+    search_columns = ("assignment_name", "description_text")
+
     def __init__(self, db_path: str):
         super().__init__(db_path)
         self.table_name = "assignment"
+        self._ensure_table()
 
-    def set_database(self, tr_list):
-        con = sqlite3.connect(self.db_path, isolation_level=None)
-        cur = con.cursor()
-        cur.execute("""CREATE TABLE IF NOT EXISTS assignment (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        assignment_id INT,
-                        course_id INT,
-                        course_name TEXT,
-                        assignment_name TEXT,
-                        start_date TEXT NULL,
-                        end_date TEXT NULL,
-                        description TEXT NULL,
-                        submitted INTEGER NOT NULL DEFAULT 0)""")
+    def _migrate(self, cur):
         columns = {row[1] for row in cur.execute("PRAGMA table_info(assignment)")}
         if "submitted" not in columns:
             cur.execute("ALTER TABLE assignment ADD COLUMN submitted INTEGER NOT NULL DEFAULT 0")
-        changed_rows = []
-        for assignment_id, course_id, course_name, assignment_name, start_date, end_date, description, submitted in tr_list:
-            start_date = to_str(start_date)
-            end_date = to_str(end_date)
-            submitted_value = None if submitted is None else int(bool(submitted))
-            new_values = {
+        self._migrate_html_columns(cur)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_assignment_end_date ON assignment (end_date)")  # /due
+
+    def is_submitted(self, assignment_id) -> bool:
+        with self.storage.cursor() as cur:
+            cur.execute("SELECT submitted FROM assignment WHERE assignment_id=?", (assignment_id,))
+            row = cur.fetchone()
+        return bool(row and row[0])
+
+    def set_database(self, tr_list):
+        items = [
+            ((assignment_id,), {
                 "course_id": course_id,
                 "course_name": course_name,
                 "assignment_name": assignment_name,
-                "start_date": start_date,
-                "end_date": end_date,
+                "start_date": to_str(start_date),
+                "end_date": to_str(end_date),
                 "description": description,
+                "submitted": None if submitted is None else int(bool(submitted)),
+            })
+            for assignment_id, course_id, course_name, assignment_name, start_date, end_date, description, submitted in tr_list
+        ]
+        return [
+            {
+                "assignment_id": assignment_id,
+                "course_name": values["course_name"],
+                "assignment_name": values["assignment_name"],
+                "changed_fields": changed_fields,
             }
-            cur.execute("""SELECT id, course_id, course_name, assignment_name, start_date, end_date, description, submitted
-                           FROM assignment WHERE assignment_id=:Id""", {"Id": assignment_id})
-            row = cur.fetchone()
-            if row is None:
-                submitted_value = submitted_value or 0
-                cur.execute("""INSERT INTO assignment
-                            (assignment_id, course_id, course_name, assignment_name, start_date, end_date, description, submitted)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                            (assignment_id, course_id, course_name, assignment_name, start_date, end_date, description, submitted_value))
-                continue
-
-            _, old_course_id, old_course_name, old_assignment_name, old_start_date, old_end_date, old_description, old_submitted = row
-            if submitted_value is None:
-                submitted_value = old_submitted
-            new_values["submitted"] = submitted_value
-            old_values = {
-                "course_id": old_course_id,
-                "course_name": old_course_name,
-                "assignment_name": old_assignment_name,
-                "start_date": old_start_date,
-                "end_date": old_end_date,
-                "description": old_description,
-                "submitted": old_submitted,
-            }
-            changed_fields = [
-                (field, old_values[field], new_values[field])
-                for field in new_values
-                if values_differ(old_values[field], new_values[field])
-            ]
-            if changed_fields:
-                cur.execute("""UPDATE assignment
-                               SET course_id=?, course_name=?, assignment_name=?, start_date=?, end_date=?, description=?, submitted=?
-                               WHERE assignment_id=?""",
-                            (course_id, course_name, assignment_name, start_date, end_date, description, submitted_value, assignment_id))
-                changed_rows.append({
-                    "assignment_id": assignment_id,
-                    "course_name": course_name,
-                    "assignment_name": assignment_name,
-                    "changed_fields": changed_fields,
-                })
-        con.close()
-        return changed_rows
+            for (assignment_id,), values, changed_fields in self.upsert(items)
+        ]
 
 class AnnouncementDB(DatabaseBase):
+    schema = ("""CREATE TABLE IF NOT EXISTS announcement (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    announcement_id INT,
+                    course_id INT,
+                    course_name TEXT,
+                    announcement_title TEXT,
+                    announcement_message TEXT,
+                    posted_at TEXT NULL,
+                    announcement_text TEXT NULL,  -- announcement_message의 평문 (저장할 때 한 번만 파싱)
+                    announcement_hash TEXT NULL)""",)
+    key_columns = ("announcement_id",)
+    value_columns = ("course_id", "course_name", "announcement_title", "announcement_message", "posted_at")
+    html_columns = {"announcement_message": ("announcement_text", "announcement_hash")}
+    history_columns = ("announcement_title", "announcement_message")
+    search_columns = ("announcement_title", "announcement_text")
+
     def __init__(self, db_path: str):
         super().__init__(db_path)
         self.table_name = "announcement"
+        self._ensure_table()
+
+    def _migrate(self, cur):
+        self._migrate_html_columns(cur)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_announcement_posted_at ON announcement (posted_at)")  # /recent
 
     def set_database(self, tr_list):
-        con = sqlite3.connect(self.db_path, isolation_level=None)
-        cur = con.cursor()
-        cur.execute("""CREATE TABLE IF NOT EXISTS announcement (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        announcement_id INT,
-                        course_id INT,
-                        course_name TEXT,
-                        announcement_title TEXT,
-                        announcement_message TEXT,
-                        posted_at TEXT NULL)""")
-        changed_rows = []
-        for announcement_id, course_id, course_name, announcement_title, announcement_message, posted_at in tr_list:
-            posted_at = to_str(posted_at)
-            new_values = {
+        items = [
+            ((announcement_id,), {
                 "course_id": course_id,
                 "course_name": course_name,
                 "announcement_title": announcement_title,
                 "announcement_message": announcement_message,
-                "posted_at": posted_at,
-            }
-            cur.execute("""SELECT id, course_id, course_name, announcement_title, announcement_message, posted_at
-                           FROM announcement WHERE announcement_id=:Id""", {"Id": announcement_id})
-            row = cur.fetchone()
-            if row is None:
-                cur.execute("""INSERT INTO announcement 
-                            (announcement_id, course_id, course_name, announcement_title, announcement_message, posted_at) 
-                            VALUES (?, ?, ?, ?, ?, ?)""",
-                            (announcement_id, course_id, course_name, announcement_title, announcement_message, posted_at))
-                continue
-
-            _, old_course_id, old_course_name, old_title, old_message, old_posted_at = row
-            old_values = {
-                "course_id": old_course_id,
-                "course_name": old_course_name,
-                "announcement_title": old_title,
-                "announcement_message": old_message,
-                "posted_at": old_posted_at,
+                "posted_at": to_str(posted_at),
+            })
+            for announcement_id, course_id, course_name, announcement_title, announcement_message, posted_at in tr_list
+        ]
+        return [
+            {
+                "announcement_id": announcement_id,
+                "course_name": values["course_name"],
+                "announcement_title": values["announcement_title"],
+                "changed_fields": changed_fields,
             }
-            changed_fields = [
-                (field, old_values[field], new_values[field])
-                for field in new_values
-                if values_differ(old_values[field], new_values[field])
-            ]
-            if changed_fields:
-                cur.execute("""UPDATE announcement
-                               SET course_id=?, course_name=?, announcement_title=?, announcement_message=?, posted_at=?
-                               WHERE announcement_id=?""",
-                            (course_id, course_name, announcement_title, announcement_message, posted_at, announcement_id))
-                changed_rows.append({
-                    "announcement_id": announcement_id,
-                    "course_name": course_name,
-                    "announcement_title": announcement_title,
-                    "changed_fields": changed_fields,
-                })
-        con.close()
-        return changed_rows
+            for (announcement_id,), values, changed_fields in self.upsert(items)
+        ]
 
 class CourseDB(DatabaseBase):
+    schema = ("""CREATE TABLE IF NOT EXISTS course (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    course_id INT,
+                    course_name TEXT,
+                    course_code TEXT)""",)
+    key_columns = ("course_id",)
+    value_columns = ("course_name", "course_code")
+
     def __init__(self, db_path: str):
         super().__init__(db_path)
         self.table_name = "course"
+        self._ensure_table()
 
     def set_database(self, tr_list):
-        con = sqlite3.connect(self.db_path, isolation_level=None)
-        cur = con.cursor()
-        cur.execute("""CREATE TABLE IF NOT EXISTS course (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        course_id INT,
-                        course_name TEXT,
-                        course_code TEXT)""")
-        changed_rows = []
-        for course_id, course_name, course_code in tr_list:
-            new_values = {"course_name": course_name, "course_code": course_code}
-            cur.execute("SELECT id, course_name, course_code FROM course WHERE course_id=:Id", {"Id": course_id})
-            row = cur.fetchone()
-            if row is None:
-                cur.execute("INSERT INTO course (course_id, course_name, course_code) VALUES (?, ?, ?)",
-                            (course_id, course_name, course_code))
-                continue
-
-            _, old_course_name, old_course_code = row
-            old_values = {"course_name": old_course_name, "course_code": old_course_code}
-            changed_fields = [
-                (field, old_values[field], new_values[field])
-                for field in new_values
-                if values_differ(old_values[field], new_values[field])
-            ]
-            if changed_fields:
-                cur.execute("UPDATE course SET course_name=?, course_code=? WHERE course_id=?",
-                            (course_name, course_code, course_id))
-                changed_rows.append({
-                    "course_id": course_id,
-                    "course_name": course_name,
-                    "changed_fields": changed_fields,
-                })
-        con.close()
-        return changed_rows
+        items = [
+            ((course_id,), {"course_name": course_name, "course_code": course_code})
+            for course_id, course_name, course_code in tr_list
+        ]
+        return [
+            {
+                "course_id": course_id,
+                "course_name": values["course_name"],
+                "changed_fields": changed_fields,
+            }
+            for (course_id,), values, changed_fields in self.upsert(items)
+        ]
 
 class LectureDB(DatabaseBase):
+    schema = ("""CREATE TABLE IF NOT EXISTS lecture (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    course_id INT,
+                    course_name TEXT,
+                    file_name TEXT,
+                    file_size INT)""",)
+    key_columns = ("course_id", "file_name")
+    value_columns = ("course_name", "file_size")
+
     def __init__(self, db_path: str):
         super().__init__(db_path)
         self.table_name = "lecture"
+        self._ensure_table()
 
-    def set_database(self, tr_list):
-        con = sqlite3.connect(self.db_path, isolation_level=None)
-        cur = con.cursor()
-        cur.execute("""CREATE TABLE IF NOT EXISTS lecture (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        course_id INT,
-                        course_name TEXT,
-                        file_name TEXT,
-                        file_size INT)""")
-        changed_rows = []
-        for course_id, course_name, file_name, file_size in tr_list:
-            file_name = file_name.replace("'", "''")
-            new_values = {"course_name": course_name, "file_size": file_size}
-            cur.execute("SELECT id, course_name, file_size FROM lecture WHERE course_id=:Id AND file_name=:File",
-                        {"Id": course_id, "File": file_name})
-            row = cur.fetchone()
-            if row is None:
-                cur.execute("""INSERT INTO lecture 
-                            (course_id, course_name, file_name, file_size) 
-                            VALUES (?, ?, ?, ?)""",
-                            (course_id, course_name, file_name, file_size))
-                continue
+    def _migrate(self, cur):
+        columns = {row[1] for row in cur.execute("PRAGMA table_info(lecture)")}
+        for column, column_type in (("content_hash", "TEXT"), ("updated_at", "TEXT"), ("file_id", "INT"),
+                                    ("content_type", "TEXT"), ("local_path", "TEXT"), ("modified_at", "TEXT")):
+            if column not in columns:
+                cur.execute(f"ALTER TABLE lecture ADD COLUMN {column} {column_type} NULL")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_lecture_file_id ON lecture (file_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_lecture_course_updated ON lecture (course_name, updated_at)")  # /files
+
+    @staticmethod
+    def key_name(file_name):
+        # 기존 DB와 키를 맞추기 위해 작은따옴표 이스케이프 형식 유지
+        return file_name.replace("'", "''")
+
+    def get_file_states(self):
+        """
+        반환: ({file_id: 상태}, {(course_id, file_name): 상태})
+        상태: dict(course_id, file_name, file_id, content_hash, updated_at, content_type, local_path, modified_at, file_size)
+        """
+        with self.storage.cursor() as cur:
+            cur.execute("""SELECT course_id, file_name, file_id, content_hash, updated_at, content_type, local_path,
+                                  modified_at, file_size
+                           FROM lecture""")
+            columns = [description[0] for description in cur.description]
+            states = [dict(zip(columns, row)) for row in cur.fetchall()]
+        by_id = {state["file_id"]: state for state in states if state["file_id"] is not None}
+        by_name = {(state["course_id"], state["file_name"]): state for state in states}
+        return by_id, by_name
 
-            _, old_course_name, old_file_size = row
-            old_values = {"course_name": old_course_name, "file_size": old_file_size}
-            changed_fields = [
-                (field, old_values[field], new_values[field])
-                for field in new_values
-                if values_differ(old_values[field], new_values[field])
-            ]
-            if changed_fields:
-                cur.execute("UPDATE lecture SET course_name=?, file_size=? WHERE course_id=? AND file_name=?",
-                            (course_name, file_size, course_id, file_name))
-                changed_rows.append({
-                    "course_id": course_id,
-                    "course_name": course_name,
-                    "file_name": file_name,
-                    "changed_fields": changed_fields,
-                })
-        con.close()
-        return changed_rows
+    def set_file_states(self, tr_list):
+        """
+        tr_list: [(course_id, file_name, file_id, content_hash, updated_at, content_type, local_path, modified_at)]
+        set_database로 행이 생긴 뒤 호출
+        """
+        with self.storage.transaction() as cur:
+            cur.executemany("""UPDATE lecture SET file_id=?, content_hash=?, updated_at=?, content_type=?, local_path=?,
+                                                  modified_at=?
+                               WHERE course_id=? AND file_name=?""",
+                            [(file_id, content_hash, updated_at, content_type, local_path, modified_at,
+                              course_id, self.key_name(file_name))
+                             for course_id, file_name, file_id, content_hash, updated_at, content_type, local_path, modified_at
+                             in tr_list])
+
+    def pdf_files(self):
+        """반환: {파일 sha256: (과목명, 파일명, 로컬 경로)} - 해시가 기록된 PDF (검색 색인용)"""
+        with self.storage.cursor() as cur:
+            cur.execute("""SELECT content_hash, course_name, file_name, local_path FROM lecture
+                           WHERE content_hash IS NOT NULL AND local_path IS NOT NULL AND LOWER(file_name) LIKE '%.pdf'
+                           ORDER BY id""")
+            return {content_hash: (course_name, file_name.replace("''", "'"), local_path)
+                    for content_hash, course_name, file_name, local_path in cur.fetchall()}
+
+    def rename_files(self, tr_list):
+        """tr_list: [(course_id, old_file_name, new_file_name)] - LMS에서 이름이 바뀐 파일의 행을 새 이름으로 옮김"""
+        with self.storage.transaction() as cur:
+            cur.executemany("UPDATE OR IGNORE lecture SET file_name=? WHERE course_id=? AND file_name=?",
+                            [(self.key_name(new_name), course_id, self.key_name(old_name))
+                             for course_id, old_name, new_name in tr_list])
+
+    def set_database(self, tr_list):
+        items = [
+            ((course_id, self.key_name(file_name)), {"course_name": course_name, "file_size": file_size})
+            for course_id, course_name, file_name, file_size in tr_list
+        ]
+        return [
+            {
+                "course_id": course_id,
+                "course_name": values["course_name"],
+                "file_name": file_name,
+                "changed_fields": changed_fields,
+            }
+            for (course_id, file_name), values, changed_fields in self.upsert(items)
+        ]
 
 class NotificationDB(DatabaseBase):
+    """
+    과제 마감 알림 예약/전송 기록. (계정, 과제, 마감 몇 분 전, 마감 시각)마다 한 행.
+    마감이 바뀌면 기존 pending 행은 cancelled가 되고 새 마감 기준으로 다시 예약됨
+    """
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS assignment_notify (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER NOT NULL DEFAULT 0,  -- 0은 환경변수 기본 계정
+            assignment_id INTEGER NOT NULL,
+            offset_minutes INTEGER NOT NULL,  -- 마감 몇 분 전 알림인지 (4320 = 72시간)
+            due_at TEXT NULL,                 -- 예약 기준 마감 시각 (UTC, 이전 D-day 방식 기록은 NULL)
+            fire_at REAL NULL,                -- 알림 시각 (epoch 초)
+            course_name TEXT NULL,
+            assignment_name TEXT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending, sent, skipped(이미 지난 알림), cancelled
+            sent_at TEXT NULL
+        )
+        """,
+    )
+
     def __init__(self, db_path: str):
         super().__init__(db_path)
         self.table_name = "assignment_notify"
         self._ensure_table()
 
-    def _ensure_table(self):
-        con = sqlite3.connect(self.db_path, isolation_level=None)
-        cur = con.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS assignment_notify (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                assignment_id INTEGER NOT NULL,
-                d_day INTEGER NOT NULL,          -- 3, 1, 0
-                sent_at TEXT NOT NULL
-            )
-        """)
-        # 중복 방지: 같은 과제의 동일 D-day는 한 번만 기록
-        cur.execute("""
-            CREATE UNIQUE INDEX IF NOT EXISTS idx_assignment_notify_unique
-            ON assignment_notify (assignment_id, d_day)
-        """)
-        con.close()
-
-    def was_sent(self, assignment_id: int, d_day: int) -> bool:
-        con = sqlite3.connect(self.db_path, isolation_level=None)
-        cur = con.cursor()
-        cur.execute(
-            "SELECT 1 FROM assignment_notify WHERE assignment_id=? AND d_day=?",
-            (assignment_id, d_day)
+    def _migrate(self, cur):
+        """이전 (assignment_id, d_day, sent_at) 테이블을 옮김: D-3/D-1/D-day 기록은 72/24/0시간 전 sent 행으로 보존"""
+        columns = {row[1] for row in cur.execute("PRAGMA table_info(assignment_notify)")}
+        if "d_day" in columns:
+            cur.execute("ALTER TABLE assignment_notify RENAME TO assignment_notify_legacy")
+            cur.execute("DROP INDEX IF EXISTS idx_assignment_notify_unique")
+            cur.execute(self.schema[0])
+            cur.execute("""INSERT INTO assignment_notify (assignment_id, offset_minutes, status, sent_at)
+                           SELECT assignment_id, d_day * 1440, 'sent', sent_at FROM assignment_notify_legacy""")
+            cur.execute("DROP TABLE assignment_notify_legacy")
+        elif "account_id" not in columns:
+            cur.execute("ALTER TABLE assignment_notify ADD COLUMN account_id INTEGER NOT NULL DEFAULT 0")
+            cur.execute("DROP INDEX IF EXISTS idx_assignment_notify_unique")
+        cur.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_assignment_notify_unique
+                       ON assignment_notify (account_id, assignment_id, offset_minutes, due_at)""")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_assignment_notify_pending ON assignment_notify (status, fire_at)")
+
+    def schedule(self, assignments, offsets, now=None, account_id=0):
+        """
+        assignments: [(assignment_id, course_name, assignment_name, due_at(UTC datetime 또는 None), submitted)] - account_id 계정 기준
+        마감이 바뀌었거나 제출한 과제의 pending 알림은 취소하고, 새 마감 기준으로 아직 없는 알림만 추가.
+        이미 지난 알림 시각은 그중 마감에 가장 가까운 하나만 바로 보내고 나머지는 skipped로 기록.
+        반환: 새로 예약한 [(fire_at, id)]
+        """
+        now = now or datetime.now(timezone.utc)
+        scheduled = []
+        with self.storage.transaction() as cur:
+            for assignment_id, course_name, assignment_name, due_at, submitted in assignments:
+                due_iso = due_at.astimezone(timezone.utc).isoformat() if due_at is not None else None
+                cur.execute("""UPDATE assignment_notify SET status='cancelled'
+                               WHERE account_id=? AND assignment_id=? AND status='pending' AND (? OR due_at IS NOT ?)""",
+                            (account_id, assignment_id, bool(submitted), due_iso))
+                if submitted or due_at is None or due_at <= now:
+                    continue
+                cur.execute("""SELECT offset_minutes FROM assignment_notify
+                               WHERE account_id=? AND assignment_id=? AND due_at=?""", (account_id, assignment_id, due_iso))
+                done = {row[0] for row in cur.fetchall()}
+                cur.execute("""SELECT MIN(offset_minutes) FROM assignment_notify
+                               WHERE account_id=? AND assignment_id=? AND due_at IS NULL""", (account_id, assignment_id))
+                legacy_min = cur.fetchone()[0]  # 이전 방식으로 이미 보낸 알림보다 이른 알림은 건너뜀
+                candidates = [offset for offset in offsets
+                              if offset not in done and (legacy_min is None or offset < legacy_min)]
+                overdue = [offset for offset in candidates if due_at - timedelta(minutes=offset) <= now]
+                nearest = min(overdue) if overdue and min(overdue) < min(done, default=min(overdue) + 1) else None
+                for offset in candidates:
+                    fire_at = (due_at - timedelta(minutes=offset)).timestamp()
+                    status = "skipped" if offset in overdue and offset != nearest else "pending"
+                    cur.execute("""INSERT INTO assignment_notify
+                                   (account_id, assignment_id, offset_minutes, due_at, fire_at, course_name, assignment_name, status)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                                (account_id, assignment_id, offset, due_iso, fire_at, course_name, assignment_name, status))
+                    if status == "pending":
+                        scheduled.append((fire_at, cur.lastrowid))
+        return scheduled
+
+    def get_pending(self):
+        """반환: [(fire_at, id)]"""
+        with self.storage.cursor() as cur:
+            cur.execute("SELECT fire_at, id FROM assignment_notify WHERE status='pending'")
+            return cur.fetchall()
+
+    def claim(self, reminder_id, sent_at: str):
+        """pending 알림을 sent로 바꾸고 (account_id, assignment_id, offset_minutes, due_at, course_name, assignment_name) 반환. 이미 처리됐으면 None"""
+        with self.storage.transaction() as cur:
+            cur.execute("UPDATE assignment_notify SET status='sent', sent_at=? WHERE id=? AND status='pending'",
+                        (sent_at, reminder_id))
+            if not cur.rowcount:
+                return None
+            cur.execute("""SELECT account_id, assignment_id, offset_minutes, due_at, course_name, assignment_name
+                           FROM assignment_notify WHERE id=?""", (reminder_id,))
+            return cur.fetchone()
+
+    def cancel(self, reminder_id):
+        with self.storage.transaction() as cur:
+            cur.execute("UPDATE assignment_notify SET status='cancelled' WHERE id=?", (reminder_id,))
+
+class ReminderEngine:
+    """
+    과제 마감 알림 타이머. 예약된 알림을 (알림 시각, id) 힙으로 들고 있다가 가장 이른 시각까지 잠든 뒤 전송.
+    수집 주기와 무관하게 정해진 시각에 보내며, 예약은 assignment_notify에 저장되므로 재시작해도 이어서 동작.
+    힙에는 취소된 알림이 남아 있을 수 있지만 claim()이 pending 행만 처리하므로 보내지 않음.
+    알림은 계정별 채팅방으로 보냄 (accounts로 설정, 없으면 기본 CHAT_ID)
+    """
+    def __init__(self, notification_db: NotificationDB, assignment_db=None, offsets=None, account_db=None):
+        self.db = notification_db
+        self.assignment_db = assignment_db
+        self.account_db = account_db
+        self.offsets = offsets if offsets is not None else parse_reminder_offsets(REMINDER_OFFSETS)
+        self.chats = {}  # account_id -> chat_id
+        self.heap = list(self.db.get_pending())
+        heapq.heapify(self.heap)
+        self._wakeup = None
+
+    def set_accounts(self, accounts):
+        self.chats = {account.id: account.chat_id for account in accounts}
+
+    def is_submitted(self, account_id, assignment_id):
+        """기본 계정은 assignment 테이블, 추가 계정은 account_submission 기준"""
+        if account_id == 0:
+            return self.assignment_db is not None and self.assignment_db.is_submitted(assignment_id)
+        return self.account_db is not None and self.account_db.is_submitted(account_id, assignment_id)
+
+    def schedule(self, assignments, account_id=0):
+        """assignments: NotificationDB.schedule과 같은 형식. 같은 값으로 여러 번 불러도 새 행은 생기지 않음"""
+        for entry in self.db.schedule(assignments, self.offsets, account_id=account_id):
+            heapq.heappush(self.heap, entry)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def fire_due(self):
+        """알림 시각이 된 알림을 모두 전송"""
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            _, reminder_id = heapq.heappop(self.heap)
+            await self.fire(reminder_id)
+
+    async def fire(self, reminder_id):
+        sent_at = datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S")
+        row = self.db.claim(reminder_id, sent_at)
+        if row is None:
+            return
+        account_id, assignment_id, offset_minutes, due_at, course_name, assignment_name = row
+        if self.is_submitted(account_id, assignment_id):
+            logging.info(f"과제 마감 알림 생략 (이미 제출): {assignment_id}, {assignment_name}")
+            self.db.cancel(reminder_id)
+            return
+        due_kst = parse_canvas_dt(due_at).astimezone(KST)
+        logging.info(f"과제 마감 알림: {course_name}, {assignment_name}, {reminder_label(offset_minutes)}, 마감 {due_kst}")
+        await send_telegram_message(
+            f"[과제 마감 알림] {reminder_label(offset_minutes)}\n"
+            f"과목: {course_name}\n"
+            f"과제: {assignment_name}\n"
+            f"마감: {due_kst.strftime('%Y-%m-%d %H:%M:%S')} (KST)",
+            course_name,
+            self.chats.get(account_id, chat_id),
+        )
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await self.fire_due()
+            except Exception:
+                logging.error(f"과제 마감 알림 에러: {traceback.format_exc()}")
+                await asyncio.sleep(API_RETRY_BACKOFF_SECONDS)
+                continue
+            timeout = max(0.0, self.heap[0][0] - time.time()) if self.heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+class SyncCursorDB(DatabaseBase):
+    """과목/리소스별 증분 수집 기준 시각(high-water mark)과 마지막 전체 수집 시각"""
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS sync_cursor (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id INTEGER NOT NULL,
+            resource TEXT NOT NULL,          -- announcements, assignments, files
+            cursor TEXT NULL,                -- 가장 최근 updated_at/posted_at (UTC)
+            last_full_sync TEXT NULL         -- 마지막 전체 수집 시각 (KST)
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_sync_cursor_unique
+        ON sync_cursor (course_id, resource)
+        """,
+    )
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.table_name = "sync_cursor"
+        self._ensure_table()
+
+    def get_all(self):
+        """반환: {(course_id, resource): (cursor, last_full_sync)}"""
+        with self.storage.cursor() as cur:
+            cur.execute("SELECT course_id, resource, cursor, last_full_sync FROM sync_cursor")
+            rows = cur.fetchall()
+        return {(course_id, resource): (cursor, last_full_sync) for course_id, resource, cursor, last_full_sync in rows}
+
+    def set_database(self, tr_list):
+        """tr_list: [(course_id, resource, cursor, full_synced_at)] - full_synced_at이 None이면 기존 값 유지"""
+        with self.storage.transaction() as cur:
+            cur.executemany("""INSERT INTO sync_cursor (course_id, resource, cursor, last_full_sync)
+                               VALUES (?, ?, ?, ?)
+                               ON CONFLICT (course_id, resource) DO UPDATE SET
+                                   cursor=excluded.cursor,
+                                   last_full_sync=COALESCE(excluded.last_full_sync, sync_cursor.last_full_sync)""",
+                            tr_list)
+
+class OutboxDB(DatabaseBase):
+    """텔레그램 전송 대기열. 전송에 성공한 행만 sent로 바뀌므로 재시작해도 남은 메시지를 이어서 보냄"""
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS telegram_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            course_name TEXT NULL,           -- 같은 과목 메시지를 묶는 기준 (NULL이면 단독 전송)
+            message TEXT NOT NULL,
+            media TEXT NULL,                 -- 사진 앨범: [{"path", "caption"}] JSON (message는 첫 사진 캡션)
+            created_at TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending, sent, failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0, -- epoch 초
+            sent_at TEXT NULL,
+            last_error TEXT NULL
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_telegram_outbox_pending
+        ON telegram_outbox (status, next_attempt_at)
+        """,
+    )
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.table_name = "telegram_outbox"
+        self._ensure_table()
+
+    def _migrate(self, cur):
+        columns = {row[1] for row in cur.execute("PRAGMA table_info(telegram_outbox)")}
+        if "media" not in columns:
+            cur.execute("ALTER TABLE telegram_outbox ADD COLUMN media TEXT NULL")
+
+    def enqueue(self, chat_id, message, course_name=None, media=None):
+        with self.storage.transaction() as cur:
+            cur.execute("""INSERT INTO telegram_outbox (chat_id, course_name, message, media, created_at)
+                           VALUES (?, ?, ?, ?, ?)""",
+                        (str(chat_id), course_name, message, json.dumps(media, ensure_ascii=False) if media else None,
+                         datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S")))
+
+    def get_due(self, now: float, limit=200):
+        """반환: [(id, chat_id, course_name, message, attempts, media)] - 전송 시각이 된 pending 메시지 (id 순)"""
+        with self.storage.cursor() as cur:
+            cur.execute("""SELECT id, chat_id, course_name, message, attempts, media FROM telegram_outbox
+                           WHERE status='pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?""", (now, limit))
+            return [row[:5] + (json.loads(row[5]) if row[5] else None,) for row in cur.fetchall()]
+
+    def next_attempt_at(self):
+        with self.storage.cursor() as cur:
+            cur.execute("SELECT MIN(next_attempt_at) FROM telegram_outbox WHERE status='pending'")
+            return cur.fetchone()[0]
+
+    def mark_sent(self, ids):
+        sent_at = datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S")
+        with self.storage.transaction() as cur:
+            cur.executemany("UPDATE telegram_outbox SET status='sent', sent_at=? WHERE id=?", [(sent_at, i) for i in ids])
+
+    def mark_retry(self, ids, next_attempt_at: float, error: str, give_up: bool = False):
+        status = "failed" if give_up else "pending"
+        with self.storage.transaction() as cur:
+            cur.executemany("""UPDATE telegram_outbox
+                               SET status=?, attempts=attempts + 1, next_attempt_at=?, last_error=? WHERE id=?""",
+                            [(status, next_attempt_at, error, i) for i in ids])
+
+    def prune(self, max_age: timedelta = OUTBOX_MAX_AGE):
+        """max_age보다 오래된 sent/failed 행 삭제 (pending은 남김). 반환: 삭제한 행 수"""
+        cutoff = (datetime.now(KST) - max_age).strftime("%Y-%m-%d %H:%M:%S")
+        with self.storage.transaction() as cur:
+            cur.execute("DELETE FROM telegram_outbox WHERE status != 'pending' AND created_at < ?", (cutoff,))
+            return cur.rowcount
+
+class PdfFingerprintDB(DatabaseBase):
+    """
+    PDF 페이지 지문 캐시. 파일 내용 해시(SHA-256)를 키로 하므로 내용이 바뀌면 자연히 다른 항목이 됨.
+    최근에 사용한 PDF_FINGERPRINT_CACHE_FILES개 파일만 유지 (LRU)
+    """
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS pdf_fingerprint_file (
+            file_hash TEXT PRIMARY KEY,
+            page_count INTEGER NOT NULL,
+            last_used REAL NOT NULL          -- epoch 초
         )
-        ok = cur.fetchone() is not None
-        con.close()
-        return ok
-
-    def mark_sent(self, assignment_id: int, d_day: int, sent_at: str) -> None:
-        con = sqlite3.connect(self.db_path, isolation_level=None)
-        cur = con.cursor()
-        cur.execute(
-            "INSERT OR IGNORE INTO assignment_notify (assignment_id, d_day, sent_at) VALUES (?, ?, ?)",
-            (assignment_id, d_day, sent_at)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pdf_page_fingerprint (
+            file_hash TEXT NOT NULL,
+            page_index INTEGER NOT NULL,
+            page_hash TEXT NOT NULL,         -- content stream + 이미지/XObject + 텍스트 해시
+            render_hash TEXT NULL,           -- PDF_DIFF_DPI 렌더링 결과 해시 (렌더링한 적 없으면 NULL)
+            perceptual_hash TEXT NULL,       -- 9x8 dHash
+            text_hash TEXT NOT NULL,
+            PRIMARY KEY (file_hash, page_index)
         )
-        con.close()
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_pdf_fingerprint_file_last_used
+        ON pdf_fingerprint_file (last_used)
+        """,
+    )
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.table_name = "pdf_fingerprint_file"
+        self._ensure_table()
+
+    def get(self, file_hash):
+        """반환: {page_index: {page_hash, render_hash, perceptual_hash, text_hash}} 또는 None (캐시 없음)"""
+        with self.storage.transaction() as cur:
+            cur.execute("UPDATE pdf_fingerprint_file SET last_used=? WHERE file_hash=?", (time.time(), file_hash))
+            if not cur.rowcount:
+                return None
+            cur.execute("""SELECT page_index, page_hash, render_hash, perceptual_hash, text_hash
+                           FROM pdf_page_fingerprint WHERE file_hash=?""", (file_hash,))
+            return {
+                page_index: {
+                    "page_hash": page_hash,
+                    "render_hash": render_hash,
+                    "perceptual_hash": perceptual_hash,
+                    "text_hash": text_hash,
+                }
+                for page_index, page_hash, render_hash, perceptual_hash, text_hash in cur.fetchall()
+            }
+
+    def has(self, file_hash):
+        with self.storage.cursor() as cur:
+            cur.execute("SELECT 1 FROM pdf_fingerprint_file WHERE file_hash=?", (file_hash,))
+            return cur.fetchone() is not None
+
+    def put(self, file_hash, pages):
+        """pages: [{page_hash, render_hash, perceptual_hash, text_hash}] (페이지 순서) - 저장 후 LRU 정리"""
+        with self.storage.transaction() as cur:
+            cur.execute("""INSERT INTO pdf_fingerprint_file (file_hash, page_count, last_used) VALUES (?, ?, ?)
+                           ON CONFLICT (file_hash) DO UPDATE SET page_count=excluded.page_count, last_used=excluded.last_used""",
+                        (file_hash, len(pages), time.time()))
+            cur.execute("DELETE FROM pdf_page_fingerprint WHERE file_hash=?", (file_hash,))
+            cur.executemany("""INSERT INTO pdf_page_fingerprint
+                               (file_hash, page_index, page_hash, render_hash, perceptual_hash, text_hash)
+                               VALUES (?, ?, ?, ?, ?, ?)""",
+                            [(file_hash, index, page["page_hash"], page["render_hash"], page["perceptual_hash"], page["text_hash"])
+                             for index, page in enumerate(pages)])
+            cur.execute("""SELECT file_hash FROM pdf_fingerprint_file ORDER BY last_used DESC LIMIT -1 OFFSET ?""",
+                        (PDF_FINGERPRINT_CACHE_FILES,))
+            evicted = [row[0] for row in cur.fetchall()]
+            cur.executemany("DELETE FROM pdf_page_fingerprint WHERE file_hash=?", [(h,) for h in evicted])
+            cur.executemany("DELETE FROM pdf_fingerprint_file WHERE file_hash=?", [(h,) for h in evicted])
+
+class HttpCacheDB(DatabaseBase):
+    """
+    Canvas API GET 응답 캐시 (TimeoutHTTPAdapter가 사용). ETag/Last-Modified가 있는 응답만 저장.
+    키는 (인증 토큰 해시, URL)이라 토큰이 다르면 응답을 공유하지 않음
+    """
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS http_cache (
+            cache_key TEXT PRIMARY KEY,      -- 인증 토큰 해시 + ' ' + URL (쿼리 포함)
+            etag TEXT NULL,
+            last_modified TEXT NULL,
+            headers TEXT NOT NULL,           -- 응답 헤더 JSON
+            body BLOB NOT NULL,              -- zlib 압축 본문
+            body_size INTEGER NOT NULL,      -- 압축 전 크기
+            hits INTEGER NOT NULL DEFAULT 0,         -- 304로 응답받은 횟수
+            bytes_saved INTEGER NOT NULL DEFAULT 0,  -- 304 덕분에 받지 않은 본문 크기 합계
+            stored_at REAL NOT NULL,         -- epoch 초
+            last_used REAL NOT NULL
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_http_cache_last_used
+        ON http_cache (last_used)
+        """,
+    )
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.table_name = "http_cache"
+        self._ensure_table()
+
+    @staticmethod
+    def cache_key(request):
+        token = hashlib.sha256(request.headers.get("Authorization", "").encode("utf-8")).hexdigest()[:16]
+        return f"{token} {request.url}"
+
+    def get(self, cache_key):
+        """반환: {etag, last_modified, headers, body, body_size} 또는 None"""
+        with self.storage.cursor() as cur:
+            cur.execute("SELECT etag, last_modified, headers, body, body_size FROM http_cache WHERE cache_key=?",
+                        (cache_key,))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        etag, last_modified, headers, body, body_size = row
+        return {
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": json.loads(headers),
+            "body": zlib.decompress(body),
+            "body_size": body_size,
+        }
+
+    def put(self, cache_key, etag, last_modified, headers, body):
+        now = time.time()
+        with self.storage.transaction() as cur:
+            cur.execute("""INSERT INTO http_cache
+                           (cache_key, etag, last_modified, headers, body, body_size, stored_at, last_used)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                           ON CONFLICT (cache_key) DO UPDATE SET
+                               etag=excluded.etag, last_modified=excluded.last_modified, headers=excluded.headers,
+                               body=excluded.body, body_size=excluded.body_size,
+                               stored_at=excluded.stored_at, last_used=excluded.last_used""",
+                        (cache_key, etag, last_modified, json.dumps(headers), zlib.compress(body), len(body), now, now))
+
+    def record_hit(self, cache_key, saved_bytes):
+        with self.storage.transaction() as cur:
+            cur.execute("""UPDATE http_cache SET hits=hits + 1, bytes_saved=bytes_saved + ?, last_used=?
+                           WHERE cache_key=?""", (saved_bytes, time.time(), cache_key))
+
+    def prune(self, max_age: timedelta = HTTP_CACHE_MAX_AGE):
+        """max_age 동안 쓰지 않은 항목 삭제. 반환: 삭제한 항목 수"""
+        with self.storage.transaction() as cur:
+            cur.execute("DELETE FROM http_cache WHERE last_used < ?", (time.time() - max_age.total_seconds(),))
+            return cur.rowcount
+
+    def totals(self):
+        """반환: (항목 수, 누적 hit 수, 누적 절약 바이트)"""
+        with self.storage.cursor() as cur:
+            cur.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0), COALESCE(SUM(bytes_saved), 0) FROM http_cache")
+            return cur.fetchone()
+
+class MetricsDB(DatabaseBase):
+    """수집 주기별 단계/과목 측정값 (CrawlStats.drain 결과). `python main.py metrics`로 요약"""
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS cycle_metrics (
+            cycle_started_at TEXT NOT NULL,  -- 수집 주기 시작 시각 (KST)
+            phase TEXT NOT NULL,             -- planner, courses, announcements, assignments, submissions, files,
+                                             -- download, pdf_diff, db_upsert, search_index, reminders, telegram_send,
+                                             -- telegram_command, cycle, other
+            course_name TEXT NOT NULL DEFAULT '',
+            seconds REAL NOT NULL DEFAULT 0,     -- 스레드별 소요 시간 합계 (병렬 실행 시 주기 시간보다 클 수 있음)
+            calls INTEGER NOT NULL DEFAULT 0,    -- 측정 횟수 (telegram_send는 보낸 메시지 수)
+            requests INTEGER NOT NULL DEFAULT 0, -- HTTP 요청 수 (urllib3 재시도 제외)
+            bytes INTEGER NOT NULL DEFAULT 0,    -- 받은 본문 크기 (telegram_send는 보낸 크기)
+            retries INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (cycle_started_at, phase, course_name)
+        )
+        """,
+    )
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.table_name = "cycle_metrics"
+        self._ensure_table()
+
+    def save(self, cycle_started_at: str, phases):
+        with self.storage.transaction() as cur:
+            cur.executemany(f"""INSERT OR REPLACE INTO cycle_metrics
+                                (cycle_started_at, phase, course_name, {", ".join(METRIC_FIELDS)})
+                                VALUES (?, ?, ?, {", ".join("?" * len(METRIC_FIELDS))})""",
+                            [(cycle_started_at, phase, course_name) + tuple(values[field] for field in METRIC_FIELDS)
+                             for (phase, course_name), values in phases.items()])
+
+    def prune(self, max_age: timedelta = METRICS_MAX_AGE):
+        """반환: 삭제한 행 수"""
+        cutoff = (datetime.now(KST) - max_age).strftime("%Y-%m-%d %H:%M:%S")
+        with self.storage.transaction() as cur:
+            cur.execute("DELETE FROM cycle_metrics WHERE cycle_started_at < ?", (cutoff,))
+            return cur.rowcount
+
+    def summary(self, cycles=20, top=10):
+        """
+        최근 cycles개 주기 요약.
+        반환: (주기 수, 단계별 [(phase, seconds, calls, requests, bytes, retries)],
+               과목별 [(course_name, seconds, requests, bytes, retries)]) - 소요 시간 내림차순
+        """
+        sums = ", ".join(f"SUM({field})" for field in METRIC_FIELDS)
+        with self.storage.cursor() as cur:
+            cur.execute("""CREATE TEMP TABLE IF NOT EXISTS recent_cycles (cycle_started_at TEXT PRIMARY KEY)""")
+            cur.execute("DELETE FROM recent_cycles")
+            cur.execute("""INSERT INTO recent_cycles SELECT DISTINCT cycle_started_at FROM cycle_metrics
+                           ORDER BY cycle_started_at DESC LIMIT ?""", (cycles,))
+            cur.execute("SELECT COUNT(*) FROM recent_cycles")
+            cycle_count = cur.fetchone()[0]
+            cur.execute(f"""SELECT phase, {sums} FROM cycle_metrics
+                            WHERE cycle_started_at IN (SELECT cycle_started_at FROM recent_cycles)
+                            GROUP BY phase ORDER BY SUM(seconds) DESC""")
+            phases = cur.fetchall()
+            # submissions는 assignments 안에서 측정되므로 과목 합계에서 제외
+            cur.execute("""SELECT course_name, SUM(seconds), SUM(requests), SUM(bytes), SUM(retries) FROM cycle_metrics
+                           WHERE cycle_started_at IN (SELECT cycle_started_at FROM recent_cycles)
+                             AND course_name != '' AND phase != 'submissions'
+                           GROUP BY course_name ORDER BY SUM(seconds) DESC LIMIT ?""", (top,))
+            courses = cur.fetchall()
+        return cycle_count, phases, courses
+
+class MetricsExporter:
+    """
+    누적 측정값을 Prometheus 텍스트 형식으로 제공하는 로컬 HTTP 엔드포인트 (LMS_METRICS_PORT, 127.0.0.1에만 바인딩).
+    값은 수집 주기가 끝날 때마다 observe()로 더해짐
+    """
+    def __init__(self, port, host="127.0.0.1"):
+        self.port = port
+        self.host = host
+        self.counts = {}
+        self.phases = {}
+        self.last_cycle = None  # (끝난 시각 epoch, 소요 시간)
+
+    def observe(self, counts, phases, cycle_seconds):
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+        for key, values in phases.items():
+            entry = self.phases.setdefault(key, dict.fromkeys(METRIC_FIELDS, 0))
+            for field in METRIC_FIELDS:
+                entry[field] += values[field]
+        self.last_cycle = (time.time(), cycle_seconds)
+
+    @staticmethod
+    def label(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def render(self):
+        lines = []
+        for field in METRIC_FIELDS:
+            name = f"lms_phase_{field}_total"
+            lines.append(f"# TYPE {name} counter")
+            for (phase, course_name), values in sorted(self.phases.items()):
+                lines.append(f'{name}{{phase="{self.label(phase)}",course="{self.label(course_name)}"}} {values[field]}')
+        lines.append("# TYPE lms_counter_total counter")
+        for name, value in sorted(self.counts.items()):
+            lines.append(f'lms_counter_total{{name="{self.label(name)}"}} {value}')
+        if self.last_cycle is not None:
+            lines.append("# TYPE lms_last_cycle_timestamp_seconds gauge")
+            lines.append(f"lms_last_cycle_timestamp_seconds {self.last_cycle[0]:.0f}")
+            lines.append("# TYPE lms_last_cycle_duration_seconds gauge")
+            lines.append(f"lms_last_cycle_duration_seconds {self.last_cycle[1]:.3f}")
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # 요청 헤더는 사용하지 않음
+            path = request_line.split()[1].decode("ascii", "replace") if len(request_line.split()) > 1 else "/"
+            if path.split("?")[0] in ("/", "/metrics"):
+                status, body = "200 OK", self.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        logging.info(f"측정값 엔드포인트: http://{self.host}:{self.port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+def save_cycle_metrics(metrics_db, cycle_started_at, cycle_seconds, exporter=None):
+    """한 수집 주기의 측정값을 저장하고 오래 걸린 단계를 로그로 남김 (CrawlStats는 초기화됨). 반환: (counts, phases)"""
+    crawl_stats.record("cycle", seconds=cycle_seconds, calls=1)
+    counts, phases = crawl_stats.drain()
+    metrics_db.save(cycle_started_at.strftime("%Y-%m-%d %H:%M:%S"), phases)
+    if exporter is not None:
+        exporter.observe(counts, phases, cycle_seconds)
+    by_phase = {}
+    for (phase, _), values in phases.items():
+        if phase != "cycle":
+            by_phase[phase] = by_phase.get(phase, 0) + values["seconds"]
+    slowest = sorted(by_phase.items(), key=lambda item: item[1], reverse=True)[:5]
+    logging.info(
+        f"단계별 소요 시간: {', '.join(f'{phase} {seconds:.1f}초' for phase, seconds in slowest) or '없음'} / "
+        f"요청 {sum(values['requests'] for values in phases.values())}건, "
+        f"{sum(values['bytes'] for values in phases.values()) / 1024:.1f}KB, "
+        f"재시도 {sum(values['retries'] for values in phases.values())}회"
+    )
+    return counts, phases
+
+Account = namedtuple("Account", "id name api_key chat_id")
+
+def default_account():
+    """환경변수(LMS_API_KEY, CHAT_ID)로 설정한 기본 계정 (id 0, DB에는 저장하지 않음)"""
+    return Account(0, "default", API_KEY, chat_id)
+
+class AccountDB(DatabaseBase):
+    """
+    여러 계정 모드의 추가 계정과 계정별 과제 제출 여부.
+    과목 데이터(공지/과제/파일)는 계정이 공유하고, planner와 제출 여부만 계정별로 수집
+    """
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS account (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,  -- 0은 환경변수 기본 계정용으로 비워 둠
+            name TEXT NOT NULL UNIQUE,
+            api_key TEXT NOT NULL,
+            chat_id TEXT NOT NULL,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            created_at TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS account_submission (
+            account_id INTEGER NOT NULL,
+            assignment_id INTEGER NOT NULL,
+            submitted INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (account_id, assignment_id)
+        )
+        """,
+    )
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.table_name = "account"
+        self._ensure_table()
+
+    def add(self, name, api_key, account_chat_id):
+        with self.storage.transaction() as cur:
+            cur.execute("""INSERT INTO account (name, api_key, chat_id, created_at) VALUES (?, ?, ?, ?)
+                           ON CONFLICT (name) DO UPDATE SET api_key=excluded.api_key, chat_id=excluded.chat_id, enabled=1""",
+                        (name, api_key, str(account_chat_id), datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S")))
+
+    def remove(self, name) -> bool:
+        with self.storage.transaction() as cur:
+            cur.execute("SELECT id FROM account WHERE name=?", (name,))
+            row = cur.fetchone()
+            if row is None:
+                return False
+            cur.execute("DELETE FROM account_submission WHERE account_id=?", row)
+            cur.execute("DELETE FROM account WHERE id=?", row)
+            return True
+
+    def get_all(self):
+        """반환: [(Account, enabled)]"""
+        with self.storage.cursor() as cur:
+            cur.execute("SELECT id, name, api_key, chat_id, enabled FROM account ORDER BY id")
+            return [(Account(*row[:4]), bool(row[4])) for row in cur.fetchall()]
+
+    def get_enabled(self):
+        return [account for account, enabled in self.get_all() if enabled]
+
+    def set_submissions(self, tr_list):
+        """tr_list: [(account_id, assignment_id, submitted)]"""
+        updated_at = datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S")
+        with self.storage.transaction() as cur:
+            cur.executemany("""INSERT INTO account_submission (account_id, assignment_id, submitted, updated_at)
+                               VALUES (?, ?, ?, ?)
+                               ON CONFLICT (account_id, assignment_id) DO UPDATE SET
+                                   submitted=excluded.submitted, updated_at=excluded.updated_at""",
+                            [(account_id, assignment_id, int(bool(submitted)), updated_at)
+                             for account_id, assignment_id, submitted in tr_list])
+
+    def is_submitted(self, account_id, assignment_id) -> bool:
+        with self.storage.cursor() as cur:
+            cur.execute("SELECT submitted FROM account_submission WHERE account_id=? AND assignment_id=?",
+                        (account_id, assignment_id))
+            row = cur.fetchone()
+        return bool(row and row[0])
 
 class DatabaseWatcher:
-    def __init__(self, db_instance):
+    """
+    테이블에 새로 추가된 행(id 증가)을 감지.
+    마지막으로 처리한 id를 watcher_cursor 테이블에 저장해, 재시작해도 이미 알린 행을 다시 알리거나 전체를 다시 읽지 않음.
+    처음 실행할 때는 현재 MAX(id)부터 감시 (기존 행은 알리지 않음).
+    """
+    page_size = 100
+
+    def __init__(self, db_instance, columns=("*",)):
         self.db = db_instance
-        self.last_seen_id = self.db.get_latest_data_id() or 0
+        self.columns = columns
+        self.name = self.db.table_name
+        with self.db.storage.transaction() as cur:
+            cur.execute("""CREATE TABLE IF NOT EXISTS watcher_cursor (
+                            name TEXT PRIMARY KEY,
+                            last_seen_id INTEGER NOT NULL)""")
+            cur.execute("SELECT last_seen_id FROM watcher_cursor WHERE name=?", (self.name,))
+            row = cur.fetchone()
+        if row is not None:
+            self.last_seen_id = row[0]
+        else:
+            self._save(self.db.get_latest_data_id() or 0)
+
+    def _save(self, last_seen_id):
+        self.last_seen_id = last_seen_id
+        with self.db.storage.transaction() as cur:
+            cur.execute("""INSERT INTO watcher_cursor (name, last_seen_id) VALUES (?, ?)
+                           ON CONFLICT (name) DO UPDATE SET last_seen_id=excluded.last_seen_id""",
+                        (self.name, last_seen_id))
+
+    def iter_new_rows(self):
+        """
+        last_seen_id 이후 행을 id 순서로 page_size개씩 읽어 (id 제외) columns 값만 yield.
+        커서는 한 페이지를 모두 처리한 뒤 한 번만 저장 → 처리 도중 실패하면 그 페이지는 다음 주기에 다시 처리.
+        호출하는 쪽이 storage.transaction() 안에서 돌면 알림 outbox 기록과 커서 저장이 한 번에 커밋되어 중복 알림도 없음
+        """
+        select_sql = (f"SELECT id, {', '.join(self.columns)} FROM {self.db.table_name} "
+                      f"WHERE id > ? ORDER BY id LIMIT {self.page_size}")
+        while True:
+            with self.db.storage.cursor() as cur:
+                try:
+                    cur.execute(select_sql, (self.last_seen_id,))
+                except sqlite3.OperationalError:
+                    return
+                rows = cur.fetchall()
+            if not rows:
+                return
+            for _, *values in rows:
+                yield tuple(values)
+            self._save(rows[-1][0])
+
+class TelegramDispatcher:
+    """
+    outbox의 메시지를 백그라운드에서 전송.
+      - 같은 채팅방/과목의 대기 메시지를 TELEGRAM_MESSAGE_LIMIT 이내의 요약 메시지로 묶음
+      - 채팅방별 TELEGRAM_MIN_INTERVAL 간격, 분당 TELEGRAM_MAX_PER_MINUTE 건으로 전송 속도 제한
+      - RetryAfter(flood limit)는 안내된 시간만큼, 그 외 네트워크 오류는 지수 백오프로 재시도
+      - 전송 성공 직후 sent로 기록하므로 재시작 시 이미 보낸 메시지는 다시 보내지 않음
+        (전송과 기록 사이에 프로세스가 죽는 경우만 중복 가능)
+      - 사진 앨범은 묶지 않고 하나의 media group으로 보낸 뒤 이미지 파일을 정리
+      - OUTBOX_PRUNE_INTERVAL마다 OUTBOX_MAX_AGE보다 오래된 sent/failed 행을 삭제해 outbox가 계속 커지지 않게 함
+    """
+    def __init__(self, outbox_db: OutboxDB, bot, default_chat_id):
+        self.outbox = outbox_db
+        self.bot = bot
+        self.default_chat_id = default_chat_id
+        self._wakeup = asyncio.Event()
+        self._sent_times = {}  # chat_id -> deque(전송 시각)
+        self._pruned_at = None  # 마지막 outbox 정리 시각 (monotonic)
+
+    def enqueue(self, message, course_name=None, chat_id=None, media=None):
+        self.outbox.enqueue(chat_id or self.default_chat_id, message, course_name, media)
+        self._wakeup.set()
+
+    @staticmethod
+    def build_batches(rows):
+        """
+        rows: [(id, chat_id, course_name, message, attempts, media)]
+        반환: [(chat_id, [id...], text, media)] - 과목별로 묶되 처음 등장한 순서 유지 (앨범은 따로 전송)
+        """
+        groups = {}
+        for row_id, row_chat_id, course_name, message, _, media in rows:
+            # 앨범과 과목이 없는 메시지는 단독 전송
+            key = (row_chat_id, course_name if course_name is not None and not media else f"#{row_id}")
+            groups.setdefault(key, []).append((row_id, message, media))
+
+        batches = []
+        for (row_chat_id, _), messages in groups.items():
+            if messages[0][2]:
+                row_id, message, media = messages[0]
+                batches.append((row_chat_id, [row_id], message, media))
+                continue
+            ids, parts, length = [], [], 0
+            for row_id, message, _ in messages:
+                message = truncate_text(message, TELEGRAM_MESSAGE_LIMIT)
+                if parts and length + len(message) + 2 > TELEGRAM_MESSAGE_LIMIT:
+                    batches.append((row_chat_id, ids, "\n\n".join(parts), None))
+                    ids, parts, length = [], [], 0
+                ids.append(row_id)
+                parts.append(message)
+                length += len(message) + 2
+            if parts:
+                batches.append((row_chat_id, ids, "\n\n".join(parts), None))
+        return batches
+
+    async def _throttle(self, target_chat_id):
+        sent_times = self._sent_times.setdefault(target_chat_id, deque())
+        while True:
+            now = time.monotonic()
+            while sent_times and now - sent_times[0] >= 60:
+                sent_times.popleft()
+            wait = 0
+            if sent_times:
+                wait = TELEGRAM_MIN_INTERVAL - (now - sent_times[-1])
+            if len(sent_times) >= TELEGRAM_MAX_PER_MINUTE:
+                wait = max(wait, 60 - (now - sent_times[0]))
+            if wait <= 0:
+                sent_times.append(now)
+                return
+            await asyncio.sleep(wait)
 
-    def check_for_update(self):
-        con = sqlite3.connect(self.db.db_path, isolation_level=None)
-        cur = con.cursor()
+    async def _send_batch(self, target_chat_id, ids, text, attempts, media=None):
+        await self._throttle(target_chat_id)
+        # 이벤트 루프에서 다른 작업과 겹쳐 실행되므로 phase() 대신 직접 기록 (수집 요청이 이 단계로 잡히지 않게)
+        started = time.perf_counter()
         try:
-            cur.execute(f"SELECT * FROM {self.db.table_name} WHERE id > ?", (self.last_seen_id,))
-            new_data = cur.fetchall()
+            if media:
+                await send_album(self.bot, target_chat_id, text, media)
+            else:
+                await self.bot.send_message(chat_id=target_chat_id, text=text)
+        except telegram.error.RetryAfter as e:
+            crawl_stats.record("telegram_send", seconds=time.perf_counter() - started, requests=1, retries=1)
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            logging.warning(f"텔레그램 flood limit, {retry_after}초 후 재전송 (outbox id={ids})")
+            self.outbox.mark_retry(ids, time.time() + float(retry_after), f"RetryAfter {retry_after}")
+        except (telegram.error.BadRequest, telegram.error.Forbidden) as e:
+            crawl_stats.record("telegram_send", seconds=time.perf_counter() - started, requests=1)
+            logging.error(f"텔레그램 전송 실패, 재시도하지 않음 (outbox id={ids}): {e}")
+            self.outbox.mark_retry(ids, time.time(), str(e), give_up=True)
+            remove_album_files(media)
+        except Exception as e:
+            crawl_stats.record("telegram_send", seconds=time.perf_counter() - started, requests=1, retries=1)
+            give_up = attempts + 1 >= TELEGRAM_MAX_ATTEMPTS
+            delay = min(API_RETRY_BACKOFF_SECONDS * 2 ** attempts, 600)
+            log = logging.error if give_up else logging.warning
+            log(f"텔레그램 전송 실패 ({attempts + 1}/{TELEGRAM_MAX_ATTEMPTS}, outbox id={ids}): {e}")
+            self.outbox.mark_retry(ids, time.time() + delay, str(e), give_up=give_up)
+            if give_up:
+                remove_album_files(media)
+        else:
+            crawl_stats.record("telegram_send", seconds=time.perf_counter() - started, calls=len(ids), requests=1,
+                               bytes=len(text.encode("utf-8")) + sum(os.path.getsize(item["path"]) for item in media or ()
+                                                                       if os.path.exists(item["path"])))
+            self.outbox.mark_sent(ids)
+            remove_album_files(media)
+
+    async def run_once(self):
+        """전송 시각이 된 메시지를 한 번 처리. 보낼 것이 없으면 새 메시지나 재시도 시각까지 대기"""
+        rows = self.outbox.get_due(time.time())
+        if not rows:
+            next_at = self.outbox.next_attempt_at()
+            timeout = None if next_at is None else max(0.0, next_at - time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            # 연달아 들어오는 메시지를 모아서 보내기 위해 잠시 대기
+            await asyncio.sleep(TELEGRAM_DIGEST_WINDOW)
+            return
+
+        attempts = {row[0]: row[4] for row in rows}
+        for target_chat_id, ids, text, media in self.build_batches(rows):
+            await self._send_batch(target_chat_id, ids, text, max(attempts[i] for i in ids), media)
+
+    async def wait_idle(self, timeout):
+        """run()이 실행 중일 때 지금 보낼 수 있는 메시지가 모두 전송될 때까지 대기. 반환: 제한 시간 안에 끝났는지"""
+        deadline = time.monotonic() + timeout
+        while self.outbox.get_due(time.time(), limit=1):
+            if time.monotonic() >= deadline:
+                return False
+            self._wakeup.set()
+            await asyncio.sleep(0.05)
+        return True
+
+    def prune_if_due(self):
+        """OUTBOX_PRUNE_INTERVAL이 지났으면 오래된 outbox 행 정리. 반환: 삭제한 행 수"""
+        now = time.monotonic()
+        if self._pruned_at is not None and now - self._pruned_at < OUTBOX_PRUNE_INTERVAL:
+            return 0
+        self._pruned_at = now
+        pruned = self.outbox.prune()
+        if pruned:
+            logging.info(f"오래된 텔레그램 outbox 행 {pruned}개 삭제")
+        return pruned
+
+    async def run(self):
+        while True:
+            try:
+                self.prune_if_due()
+                await self.run_once()
+            except Exception:
+                logging.error(f"텔레그램 디스패처 에러: {traceback.format_exc()}")
+                await asyncio.sleep(API_RETRY_BACKOFF_SECONDS)
+
+class CommandReader:
+    """
+    텔레그램 명령 응답용 LMS.db 조회. 수집 주기가 쓰는 Storage(공유 연결, 잠금, 트랜잭션) 대신 별도 읽기 전용 연결을 열어
+    WAL 스냅샷을 읽으므로 DB 반영 중에도 잠금을 기다리지 않음. 각 조회는 인덱스(end_date, posted_at, course_name)를 탐
+    """
+    def __init__(self, db_path: str):
+        self.con = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self.con.execute("PRAGMA query_only=ON")
+
+    def close(self):
+        self.con.close()
+
+    def account_id(self, chat) -> int | None:
+        """채팅방의 계정 ID (기본 CHAT_ID는 0). 등록되지 않은 채팅방이면 None"""
+        if chat == str(chat_id):
+            return 0
+        row = self.con.execute("SELECT id FROM account WHERE chat_id=? AND enabled=1 ORDER BY id LIMIT 1",
+                               (chat,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _course_filter(courses, column="course_name"):
+        if courses is None:
+            return "", []
+        return f" AND {column} IN ({', '.join('?' * len(courses))})", list(courses)
+
+    def due(self, account_id, courses, now_utc, limit=COMMAND_LIST_LIMIT):
+        """마감 전 미제출 과제 [(과목명, 과제명, 마감)] - 마감 순, limit + 1개까지 (더 있는지 확인용)"""
+        course_sql, params = self._course_filter(courses, "a.course_name")
+        if account_id == 0:
+            submitted = "a.submitted"
+            join, join_params = "", []
+        else:
+            submitted = "COALESCE(s.submitted, 0)"
+            join = " LEFT JOIN account_submission s ON s.account_id=? AND s.assignment_id=a.assignment_id"
+            join_params = [account_id]
+        return self.con.execute(
+            f"""SELECT a.course_name, a.assignment_name, a.end_date FROM assignment a{join}
+                WHERE a.end_date > ? AND {submitted}=0{course_sql} ORDER BY a.end_date LIMIT ?""",
+            join_params + [now_utc.strftime("%Y-%m-%dT%H:%M:%SZ")] + params + [limit + 1]).fetchall()
+
+    def recent(self, courses, limit):
+        """최근 공지 [(과목명, 제목, 평문, 게시일)] - 게시일 역순"""
+        course_sql, params = self._course_filter(courses)
+        return self.con.execute(
+            f"""SELECT course_name, announcement_title, announcement_text, posted_at FROM announcement
+                WHERE 1{course_sql} ORDER BY posted_at DESC LIMIT ?""", params + [limit]).fetchall()
+
+    def file_courses(self, courses):
+        """강의자료가 있는 과목 [(과목명, 파일 수)]"""
+        course_sql, params = self._course_filter(courses)
+        return self.con.execute(f"""SELECT course_name, COUNT(*) FROM lecture WHERE 1{course_sql}
+                                    GROUP BY course_name ORDER BY course_name""", params).fetchall()
+
+    def files(self, course_name, limit=COMMAND_LIST_LIMIT):
+        """과목의 강의자료 [(파일명, 크기, 수정 시각)] - 최근 수정 순"""
+        return [(file_name.replace("''", "'"), file_size, updated_at) for file_name, file_size, updated_at in self.con.execute(
+            """SELECT file_name, file_size, updated_at FROM lecture WHERE course_name=?
+               ORDER BY updated_at DESC LIMIT ?""", (course_name, limit)).fetchall()]
+
+    def status(self, account_id):
+        """반환: dict(last_cycle, requests, retries, counts, outbox, reminders, next_reminder, search_docs)"""
+        con = self.con
+        last_cycle = con.execute("""SELECT cycle_started_at, seconds FROM cycle_metrics WHERE phase='cycle'
+                                    ORDER BY cycle_started_at DESC LIMIT 1""").fetchone()
+        requests_, retries = con.execute(
+            "SELECT SUM(requests), SUM(retries) FROM cycle_metrics WHERE cycle_started_at=? AND phase!='cycle'",
+            (last_cycle[0] if last_cycle else None,)).fetchone()
+        counts = {table: con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("course", "announcement", "assignment", "lecture")}
+        reminders, next_reminder = con.execute(
+            "SELECT COUNT(*), MIN(fire_at) FROM assignment_notify WHERE status='pending' AND account_id=?",
+            (account_id,)).fetchone()
+        try:
+            search_docs = con.execute("SELECT COUNT(*) FROM search_doc").fetchone()[0]
         except sqlite3.OperationalError:
-            con.close()
-            return []
-        con.close()
-        if new_data:
-            self.last_seen_id = max(row[0] for row in new_data)
-        return new_data
+            search_docs = None
+        return {
+            "last_cycle": last_cycle,
+            "requests": requests_ or 0,
+            "retries": retries or 0,
+            "counts": counts,
+            "outbox": con.execute("SELECT COUNT(*) FROM telegram_outbox WHERE status='pending'").fetchone()[0],
+            "reminders": reminders,
+            "next_reminder": next_reminder,
+            "search_docs": search_docs,
+        }
+
+    def search(self, query, courses, limit=10):
+        return SearchIndexDB.query(self.con.cursor(), query, limit, courses=courses)
+
+class TelegramCommandHandler:
+    """
+    텔레그램 명령에 LMS.db만 읽어 답하는 태스크 (loop_main과 함께 실행).
+      - getUpdates long polling으로 명령을 받고, 답은 CommandReader 조회 결과로만 만듦 (Canvas 요청 없음)
+      - 조회는 전용 스레드 하나에서 실행하므로 이벤트 루프(수집 주기, 알림 전송)를 막지 않음
+      - 기본 CHAT_ID와 account 테이블의 채팅방에만 답하며, 제출 여부/수강 과목은 그 계정 기준
+      - 답장은 outbox를 거치지 않고 바로 보냄 (알림 묶음 대기 없이 즉시)
+    """
+    commands = {
+        "due": "마감 전 미제출 과제",
+        "recent": "최근 공지 (/recent 개수)",
+        "files": "과목 강의자료 (/files 과목명)",
+        "search": "공지/과제/강의자료 검색 (/search 검색어)",
+        "status": "봇 상태와 마지막 수집 주기",
+        "help": "명령 목록",
+    }
+
+    def __init__(self, bot, reader: CommandReader, scheduler=None, poll_timeout=TELEGRAM_POLL_TIMEOUT):
+        self.bot = bot
+        self.reader = reader
+        self.scheduler = scheduler
+        self.poll_timeout = poll_timeout
+        self.offset = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="telegram-command")
+
+    def close(self):
+        self.executor.shutdown(wait=True)  # 진행 중인 조회(수 ms)가 끝난 뒤 연결을 닫음
+        self.reader.close()
+
+    @staticmethod
+    def chat_courses(chat):
+        """여러 계정 모드에서 이 채팅방 계정이 듣는 과목명 목록 (한 계정이면 None: 전체)"""
+        if not course_chats:
+            return None
+        return [course_name for course_name, chats in course_chats.items() if chat in map(str, chats)]
+
+    def collector_state(self):
+        """메모리에만 있는 수집 상태 (이벤트 루프 스레드에서 읽음)"""
+        if self.scheduler is None:
+            return None
+        return {"quiet": self.scheduler.quiet_seconds_left(), "failures": self.scheduler.failures,
+                "next_poll": self.scheduler.seconds_until_next() if self.scheduler.next_poll else None}
+
+    def answer(self, command, argument, account_id, courses, state):
+        """명령 응답 문자열 (전용 스레드에서 실행)"""
+        now_utc = datetime.now(timezone.utc)
+        if command == "due":
+            rows = self.reader.due(account_id, courses, now_utc)
+            if not rows:
+                return "마감 전 미제출 과제가 없습니다."
+            lines = [f"📌 마감 전 미제출 과제{f' (앞의 {COMMAND_LIST_LIMIT}건)' if len(rows) > COMMAND_LIST_LIMIT else ''}"]
+            for course_name, assignment_name, end_date in rows[:COMMAND_LIST_LIMIT]:
+                due_at = parse_canvas_dt(end_date)
+                lines.append(f"- {due_at.astimezone(KST).strftime('%m/%d %H:%M')} ({remaining_label((due_at - now_utc).total_seconds())} 남음) "
+                             f"{course_name} / {assignment_name}")
+            return "\n".join(lines)
+        if command == "recent":
+            limit = min(int(argument), COMMAND_LIST_LIMIT) if argument.isdigit() and int(argument) > 0 else 5
+            rows = self.reader.recent(courses, limit)
+            if not rows:
+                return "저장된 공지가 없습니다."
+            return "\n\n".join(f"📢 {course_name} / {title} ({format_to_kst(posted_at)})\n"
+                               f"{truncate_text(' '.join((text or '').split()), 200)}"
+                               for course_name, title, text, posted_at in rows)
+        if command == "files":
+            file_courses = self.reader.file_courses(courses)
+            matches = [(name, count) for name, count in file_courses if argument and argument.lower() in name.lower()]
+            exact = [(name, count) for name, count in matches if name.lower() == argument.lower()]
+            matches = exact or matches
+            if len(matches) != 1:
+                header = ("과목명을 입력해 주세요: /files 과목명" if not argument else
+                          f"'{argument}' 과목이 없습니다." if not matches else f"'{argument}'에 해당하는 과목이 여러 개입니다.")
+                return "\n".join([header] + [f"- {name} ({count}개)" for name, count in matches or file_courses])
+            course_name, count = matches[0]
+            lines = [f"📁 {course_name} 강의자료 {count}개 (최근 수정 순)"]
+            for file_name, file_size, updated_at in self.reader.files(course_name):
+                size = ("-" if not file_size else f"{file_size / 1024 / 1024:.1f}MB" if file_size >= 1024 * 1024
+                        else f"{file_size / 1024:.0f}KB")
+                lines.append(f"- {file_name} ({size}, {format_to_kst(updated_at)[:16]})")
+            return "\n".join(lines)
+        if command == "search":
+            if not argument:
+                return "검색어를 입력해 주세요: /search 검색어"
+            try:
+                hits = self.reader.search(argument, courses)
+            except sqlite3.OperationalError:
+                return "검색 색인을 사용할 수 없습니다."
+            if not hits:
+                return f"'{argument}' 검색 결과가 없습니다."
+            return f"🔎 '{argument}' 검색 결과 {len(hits)}건\n" + "\n".join(format_search_hit(hit) for hit in hits)
+        if command == "status":
+            status = self.reader.status(account_id)
+            lines = ["🤖 LMS Bot 상태"]
+            if status["last_cycle"]:
+                started_at, seconds = status["last_cycle"]
+                lines.append(f"마지막 수집: {started_at} ({seconds:.1f}초, 요청 {status['requests']}건, "
+                             f"재시도 {status['retries']}회)")
+            else:
+                lines.append("마지막 수집: 기록 없음")
+            if state is not None:
+                if state["quiet"]:
+                    lines.append(f"휴식 시간: {remaining_label(state['quiet'])} 후 수집 재개")
+                elif state["next_poll"] is not None:
+                    lines.append(f"다음 수집: {remaining_label(state['next_poll'])} 후")
+                if state["failures"]:
+                    lines.append(f"연속 실패: {state['failures']}회")
+            counts = status["counts"]
+            lines.append(f"저장된 항목: 과목 {counts['course']}, 공지 {counts['announcement']}, "
+                         f"과제 {counts['assignment']}, 강의자료 {counts['lecture']}")
+            if status["search_docs"] is not None:
+                lines.append(f"검색 색인: 문서 {status['search_docs']}개")
+            next_reminder = (f", 다음 {datetime.fromtimestamp(status['next_reminder'], KST).strftime('%m/%d %H:%M')}"
+                             if status["next_reminder"] else "")
+            lines.append(f"예약된 마감 알림: {status['reminders']}건{next_reminder}")
+            lines.append(f"보내지 않은 알림: {status['outbox']}건")
+            return "\n".join(lines)
+        return "사용할 수 있는 명령\n" + "\n".join(f"/{name} - {help_text}" for name, help_text in self.commands.items())
+
+    async def handle(self, chat, text):
+        """명령 하나를 처리. 반환: 응답 문자열 (등록되지 않은 채팅방이거나 명령이 아니면 None)"""
+        command, _, argument = text.strip().partition(" ")
+        if not command.startswith("/"):
+            return None
+        command = command[1:].split("@")[0].lower()  # 그룹 채팅의 /due@봇이름
+        loop = asyncio.get_running_loop()
+        account_id = await loop.run_in_executor(self.executor, self.reader.account_id, chat)
+        if account_id is None:
+            logging.warning(f"등록되지 않은 채팅방의 텔레그램 명령 무시 (chat_id={chat}): {command}")
+            return None
+        started = time.perf_counter()
+        try:
+            reply = await loop.run_in_executor(self.executor, self.answer, command, argument.strip(), account_id,
+                                               self.chat_courses(chat), self.collector_state())
+        except Exception:
+            logging.error(f"텔레그램 명령 처리 에러 ({command}): {traceback.format_exc()}")
+            reply = "❗ 조회 중 에러가 발생했습니다."
+        crawl_stats.record("telegram_command", seconds=time.perf_counter() - started, calls=1)
+        return truncate_text(reply, TELEGRAM_MESSAGE_LIMIT)
+
+    async def run_once(self):
+        updates = await self.bot.get_updates(offset=self.offset, timeout=self.poll_timeout, allowed_updates=["message"])
+        for update in updates:
+            self.offset = update.update_id + 1
+            message = update.message
+            if message is None or not message.text:
+                continue
+            if message.date is not None and datetime.now(timezone.utc) - message.date > COMMAND_MAX_AGE:
+                continue
+            reply = await self.handle(str(message.chat_id), message.text)
+            if reply is not None:
+                await self.bot.send_message(chat_id=message.chat_id, text=reply)
+
+    async def run(self):
+        try:
+            await self.bot.set_my_commands(list(self.commands.items()))
+        except Exception as e:
+            logging.warning(f"텔레그램 명령 목록 등록 실패: {e}")
+        while True:
+            try:
+                await self.run_once()
+            except telegram.error.Conflict as e:
+                # 같은 봇 토큰으로 다른 프로세스가 getUpdates 중이거나 webhook이 설정된 경우
+                logging.warning(f"텔레그램 명령 수신 충돌, 1분 후 다시 시도: {e}")
+                await asyncio.sleep(60)
+            except Exception:
+                logging.error(f"텔레그램 명령 수신 에러: {traceback.format_exc()}")
+                await asyncio.sleep(API_RETRY_BACKOFF_SECONDS)
 
 def make_dir(dir_name):
     if not os.path.exists(dir_name):
@@ -551,34 +2845,950 @@ def render_pdf_pages(pdf_path, output_base):
         return None
     return (result.stderr or result.stdout or f"exit status {result.returncode}").strip()
 
-def download_canvas_file(file, destination, course_name):
-    try:
-        file.download(destination)
+def file_sha256(file_path):
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class BandwidthLimiter:
+    """여러 다운로드 스레드가 공유하는 전체 대역폭 제한 (bytes/s, 0이면 제한 없음)"""
+    def __init__(self, bytes_per_second: float):
+        self.rate = bytes_per_second
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def consume(self, size: int) -> None:
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + size / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+class FileDownloader:
+    """
+    Canvas 파일을 청크 단위로 스트리밍해 받는 다운로드 엔진.
+      - DOWNLOAD_CONCURRENCY개를 동시에 받고, 전체 속도는 BandwidthLimiter로 제한
+      - tmp 디렉터리의 .part 파일에 받다가 끊기면 다음 주기에 HTTP Range로 이어받음
+        (.part 이름에 Canvas updated_at을 넣어 다른 버전과 섞이지 않게 함)
+      - 받으면서 SHA-256을 계산해 반환
+    """
+    def __init__(self, session, headers, tmp_dir, concurrency=None, bandwidth_limit=None):
+        self.session = session
+        self.headers = headers
+        self.tmp_dir = tmp_dir
+        self.concurrency = concurrency or DOWNLOAD_CONCURRENCY
+        self.limiter = BandwidthLimiter(DOWNLOAD_BANDWIDTH_LIMIT if bandwidth_limit is None else bandwidth_limit)
+
+    def part_path(self, file):
+        stamp = "".join(ch for ch in str(getattr(file, "updated_at", "") or "") if ch.isalnum())
+        return os.path.join(self.tmp_dir, f"{file.id}-{stamp}.part")
+
+    def download(self, file, destination, headers=None):
+        """file을 destination에 받고 SHA-256 반환 (스레드에서 실행). headers를 주면 기본 인증 헤더 대신 사용"""
+        part_path = self.part_path(file)
+        for stale in glob.glob(os.path.join(self.tmp_dir, f"{file.id}-*.part")):
+            if stale != part_path:
+                os.remove(stale)
+
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if file.size is not None and offset > file.size:
+            offset = 0
+        hasher = hashlib.sha256()
+        if offset:
+            with open(part_path, "rb") as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+
+        if file.size is None or offset < file.size:
+            headers = dict(headers or self.headers)
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+            with self.session.get(file.url, headers=headers, stream=True, timeout=API_REQUEST_TIMEOUT) as response:
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # 서버가 Range를 무시하면 처음부터 다시 받음
+                    offset = 0
+                    hasher = hashlib.sha256()
+                elif offset:
+                    logging.info(f"⏯️ 이어받기: {file.display_name} ({offset} bytes부터)")
+                received = 0
+                with open(part_path, "ab" if offset else "wb") as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        self.limiter.consume(len(chunk))
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        received += len(chunk)
+                crawl_stats.record(*crawl_stats.current_phase(), bytes=received)
+
+        if file.size is not None and os.path.getsize(part_path) != file.size:
+            raise IOError(f"다운로드 크기 불일치 (expected={file.size}, actual={os.path.getsize(part_path)})")
+        # tmp와 LMS_FILE_PATH가 다른 마운트일 수 있어 os.replace 대신 shutil.move (EXDEV 시 복사 후 삭제)
+        shutil.move(part_path, destination)
+        return hasher.hexdigest()
+
+    async def download_all(self, jobs):
+        """jobs(dict, file/destination 필수)를 병렬로 받고 끝나는 순서대로 (job, sha256, error) yield"""
+        if not jobs:
+            return
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="canvas-download") as executor:
+            def measured_download(job):
+                with crawl_stats.phase("download", job.get("course_name")):
+                    return self.download(job["file"], job["destination"], job.get("headers"))
+
+            async def run(job):
+                try:
+                    return job, await loop.run_in_executor(executor, measured_download, job), None
+                except (CanvasException, requests.exceptions.RequestException, OSError) as e:
+                    return job, None, e
+
+            for finished in asyncio.as_completed([run(job) for job in jobs]):
+                yield await finished
+
+def latest_timestamp(*values):
+    """Canvas 시각 문자열 중 가장 늦은 값 (None 무시)"""
+    latest = None
+    for value in values:
+        value = to_str(value)
+        if value and (latest is None or parse_canvas_dt(value) > parse_canvas_dt(latest)):
+            latest = value
+    return latest
+
+def is_newer(timestamp, since):
+    if since is None:
+        return True
+    timestamp = to_str(timestamp)
+    if not timestamp:
         return True
-    except (CanvasException, requests.exceptions.RequestException) as e:
+    return parse_canvas_dt(timestamp) > parse_canvas_dt(since)
+
+def fetch_course_announcements(course, course_name, since=None):
+    """
+    반환: (공지 목록, 최신 활동 시각). since가 있으면 최근 활동 순으로 받아 since 이전 항목에서 중단.
+    공지 API는 수정 시각을 주지 않아 커서로는 본문 수정을 알 수 없으므로, 최근 ANNOUNCEMENT_RECHECK_COUNT개는
+    커서 이전이어도 다시 비교한다 (첫 페이지 안이라 요청이 늘지 않음). 그보다 오래된 공지의 수정은
+    전체 재검증(FULL_SYNC_INTERVAL) 때 발견된다.
+    """
+    kwargs = {"only_announcements": True}
+    if since is not None:
+        kwargs["order_by"] = "recent_activity"
+    announcement_list, cursor = [], since
+    for index, announcement in enumerate(course.get_discussion_topics(**kwargs)):
+        activity = latest_timestamp(announcement.posted_at, getattr(announcement, "last_reply_at", None))
+        if not is_newer(activity, since) and index >= ANNOUNCEMENT_RECHECK_COUNT:
+            break
+        cursor = latest_timestamp(cursor, activity)
+        announcement_list.append((
+            announcement.id,
+            course.id,
+            course_name,
+            announcement.title,
+            announcement.message,
+            announcement.posted_at
+        ))
+        if not is_newer(activity, since) and index + 1 >= ANNOUNCEMENT_RECHECK_COUNT:
+            # 다음 항목은 더 오래됐고 재확인 범위 밖이므로 다음 페이지를 요청하지 않음
+            break
+    return announcement_list, cursor
+
+def fetch_course_assignments(course, course_name, planner_submissions, since=None):
+    """
+    반환: (과제 목록, 최신 updated_at).
+    과제 목록 API는 updated_since도 updated_at 정렬도 지원하지 않으므로, since가 있으면 bucket=future로
+    마감이 지나지 않았거나 마감이 없는 과제만 받는다. 그중 since 이후 수정된 과제와 planner에 있는 과제만
+    DB 비교 대상으로 남긴다. 마감이 지난 과제의 수정은 전체 재검증(FULL_SYNC_INTERVAL) 때 발견된다.
+    """
+    kwargs = {"include": ["submission"]}
+    if since is not None:
+        kwargs["bucket"] = "future"
+    assignment_list, cursor = [], since
+    for assignment in course.get_assignments(**kwargs):
+        updated_at = getattr(assignment, "updated_at", None)
+        cursor = latest_timestamp(cursor, updated_at)
+        if not is_newer(updated_at, since) and assignment.id not in planner_submissions:
+            continue
+        unlock_at = assignment.unlock_at
+        if unlock_at is None:
+            unlock_at = assignment.created_at
+        due_at = assignment.due_at
+        if due_at is None:
+            due_at = assignment.lock_at
+        submitted = planner_submissions.get(assignment.id)
+        if submitted is None:
+            # include[]=submission으로 목록과 함께 받은 제출 정보 사용, 없을 때만 개별 요청
+            submitted = submission_status(getattr(assignment, "submission", None))
+            if submitted is not None:
+                crawl_stats.add("submission_requests_avoided")
+            else:
+                try:
+                    with crawl_stats.phase("submissions", course_name):
+                        submitted = submission_status(assignment.get_submission("self"))
+                    crawl_stats.add("submission_requests")
+                except Exception as e:
+                    submitted = None
+                    logging.warning(f"과제 제출 여부 확인 실패 ({assignment.id}): {e}")
+        assignment_list.append((
+            assignment.id,
+            course.id,
+            course_name,
+            assignment.name,
+            unlock_at,
+            due_at,
+            assignment.description,
+            submitted,
+        ))
+        logging.info(f"과제 처리, course_name: {course_name}, assignment_id: {assignment.id}, assignment_name: {assignment.name}, unlock_at: {unlock_at}, due_at: {due_at}")
+    return assignment_list, cursor
+
+def fetch_course_files(course, since=None):
+    """반환: (파일 목록, 최신 updated_at). since가 있으면 updated_at 내림차순으로 받아 since 이전 파일에서 중단"""
+    if since is None:
+        files = list(course.get_files())
+        return files, latest_timestamp(*(getattr(file, "updated_at", None) for file in files))
+    file_list, cursor = [], since
+    for file in course.get_files(sort="updated_at", order="desc"):
+        updated_at = getattr(file, "updated_at", None)
+        if not is_newer(updated_at, since):
+            break
+        cursor = latest_timestamp(cursor, updated_at)
+        file_list.append(file)
+    return file_list, cursor
+
+def decide_sync_since(sync_state, course_id, resource, now_kst):
+    """
+    증분 수집 기준 시각 결정. None이면 전체 수집.
+      - LMS_SYNC_MODE=full 이거나 저장된 커서가 없으면 전체 수집
+      - 마지막 전체 수집 후 FULL_SYNC_INTERVAL이 지났으면 전체 재검증
+    """
+    if SYNC_MODE != "incremental" or not sync_state:
+        return None
+    cursor, last_full_sync = sync_state.get((course_id, resource), (None, None))
+    if cursor is None or last_full_sync is None:
+        return None
+    if now_kst - datetime.fromisoformat(last_full_sync) >= FULL_SYNC_INTERVAL:
+        return None
+    return cursor
+
+def parse_quiet_hours(spec):
+    """'2-6' → (2, 6). 자정을 넘는 '23-6'도 가능하고, 빈 값이나 'off'면 None"""
+    if not spec or spec.strip().lower() == "off":
+        return None
+    start, end = (int(hour) for hour in spec.split("-", 1))
+    return (start, end) if start != end else None
+
+class PollScheduler:
+    """
+    과목/리소스별 다음 수집 시각 관리 (고정 600초 대기와 새벽 2~6시 휴식을 대체).
+      - 기본 간격: POLL_INTERVALS (리소스별)
+      - 미제출 과제 마감이 POLL_URGENT_WINDOW 안에 있는 과목의 공지/과제: POLL_URGENT_INTERVAL
+      - 커서(가장 최근 수정 시각)가 POLL_IDLE_AFTER보다 오래됐거나 종강한 과목: POLL_IDLE_FACTOR배
+      - 수집 주기 전체가 실패하면 지수 백오프, QUIET_HOURS 동안은 수집하지 않음
+    상태는 메모리에만 두므로 재시작하면 모든 리소스를 한 번 수집한 뒤 다시 간격을 정함
+    """
+    def __init__(self, intervals=None, quiet_hours=QUIET_HOURS):
+        self.intervals = intervals or POLL_INTERVALS
+        self.quiet_hours = parse_quiet_hours(quiet_hours)
+        self.next_poll = {}  # (course_id, resource) -> epoch 초
+        self.failures = 0
+        self.retry_at = None
+
+    def is_due(self, course_id, resource):
+        return self.next_poll.get((course_id, resource), 0) <= time.time()
+
+    def interval(self, course, resource, cursor, urgent_due, now_utc):
+        base = self.intervals.get(resource, 600.0)
+        if resource != "files" and urgent_due is not None and urgent_due - now_utc <= POLL_URGENT_WINDOW:
+            return min(base, POLL_URGENT_INTERVAL)
+        end_at = parse_canvas_dt(getattr(course, "end_at", None))
+        last_change = parse_canvas_dt(cursor)
+        if (end_at is not None and end_at < now_utc) or (last_change is not None and now_utc - last_change >= POLL_IDLE_AFTER):
+            return min(base * POLL_IDLE_FACTOR, POLL_MAX_INTERVAL)
+        return base
+
+    def record_success(self, crawled_courses, upcoming_due):
+        """
+        crawled_courses: crawl_courses 반환값 (수집한 리소스만 cursors에 있음)
+        upcoming_due: {course_id: 가장 가까운 미제출 과제 마감(UTC)}
+        """
+        now, now_utc = time.time(), datetime.now(timezone.utc)
+        self.failures, self.retry_at = 0, None
+        for course, *_, cursors in crawled_courses:
+            for resource, (cursor, _) in cursors.items():
+                self.next_poll[(course.id, resource)] = now + self.interval(
+                    course, resource, cursor, upcoming_due.get(course.id), now_utc)
+
+    def record_failure(self):
+        """반환: 다시 시도하기까지 대기할 시간 (초)"""
+        self.failures += 1
+        delay = min(60.0 * 2 ** (self.failures - 1), POLL_MAX_INTERVAL)
+        self.retry_at = time.time() + delay
+        return delay
+
+    def seconds_until_next(self):
+        now = time.time()
+        if self.retry_at is not None:
+            wait = self.retry_at - now
+        else:
+            wait = min(self.next_poll.values(), default=now) - now
+        return max(wait, POLL_MIN_SLEEP)
+
+    def quiet_seconds_left(self, now_kst=None):
+        """조용한 시간이면 끝날 때까지 남은 시간 (초), 아니면 0"""
+        if self.quiet_hours is None:
+            return 0
+        now_kst = now_kst or datetime.now(KST)
+        start, end = self.quiet_hours
+        hour = now_kst.hour
+        if not (start <= hour < end if start < end else (hour >= start or hour < end)):
+            return 0
+        end_at = now_kst.replace(hour=end, minute=0, second=0, microsecond=0)
+        if end_at <= now_kst:
+            end_at += timedelta(days=1)
+        return (end_at - now_kst).total_seconds()
+
+def list_account_courses(canvas):
+    with crawl_stats.phase("courses"):
+        return list(canvas.get_courses(enrollment_state='active'))
+
+async def list_shared_courses(canvases):
+    """
+    여러 계정 모드: 계정마다 활성 과목 목록을 받아 과목별로 하나로 합침.
+    canvases: {account_id: Canvas} (앞쪽 계정의 과목 객체를 우선 사용 → 그 계정의 토큰으로 과목 데이터를 수집)
+    반환: (과목 목록, {course_id: [account_id, ...]})
+    """
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=max(1, min(len(canvases), CRAWL_CONCURRENCY)), thread_name_prefix="canvas-courses") as executor:
+        listings = await asyncio.gather(*(
+            loop.run_in_executor(executor, list_account_courses, canvas) for canvas in canvases.values()))
+    courses, enrollments = {}, {}
+    for account_id, listing in zip(canvases, listings):
+        for course in listing:
+            courses.setdefault(course.id, course)
+            enrollments.setdefault(course.id, []).append(account_id)
+    return list(courses.values()), enrollments
+
+async def crawl_courses(canvas, planner_submissions, mode=None, concurrency=None, sync_state=None, due=None, courses=None):
+    """
+    활성 과목과 과목별 공지/과제/파일 목록을 수집 (courses를 주면 과목 목록 요청 없이 그 과목들을 수집).
+    반환: [(course, course_name, course_code, announcements, assignments, files, cursors), ...] (과목 순서 유지)
+      - cursors: {resource: (새 커서, 전체 수집 여부)} → 수집 결과가 DB에 반영된 뒤 SyncCursorDB에 저장
+      - due(course_id, resource)가 False인 리소스는 요청하지 않고 빈 목록으로 반환 (cursors에도 없음)
+      - serial: 과목을 하나씩 순서대로 수집하고 과목 사이에 1초 대기 (기존 동작)
+      - concurrent: 과목과 과목별 하위 리소스를 스레드 풀에서 병렬로 수집
+                    (요청 속도는 configure_canvas_session의 HostRateLimiter가 제한)
+    """
+    mode = mode or CRAWL_MODE
+    concurrency = concurrency or CRAWL_CONCURRENCY
+    now_kst = datetime.now(timezone.utc).astimezone(KST)
+
+    def plan(course):
+        course_name = course.name.split('-')[0]
+        course_code = '-'.join(course.course_code.split('-')[1:])
+        since = {resource: decide_sync_since(sync_state, course.id, resource, now_kst)
+                 for resource in SYNC_RESOURCES if due is None or due(course.id, resource)}
+        return course_name, course_code, since
+
+    def pack(course, course_name, course_code, since, announcements, assignments, files):
+        fetched = dict(zip(SYNC_RESOURCES, (announcements, assignments, files)))
+        cursors = {resource: (fetched[resource][1], since[resource] is None) for resource in since}
+        return (course, course_name, course_code,
+                announcements[0], assignments[0], files[0], cursors)
+
+    def measured(resource, course_name, func, *args):
+        with crawl_stats.phase(resource, course_name):
+            return func(*args)
+
+    def list_courses():
+        with crawl_stats.phase("courses"):
+            return list(canvas.get_courses(enrollment_state='active'))
+
+    skipped = ([], None)
+    if mode == "serial":
+        results = []
+        for course in courses if courses is not None else list_courses():
+            course_name, course_code, since = plan(course)
+            results.append(pack(
+                course, course_name, course_code, since,
+                measured("announcements", course_name, fetch_course_announcements, course, course_name, since["announcements"]) if "announcements" in since else skipped,
+                measured("assignments", course_name, fetch_course_assignments, course, course_name, planner_submissions, since["assignments"]) if "assignments" in since else skipped,
+                measured("files", course_name, fetch_course_files, course, since["files"]) if "files" in since else skipped,
+            ))
+            await asyncio.sleep(1)
+        return results
+
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="canvas-crawl") as executor:
+        if courses is None:
+            courses = await loop.run_in_executor(executor, list_courses)
+
+        async def fetch(resource, since, course_name, func, *args):
+            if resource not in since:
+                return skipped
+            return await loop.run_in_executor(executor, measured, resource, course_name, func, *args, since[resource])
+
+        async def crawl_course(course):
+            course_name, course_code, since = plan(course)
+            announcements, assignments, files = await asyncio.gather(
+                fetch("announcements", since, course_name, fetch_course_announcements, course, course_name),
+                fetch("assignments", since, course_name, fetch_course_assignments, course, course_name, planner_submissions),
+                fetch("files", since, course_name, fetch_course_files, course),
+            )
+            return pack(course, course_name, course_code, since, announcements, assignments, files)
+
+        return list(await asyncio.gather(*(crawl_course(course) for course in courses)))
+
+def page_label(index, page_count):
+    """pdftoppm 출력 파일명과 같은 형식의 페이지 번호 (페이지 수 자릿수만큼 0으로 채움)"""
+    return str(index + 1).zfill(len(str(page_count)))
+
+def page_count_changes(old_count, new_count):
+    """페이지 수가 달라졌을 때 뒤쪽에 추가/삭제된 페이지 범위 (예: ["4-6 추가"], ["3 삭제"])"""
+    if old_count == new_count:
+        return []
+    first, last = sorted((old_count, new_count))
+    pages = str(first + 1) if last == first + 1 else f"{first + 1}-{last}"
+    return [f"{pages} {'추가' if new_count > old_count else '삭제'}"]
+
+def pdf_page_fingerprint(doc, page):
+    """페이지 content stream, 참조 이미지/XObject 원본 스트림, 텍스트로 만든 해시 (렌더링 없이 계산)"""
+    hasher = hashlib.sha256()
+    hasher.update(page.read_contents())
+    for image in page.get_images(full=True):
+        hasher.update(doc.xref_stream_raw(image[0]) or b"")
+    for xobject in page.get_xobjects():
+        hasher.update(doc.xref_stream_raw(xobject[0]) or b"")
+    hasher.update(page.get_text("text").encode("utf-8"))
+    return hasher.hexdigest()
+
+def render_pdf_page(page, dpi=None):
+    """페이지를 낮은 해상도 회색조로 렌더링해 (width, height, bytes) 반환"""
+    pixmap = page.get_pixmap(dpi=dpi or PDF_DIFF_DPI, colorspace=pymupdf.csGRAY, alpha=False)
+    return pixmap.width, pixmap.height, pixmap.samples
+
+def render_hash(rendered):
+    width, height, samples = rendered
+    return hashlib.sha256(f"{width}x{height}:".encode() + samples).hexdigest()
+
+def perceptual_hash(page):
+    """9x8 회색조로 렌더링한 뒤 가로로 이웃한 픽셀의 밝기 비교로 만든 64비트 dHash (hex)"""
+    rect = page.rect
+    pixmap = page.get_pixmap(matrix=pymupdf.Matrix(9 / rect.width, 8 / rect.height), colorspace=pymupdf.csGRAY, alpha=False)
+    samples, stride = pixmap.samples, pixmap.stride
+    bits = 0
+    for y in range(8):
+        row = samples[y * stride:y * stride + 9]
+        for x in range(8):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return f"{bits:016x}"
+
+def perceptual_distance(old_hash, new_hash):
+    """두 dHash(hex)의 해밍 거리"""
+    return bin(int(old_hash, 16) ^ int(new_hash, 16)).count("1")
+
+def page_fingerprints(doc, page):
+    """렌더링 없이 계산할 수 있는 지문 (render_hash/perceptual_hash는 필요할 때 채움)"""
+    return {
+        "page_hash": pdf_page_fingerprint(doc, page),
+        "render_hash": None,
+        "perceptual_hash": None,
+        "text_hash": hashlib.sha256(page.get_text("text").encode("utf-8")).hexdigest(),
+    }
+
+def open_pdf(pdf_path):
+    """반환: (문서, 에러 메시지)"""
+    try:
+        doc = pymupdf.open(pdf_path)
+    except Exception as e:
+        return None, str(e)
+    if doc.needs_pass:
+        doc.close()
+        return None, "암호화된 PDF"
+    return doc, None
+
+def diff_pdf_pages(old_pdf, new_pdf, old_file_hash=None, new_file_hash=None, fingerprint_db=None):
+    """
+    PyMuPDF로 프로세스 안에서 두 PDF를 페이지별로 비교.
+    페이지 해시가 같으면 건너뛰고, 텍스트 해시가 다르면 렌더링 없이 변경으로 판단.
+    텍스트가 같을 때만 새 페이지를 낮은 해상도로 렌더링해 기존 페이지의 렌더링 해시와 비교하고,
+    PDF_DHASH_NOISE_BITS를 켠 경우에만, 렌더링 해시가 달라도 dHash 차이가 그 이하면 잡음으로 보고 무시.
+    fingerprint_db에 기존 파일(old_file_hash)의 지문이 있으면 기존 PDF는 열지도 렌더링하지도 않음.
+    새 파일 지문은 new_file_hash로 저장해 다음 비교에서 기존 파일 지문으로 사용.
+    반환: (변경된 페이지 번호 목록, 에러 메시지) - 양쪽에 모두 있는 페이지만 비교하고,
+    페이지 수가 다르면 목록 끝에 추가/삭제된 범위(page_count_changes)를 덧붙임
+    """
+    cached_old = fingerprint_db.get(old_file_hash) if fingerprint_db is not None and old_file_hash else None
+    new_doc, new_error = open_pdf(new_pdf)
+    old_doc, old_error = (None, None) if cached_old is not None else open_pdf(old_pdf)
+    try:
+        if old_error or new_error:
+            errors = []
+            if old_error:
+                errors.append(f"기존 PDF: {old_error}")
+            if new_error:
+                errors.append(f"새 PDF: {new_error}")
+            return [], " / ".join(errors)
+
+        old_count = len(cached_old) if cached_old is not None else old_doc.page_count
+        changed_pages, new_prints = [], []
+        for index in range(new_doc.page_count):
+            new_page = new_doc[index]
+            new_print = page_fingerprints(new_doc, new_page)
+            new_prints.append(new_print)
+            if index >= old_count:
+                continue
+            if cached_old is not None:
+                old_print = cached_old[index]
+            else:
+                old_print = page_fingerprints(old_doc, old_doc[index])
+            if old_print["page_hash"] == new_print["page_hash"]:
+                new_print["render_hash"] = old_print["render_hash"]
+                new_print["perceptual_hash"] = old_print["perceptual_hash"]
+                continue
+
+            if old_print["text_hash"] != new_print["text_hash"]:
+                # 글자가 바뀐 페이지는 렌더링해 볼 필요 없이 변경 (렌더링 해시는 다음 비교에서 필요할 때 채움)
+                changed_pages.append(page_label(index, old_count))
+                continue
+
+            new_print["render_hash"] = render_hash(render_pdf_page(new_page))
+            new_print["perceptual_hash"] = perceptual_hash(new_page)
+            old_render_hash, old_perceptual_hash = old_print["render_hash"], old_print["perceptual_hash"]
+            if old_render_hash is None or old_perceptual_hash is None:
+                # 캐시에 렌더링 지문이 없는 페이지만 기존 PDF를 열어 렌더링
+                if old_doc is None:
+                    old_doc, old_error = open_pdf(old_pdf)
+                    if old_error:
+                        return [], f"기존 PDF: {old_error}"
+                if old_render_hash is None:
+                    old_render_hash = render_hash(render_pdf_page(old_doc[index]))
+                if old_perceptual_hash is None:
+                    old_perceptual_hash = perceptual_hash(old_doc[index])
+            if old_render_hash == new_print["render_hash"]:
+                continue
+            # 텍스트가 같고 축소 이미지의 밝기 구조도 거의 같으면 안티앨리어싱/재압축 잡음으로 보고 무시
+            if PDF_DHASH_NOISE_BITS >= 0 \
+                    and perceptual_distance(old_perceptual_hash, new_print["perceptual_hash"]) <= PDF_DHASH_NOISE_BITS:
+                continue
+            changed_pages.append(page_label(index, old_count))
+        changed_pages.extend(page_count_changes(old_count, new_doc.page_count))
+
+        if fingerprint_db is not None and new_file_hash:
+            fingerprint_db.put(new_file_hash, new_prints)
+        return changed_pages, None
+    except Exception as e:
+        return [], str(e)
+    finally:
+        for doc in (old_doc, new_doc):
+            if doc is not None:
+                doc.close()
+
+def diff_pdf_pages_subprocess(old_pdf, new_pdf, work_dir=None):
+    """
+    PyMuPDF가 없을 때 사용: pdftoppm으로 PNG 렌더링 후 diff/compare로 비교. 반환 형식은 diff_pdf_pages와 같음
+    work_dir를 주면 그 안에서 작업하므로 여러 비교를 동시에 실행할 수 있음
+    """
+    work_dir = work_dir or os.path.join(linux_parent_path, "tmp")
+    old_base = os.path.join(work_dir, "old_file")
+    new_base = os.path.join(work_dir, "new_file")
+    diff_base = os.path.join(work_dir, "diff")
+
+    cleanup_pdf_images(old_base, new_base, diff_base)
+    try:
+        old_pdf_error = render_pdf_pages(old_pdf, old_base)
+        new_pdf_error = render_pdf_pages(new_pdf, new_base)
+        if old_pdf_error or new_pdf_error:
+            errors = []
+            if old_pdf_error:
+                errors.append(f"기존 PDF: {old_pdf_error}")
+            if new_pdf_error:
+                errors.append(f"새 PDF: {new_pdf_error}")
+            return [], " / ".join(errors)
+
+        # 🔹 4️⃣ 모든 페이지 비교
+        old_pages = sorted(glob.glob(f"{old_base}-*.png"))
+        changed_pages = []
+
+        for old_img in old_pages:
+            # old_file-1.png → 1 추출
+            page_num = os.path.basename(old_img).split('-')[-1].split('.')[0]
+            new_img = f"{new_base}-{page_num}.png"
+            diff_img = f"{diff_base}-{page_num}.png"
+
+            if not os.path.exists(new_img):
+                continue  # 새 파일에 해당 페이지 없음 → skip
+
+            diff_result = subprocess.run(
+                f"diff -q '{old_img}' '{new_img}' > /dev/null",
+                shell=True
+            )
+
+            # 다를 때만 diff 이미지 생성
+            if diff_result.returncode != 0:
+                subprocess.run(
+                    f"compare '{old_img}' '{new_img}' '{diff_img}'",
+                    shell=True
+                )
+                changed_pages.append(page_num)
+        changed_pages.extend(page_count_changes(len(old_pages), len(glob.glob(f"{new_base}-*.png"))))
+        return changed_pages, None
+    finally:
+        # 🔹 7️⃣ 임시 PNG 정리
+        cleanup_pdf_images(old_base, new_base, diff_base)
+
+def changed_regions(old_render, new_render, cell=PDF_ALBUM_CELL):
+    """
+    같은 해상도로 렌더링한 두 페이지에서 픽셀이 다른 cell×cell 칸을 찾아, 가까운 칸끼리 합친 사각형 목록과 변경 서명 반환.
+    서명은 바뀐 칸의 위치와 내용으로 만든 해시라서, 여러 페이지에서 같은 부분이 똑같이 바뀌면 같은 값이 됨
+    반환: ([(x0, y0, x1, y1) 픽셀 좌표], 서명)
+    """
+    (old_width, old_height, old), (width, height, new) = old_render, new_render
+    if (old_width, old_height) != (width, height):
+        return [(0, 0, width, height)], render_hash(new_render)
+    signature = hashlib.sha256()
+    boxes = []
+    for top in range(0, height, cell):
+        bottom = min(top + cell, height)
+        if old[top * width:bottom * width] == new[top * width:bottom * width]:
+            continue
+        for left in range(0, width, cell):
+            right = min(left + cell, width)
+            rows = [(old[y * width + left:y * width + right], new[y * width + left:y * width + right])
+                    for y in range(top, bottom)]
+            if all(old_row == new_row for old_row, new_row in rows):
+                continue
+            signature.update(f"{left},{top}:".encode())
+            for old_row, new_row in rows:
+                signature.update(old_row + new_row)
+            # 한 칸 여유를 두고 겹치는 상자와 합침
+            box = [left - cell, top - cell, right + cell, bottom + cell]
+            index = 0
+            while index < len(boxes):
+                other = boxes[index]
+                if box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]:
+                    box = [min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3])]
+                    boxes.pop(index)
+                    index = 0
+                else:
+                    index += 1
+            boxes.append(box)
+    regions = [(max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)) for x0, y0, x1, y1 in boxes]
+    return regions, signature.hexdigest()
+
+def render_side_by_side(old_doc, new_doc, index, regions, scale):
+    """기존 | 새 페이지를 나란히 놓고 바뀐 영역을 빨간 상자로 표시한 JPEG (긴 변 PDF_ALBUM_MAX_SIDE 이하)"""
+    gap = 12
+    old_rect, new_rect = old_doc[index].rect, new_doc[index].rect
+    offset = old_rect.width + gap
+    sheet = pymupdf.open()
+    try:
+        page = sheet.new_page(width=offset + new_rect.width, height=max(old_rect.height, new_rect.height))
+        page.show_pdf_page(pymupdf.Rect(0, 0, old_rect.width, old_rect.height), old_doc, index)
+        page.show_pdf_page(pymupdf.Rect(offset, 0, offset + new_rect.width, new_rect.height), new_doc, index)
+        for x0, y0, x1, y1 in regions:
+            for shift in (0, offset):
+                rect = pymupdf.Rect(x0 * scale + shift, y0 * scale, x1 * scale + shift, y1 * scale)
+                page.draw_rect(rect, color=(1, 0, 0), fill=(1, 0, 0), fill_opacity=0.15, width=1.5)
+        zoom = min(PDF_ALBUM_MAX_SIDE / page.rect.width, PDF_ALBUM_MAX_SIDE / page.rect.height)
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        return pixmap.tobytes("jpeg", jpg_quality=PDF_ALBUM_JPEG_QUALITY)
+    finally:
+        sheet.close()
+
+def build_diff_album(old_pdf, new_pdf, changed_pages, album_dir):
+    """
+    바뀐 페이지마다 나란히 비교한 이미지를 album_dir에 JPEG로 저장. 한 번에 한 페이지만 렌더링하므로 메모리는 페이지 수와 무관.
+    같은 변경(서명이 같은 페이지)은 이미지 하나로 합치고 캡션에 페이지를 모아 적음
+    반환: [{"path": 경로, "caption": 캡션}] (최대 PDF_ALBUM_MAX_IMAGES개)
+    """
+    # 추가/삭제된 페이지 범위("4-6 추가")는 나란히 비교할 기존/새 페이지가 없으므로 제외
+    changed_pages = [label for label in changed_pages if label.isdigit()]
+    if not changed_pages:
+        return []
+    if pymupdf is None:
+        return build_diff_album_subprocess(old_pdf, new_pdf, changed_pages, album_dir)
+    old_doc, old_error = open_pdf(old_pdf)
+    new_doc, new_error = open_pdf(new_pdf)
+    try:
+        if old_error or new_error:
+            return []
+        album, pages_by_signature = [], {}
+        for label in changed_pages:
+            index = int(label) - 1
+            regions, signature = changed_regions(render_pdf_page(old_doc[index]), render_pdf_page(new_doc[index]))
+            if signature in pages_by_signature:
+                pages_by_signature[signature].append(label)
+                continue
+            if len(album) >= PDF_ALBUM_MAX_IMAGES:
+                continue
+            image_path = os.path.join(album_dir, f"page-{label}.jpg")
+            with open(image_path, "wb") as f:
+                f.write(render_side_by_side(old_doc, new_doc, index, regions, 72 / PDF_DIFF_DPI))
+            pages_by_signature[signature] = [label]
+            album.append((image_path, pages_by_signature[signature]))
+        return [{"path": image_path, "caption": f"p.{', '.join(labels)} (기존 | 새)"} for image_path, labels in album]
+    finally:
+        for doc in (old_doc, new_doc):
+            if doc is not None:
+                doc.close()
+
+def build_diff_album_subprocess(old_pdf, new_pdf, changed_pages, album_dir):
+    """PyMuPDF가 없을 때: 바뀐 페이지만 pdftoppm으로 렌더링해 compare 결과와 나란히 붙인 JPEG 생성 (ImageMagick)"""
+    album, seen = [], {}
+    for label in changed_pages:
+        if len(album) >= PDF_ALBUM_MAX_IMAGES:
+            break
+        page_base = os.path.join(album_dir, f"page-{label}")
+        rendered = []
+        for name, pdf_path in (("old", old_pdf), ("new", new_pdf)):
+            result = subprocess.run(["pdftoppm", "-png", "-singlefile", "-r", str(PDF_DIFF_DPI),
+                                     "-f", str(int(label)), "-l", str(int(label)), pdf_path, f"{page_base}-{name}"],
+                                    capture_output=True)
+            rendered.append(f"{page_base}-{name}.png" if result.returncode == 0 else None)
+        try:
+            if None in rendered:
+                continue
+            diff_img, image_path = f"{page_base}-diff.png", f"{page_base}.jpg"
+            subprocess.run(["compare", rendered[0], rendered[1], diff_img], capture_output=True)
+            if not os.path.exists(diff_img):
+                continue
+            signature = file_sha256(diff_img)
+            if signature in seen:
+                seen[signature]["pages"].append(label)
+                continue
+            subprocess.run(["convert", rendered[0], diff_img, "+append",
+                            "-resize", f"{PDF_ALBUM_MAX_SIDE}x{PDF_ALBUM_MAX_SIDE}>",
+                            "-quality", str(PDF_ALBUM_JPEG_QUALITY), image_path], capture_output=True)
+            if os.path.exists(image_path):
+                seen[signature] = {"path": image_path, "pages": [label]}
+                album.append(seen[signature])
+        finally:
+            cleanup_pdf_images(page_base)
+    return [{"path": item["path"], "caption": f"p.{', '.join(item['pages'])} (기존 | 변경 표시)"} for item in album]
+
+def fingerprint_pdf(pdf_path, file_hash, fingerprint_db):
+    """새로 받은 PDF의 페이지 지문(렌더링 해시 포함)을 미리 저장해, 나중에 바뀌었을 때 이 버전을 다시 렌더링하지 않게 함"""
+    if pymupdf is None or not file_hash or fingerprint_db.has(file_hash):
+        return
+    doc, error = open_pdf(pdf_path)
+    if error:
+        logging.warning(f"PDF 지문 생성 생략 ({pdf_path}): {error}")
+        return
+    try:
+        pages = []
+        for page in doc:
+            page_print = page_fingerprints(doc, page)
+            page_print["render_hash"] = render_hash(render_pdf_page(page))
+            page_print["perceptual_hash"] = perceptual_hash(page)
+            pages.append(page_print)
+        fingerprint_db.put(file_hash, pages)
+    except Exception as e:
+        logging.warning(f"PDF 지문 생성 실패 ({pdf_path}): {e}")
+    finally:
+        doc.close()
+
+def compare_pdf_files(old_pdf, new_pdf, old_file_hash=None, new_file_hash=None, fingerprint_db=None, work_dir=None):
+    if pymupdf is not None:
+        return diff_pdf_pages(old_pdf, new_pdf, old_file_hash, new_file_hash, fingerprint_db)
+    return diff_pdf_pages_subprocess(old_pdf, new_pdf, work_dir)
+
+def diff_pdf_job(old_pdf, new_pdf, old_file_hash, new_file_hash, work_dir, album_dir=None):
+    """
+    프로세스 풀에서 실행되는 PDF 비교 작업 (작업별 임시 디렉터리 사용).
+    album_dir를 주면 바뀐 페이지의 비교 이미지도 만듦 (album_dir는 전송 후 디스패처가 정리)
+    반환: (변경된 페이지 번호 목록, 에러 메시지, 앨범)
+    """
+    fingerprint_db = PdfFingerprintDB(db_path) if pymupdf is not None else None
+    album = []
+    try:
+        changed_pages, error_detail = compare_pdf_files(old_pdf, new_pdf, old_file_hash, new_file_hash, fingerprint_db, work_dir)
+        album = []
+        if album_dir is not None and changed_pages and not error_detail:
+            try:
+                album = build_diff_album(old_pdf, new_pdf, changed_pages, album_dir)
+            except Exception as e:
+                logging.warning(f"PDF 비교 이미지 생성 실패 ({new_pdf}): {e}")
+        return changed_pages, error_detail, album
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if album_dir is not None and not album:
+            shutil.rmtree(album_dir, ignore_errors=True)
+
+def timed_job(func, *args):
+    """프로세스 풀 작업의 실행 시간(대기 시간 제외)을 함께 반환: (결과, 초)"""
+    started = time.perf_counter()
+    return func(*args), time.perf_counter() - started
+
+def fingerprint_pdf_job(pdf_path, file_hash):
+    """프로세스 풀에서 실행되는 PDF 지문 생성 작업"""
+    fingerprint_pdf(pdf_path, file_hash, PdfFingerprintDB(db_path))
+
+def pdf_text_job(pdf_path):
+    """프로세스 풀에서 실행되는 PDF 본문 추출 작업 (검색 색인용, 페이지 사이에 \f)"""
+    with pymupdf.open(pdf_path) as doc:
+        return "\f".join(page.get_text() for page in doc)
+
+class PdfDiffPipeline:
+    """
+    바뀐 PDF (기존, 새 파일) 쌍을 프로세스 풀에서 병렬로 비교.
+    submit()은 바로 반환하므로 다운로드를 계속 진행할 수 있고, results()는 끝나는 순서대로 결과를 돌려줌.
+    PDF 렌더링은 CPU 작업이라 이벤트 루프를 막지 않도록 별도 프로세스에서 실행
+    """
+    def __init__(self, tmp_dir, workers=None, album=True):
+        self.tmp_dir = tmp_dir
+        self.workers = workers or PDF_DIFF_WORKERS
+        self.album = album  # 바뀐 페이지 비교 이미지 생성 여부
+        self.executor = None
+        self.pending = []      # (context, course_name, future)
+        self.background = []  # 결과를 기다리기만 하면 되는 지문 생성 작업
+
+    def __enter__(self):
+        # 스레드가 도는 중에 fork하면 잠금 상태가 복사될 수 있으므로 spawn 사용
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self
+
+    def __exit__(self, *exc):
+        self.executor.shutdown(wait=True, cancel_futures=exc[0] is not None)
+
+    def submit(self, context, old_pdf, new_pdf, old_file_hash=None, new_file_hash=None, course_name=None):
+        work_dir = tempfile.mkdtemp(prefix="pdf-diff-", dir=self.tmp_dir)
+        album_dir = None
+        if self.album:
+            make_dir(os.path.join(self.tmp_dir, "album"))
+            album_dir = tempfile.mkdtemp(prefix="album-", dir=os.path.join(self.tmp_dir, "album"))
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, timed_job, diff_pdf_job, old_pdf, new_pdf, old_file_hash, new_file_hash, work_dir, album_dir)
+        self.pending.append((context, course_name, future))
+
+    def submit_fingerprint(self, pdf_path, file_hash):
+        if pymupdf is None:
+            return
+        self.background.append(asyncio.get_running_loop().run_in_executor(
+            self.executor, fingerprint_pdf_job, pdf_path, file_hash))
+
+    async def results(self):
+        """반환: async iterator of (context, changed_pages, error_detail, album) - 끝나는 순서대로"""
+        async def wait(context, course_name, future):
+            try:
+                (changed_pages, error_detail, album), seconds = await future
+                crawl_stats.record("pdf_diff", course_name, seconds=seconds, calls=1)
+            except Exception as e:
+                changed_pages, error_detail, album = [], f"{type(e).__name__}: {e}", []
+            return context, changed_pages, error_detail, album
+
+        pending, self.pending = self.pending, []
+        for finished in asyncio.as_completed([wait(*item) for item in pending]):
+            yield await finished
+        for result in await asyncio.gather(*self.background, return_exceptions=True):
+            if isinstance(result, Exception):
+                logging.warning(f"PDF 지문 생성 실패: {result}")
+        self.background = []
+
+async def handle_changed_pdf(course_name, file, save_path, tmp_new_pdf, changed_pages, error_detail, album=None):
+    """PDF 비교 결과를 알린 뒤 새 파일로 교체. album이 있으면 바뀐 페이지 비교 이미지를 함께 보냄"""
+    if error_detail:
         logging.warning(
-            "Canvas 파일 다운로드 생략 "
-            f"(course={course_name}, file_id={getattr(file, 'id', 'unknown')}, "
-            f"name={file.display_name}, error={type(e).__name__})"
+            f"PDF 페이지 비교 생략 ({course_name} / {file.display_name}): {error_detail}"
         )
-        return False
+        shutil.move(tmp_new_pdf, save_path)
+        await send_telegram_message(
+            f"{course_name} 강의 {file.display_name} 파일이 변경되었습니다. "
+            f"PDF 암호화 또는 손상으로 페이지 비교는 생략했습니다.",
+            course_name,
+        )
+        send_ntfy_signal(f"DOWNLOAD_TRIGGER:{course_name}:{file.display_name}")
+        return
 
-async def main(canvas, course_db, assignment_db, announcement_db, lecture_db, notification_db):
-    make_dir(os.path.join(linux_parent_path, "tmp"))
-    session = canvas._Canvas__requester._session  # 내부 세션 객체
-    configure_canvas_session(session)
-    courses = canvas.get_courses(enrollment_state='active')
-    now_kst = datetime.now(timezone.utc).astimezone(KST)
-    
-    # 2️⃣ canvasapi의 세션 재사용
-    headers = {"Authorization": f"Bearer {API_KEY}"}
+    # 🔹 5️⃣ 결과 처리
+    if changed_pages:
+        page_str = ", ".join(changed_pages)
+        logging.info(f"⚠️ {file.display_name} 변경 감지 (페이지: {page_str})")
+        message = f"📄 {course_name} 강의 '{file.display_name}' 변경 감지됨 (페이지: {page_str})"
+        if album:
+            await send_telegram_album(message, album, course_name)
+        else:
+            await send_telegram_message(message, course_name)
+    else:
+        # 파일 해시는 바뀌었으므로 (메타데이터/폰트 등) 페이지가 같아도 변경 사실은 알림
+        logging.info(f"✅ {file.display_name} 페이지 렌더링 결과 동일")
+        await send_telegram_message(f"{course_name} 강의 {file.display_name} 파일 변경됨 (페이지 내용은 동일)", course_name)
 
-    # 3️⃣ planner/items 엔드포인트 호출
+    # 🔹 6️⃣ 새 파일로 교체
+    # os.replace(tmp_new_pdf, save_path)
+    shutil.move(tmp_new_pdf, save_path)
+    send_ntfy_signal(f"DOWNLOAD_TRIGGER:{course_name}:{file.display_name}")
+
+async def sync_downloads(downloader, download_jobs, pdf_pipeline, file_states):
+    """
+    파일을 병렬로 받으며 새 파일/변경 파일을 처리. 바뀐 PDF는 pdf_pipeline에 넘겨 다운로드와 동시에 비교하고,
+    비교가 끝나는 순서대로 알림 후 교체. 반영할 파일 메타데이터는 file_states에 추가
+    """
+    async for job, content_hash, error in downloader.download_all(download_jobs):
+        file, course_name, save_path = job["file"], job["course_name"], job["save_path"]
+        if error is not None:
+            logging.warning(
+                "Canvas 파일 다운로드 생략 "
+                f"(course={course_name}, file_id={getattr(file, 'id', 'unknown')}, "
+                f"name={file.display_name}, error={type(error).__name__}: {error})"
+            )
+            continue
+        file_state = job["file_state"][:3] + (content_hash,) + job["file_state"][4:]
+        old_path = job["old_path"]
+
+        if job["kind"] == "new":
+            file_states.append(file_state)
+            if file.display_name.lower().endswith('.pdf'):
+                pdf_pipeline.submit_fingerprint(save_path, content_hash)
+            await send_telegram_message(f"{course_name} 강의 {file.display_name} 파일 다운로드", course_name)
+            send_ntfy_signal(f"DOWNLOAD_TRIGGER:{course_name}:{file.display_name}")
+            continue
+
+        old_hash = job["old_hash"] or file_sha256(old_path)
+        if content_hash == old_hash:
+            file_states.append(file_state)
+            if old_path != save_path:
+                logging.info(f"📝 {file.display_name} 내용 동일, 이름/위치만 변경: {old_path} → {save_path}")
+                shutil.move(job["destination"], save_path)
+                os.remove(old_path)
+            else:
+                logging.info(f"✅ {file.display_name} 내용 동일 (해시 일치), 기존 파일 유지")
+                os.remove(job["destination"])
+            continue
+
+        if old_path != save_path:
+            shutil.move(old_path, save_path)
+        if file.display_name.lower().endswith('.pdf'):
+            # 비교는 프로세스 풀에서 진행하고 다운로드는 계속함 (결과 처리는 아래에서)
+            pdf_pipeline.submit((job, file_state), save_path, job["destination"], old_hash, content_hash, course_name)
+            continue
+        logging.info(f"🔄 파일 내용 변경, 다시 다운로드: {file.display_name}")
+        shutil.move(job["destination"], save_path)
+        await send_telegram_message(f"{course_name} 강의 {file.display_name} 파일이 변경됨", course_name)
+        send_ntfy_signal(f"DOWNLOAD_TRIGGER:{course_name}:{file.display_name}")
+        file_states.append(file_state)
+
+    async for (job, file_state), changed_pages, error_detail, album in pdf_pipeline.results():
+        await handle_changed_pdf(job["course_name"], job["file"], job["save_path"], job["destination"],
+                                 changed_pages, error_detail, album)
+        file_states.append(file_state)
+
+async def fetch_planner(session, headers, now_kst):
+    """
+    계정 하나의 planner/items를 받아 정리.
+    반환: (planner_submissions {assignment_id: 제출 여부}, upcoming_due {course_id: 가장 가까운 미제출 마감},
+           reminders {assignment_id: 마감 알림 예약 정보})
+    """
     url = f"{API_URL}/api/v1/planner/items"
     params = {"start_date": now_kst.strftime("%Y-%m-%dT%H:%M:%S.000Z")}
 
     data = await get_planner_items(session, url, headers, params)
     planner_submissions = {}
+    upcoming_due = {}
+    reminders = {}
 
     for item in data:
         html_url = item.get("html_url") or ""
@@ -592,78 +3802,145 @@ async def main(canvas, course_db, assignment_db, announcement_db, lecture_db, no
         has_submitted = planner_submission_status(item)
         planner_submissions[assignment_id] = has_submitted
         assignment_name = item.get("plannable").get("title")
+        if not has_submitted and due_at_utc is not None and due_at_utc > now_kst and item.get("course_id") is not None:
+            upcoming_due[item["course_id"]] = min(due_at_utc, upcoming_due.get(item["course_id"], due_at_utc))
 
-        d_day = decide_d_day(now_kst, due_at_utc, has_submitted)
-        logging.info(f"d-day 확인, course_name: {course_name}, assignment_id: {assignment_id}, assignment_name: {assignment_name}, now_kst: {now_kst}, due_at_utc: {due_at_utc}, has_submitted: {has_submitted} → d_day: {d_day}")
-        if d_day is not None:
-            if not notification_db.was_sent(assignment_id, d_day):
-                due_kst = due_at_utc.astimezone(KST)
-                if d_day == 0:
-                    d_day = "day"
-                msg = (
-                    f"[과제 마감 알림] D-{d_day}\n"
-                    f"과목: {course_name}\n"
-                    f"과제: {assignment_name}\n"
-                    f"마감: {due_kst.strftime('%Y-%m-%d %H:%M:%S')} (KST)"
-                )
-                await send_telegram_message(msg)
-                if d_day == "day":
-                    d_day = 0
-                notification_db.mark_sent(
-                    assignment_id=assignment_id,
-                    d_day=d_day,
-                    sent_at=now_kst.strftime("%Y-%m-%d %H:%M:%S")
-                )
-    course_list, assignment_list, lecture_list, announcement_list = [], [], [], []
+        reminders[assignment_id] = (assignment_id, course_name, assignment_name, due_at_utc, has_submitted)
+    return planner_submissions, upcoming_due, reminders
 
-    for course in courses:
-        course_name = course.name.split('-')[0]
-        course_code = '-'.join(course.course_code.split('-')[1:])
-        course_list.append((course.id, course_name, course_code))
+async def index_lecture_texts(search_index, lecture_db):
+    """
+    강의자료 PDF를 검색 색인에 반영. 문서는 파일 sha256으로 구분하므로 내용이 바뀐 파일만 본문을 다시 추출하고,
+    한 주기에 SEARCH_PDF_BATCH개까지 추출 (여러 개면 프로세스 풀) (색인 전부터 있던 파일은 여러 주기에 걸쳐 채움).
+    반환: 색인한 PDF 수
+    """
+    if pymupdf is None:
+        return 0
+    files = lecture_db.pdf_files()
+    search_index.sync_source("lecture", {digest: (course_name, file_name)
+                                         for digest, (course_name, file_name, _) in files.items()})
+    indexed = search_index.indexed_keys("lecture")
+    pending = [(digest, course_name, file_name, local_path)
+               for digest, (course_name, file_name, local_path) in files.items()
+               if digest not in indexed and os.path.exists(local_path)][:SEARCH_PDF_BATCH]
+    if not pending:
+        return 0
+    loop = asyncio.get_running_loop()
+    if len(pending) <= 2:
+        # 평소 주기의 새 파일 한두 개는 spawn 비용(약 1초)이 추출보다 커서 스레드에서 추출
+        results = await asyncio.gather(*(loop.run_in_executor(None, timed_job, pdf_text_job, local_path)
+                                         for *_, local_path in pending), return_exceptions=True)
+    else:
+        with ProcessPoolExecutor(max_workers=min(len(pending), PDF_DIFF_WORKERS),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = await asyncio.gather(*(loop.run_in_executor(executor, timed_job, pdf_text_job, local_path)
+                                             for *_, local_path in pending), return_exceptions=True)
+    documents = []
+    for (digest, course_name, file_name, _), result in zip(pending, results):
+        if isinstance(result, Exception):
+            # 암호화/손상 파일도 빈 본문으로 색인해 두어 주기마다 다시 시도하지 않음
+            logging.warning(f"PDF 본문 추출 실패 ({course_name} / {file_name}): {type(result).__name__}: {result}")
+            text = ""
+        else:
+            text, seconds = result
+            crawl_stats.record("search_index", course_name, seconds=seconds, calls=1)
+        documents.append((digest, course_name, file_name, text))
+    with search_index.storage.transaction() as cur:
+        search_index.index_documents(cur, "lecture", documents)
+    logging.info(f"강의자료 PDF 검색 색인: {len(documents)}개")
+    return len(documents)
 
-        # 공지 처리
-        for announcement in course.get_discussion_topics(only_announcements=True):
-            announcement_list.append((
-                announcement.id,
-                course.id,
-                course_name,
-                announcement.title,
-                announcement.message,
-                announcement.posted_at
-            ))
+async def main(canvas, course_db, assignment_db, announcement_db, lecture_db, notification_db, sync_cursor_db=None,
+               scheduler=None, reminder_engine=None, accounts=None):
+    """
+    한 수집 주기. accounts를 여러 개 주면 (첫 계정이 canvas의 계정)
+    과목 데이터는 과목마다 한 번만 수집해 공유하고, planner/제출 여부만 계정마다 받아 알림을 계정별 채팅방으로 보냄
+    """
+    global course_chats
+    make_dir(os.path.join(linux_parent_path, "tmp"))
+    accounts = accounts or [default_account()]
+    primary = accounts[0]
+    http_cache = HttpCacheDB(db_path) if HTTP_CACHE_ENABLED else None
+    canvases = {primary.id: canvas}
+    for account in accounts[1:]:
+        canvases[account.id] = Canvas(API_URL, account.api_key)
+    for account_canvas in canvases.values():
+        configure_canvas_session(account_canvas._Canvas__requester._session, http_cache)
+    session = canvas._Canvas__requester._session  # 내부 세션 객체
+    now_kst = datetime.now(timezone.utc).astimezone(KST)
+    
+    # 2️⃣ canvasapi의 세션 재사용
+    account_headers = {account.id: {"Authorization": f"Bearer {account.api_key}"} for account in accounts}
+    headers = account_headers[primary.id]
 
-        # 과제 처리 (+ D-day 알림)
-        for assignment in course.get_assignments():
-            unlock_at = assignment.unlock_at
-            if unlock_at is None:
-                unlock_at = assignment.created_at
-            due_at = assignment.due_at
-            if due_at is None:
-                due_at = assignment.lock_at
-            submitted = planner_submissions.get(assignment.id)
-            if submitted is None:
-                try:
-                    submission = assignment.get_submission("self")
-                    submitted = bool(
-                        getattr(submission, "submitted_at", None)
-                        or getattr(submission, "workflow_state", None) in {"submitted", "graded", "pending_review"}
-                    )
-                except Exception as e:
-                    submitted = None
-                    logging.warning(f"과제 제출 여부 확인 실패 ({assignment.id}): {e}")
-            assignment_list.append((
-                assignment.id,
-                course.id,
-                course_name,
-                assignment.name,
-                unlock_at,
-                due_at,
-                assignment.description,
-                submitted,
-            ))
-            logging.info(f"과제 처리, course_name: {course_name}, assignment_id: {assignment.id}, assignment_name: {assignment.name}, unlock_at: {unlock_at}, due_at: {due_at}")
+    # 3️⃣ planner/items 엔드포인트 호출 (계정별)
+    planners = {}
+    for account in accounts:
+        with crawl_stats.phase("planner"):
+            planners[account.id] = await fetch_planner(
+                canvases[account.id]._Canvas__requester._session, account_headers[account.id], now_kst)
+    planner_submissions, upcoming_due, reminders = planners[primary.id]
+    for account_id, (submissions, account_due, _) in planners.items():
+        for assignment_id in submissions:
+            # 다른 계정의 planner 과제도 수집 대상으로 남김 (제출 여부는 목록을 받은 계정의 것으로만 기록, 아래 참고)
+            planner_submissions.setdefault(assignment_id, None)
+        for course_id, due_at in account_due.items():
+            upcoming_due[course_id] = min(due_at, upcoming_due.get(course_id, due_at))
+
+    courses, enrollments = None, None
+    if len(accounts) > 1:
+        courses, enrollments = await list_shared_courses(canvases)
+        chats = {account.id: account.chat_id for account in accounts}
+        course_chats = {}
+        for course in courses:
+            targets = course_chats.setdefault(course.name.split('-')[0], [])
+            targets.extend(chats[account_id] for account_id in enrollments[course.id] if chats[account_id] not in targets)
+        logging.info(f"여러 계정 모드: 계정 {len(accounts)}개, 과목 {len(courses)}개 "
+                     f"(계정별 수강 과목 합계 {sum(len(ids) for ids in enrollments.values())}개)")
+    else:
+        course_chats = {}
+    course_list, assignment_list, lecture_list, announcement_list = [], [], [], []
+
+    sync_state = sync_cursor_db.get_all() if sync_cursor_db is not None else None
+    tmp_dir = os.path.join(linux_parent_path, "tmp")
+    states_by_id, states_by_name = lecture_db.get_file_states()
+    if sync_state:
+        # 로컬에서 지워진/사라진 파일은 Canvas 메타데이터가 그대로라 증분 목록에 나오지 않으므로,
+        # 그런 과목은 파일 목록을 전체 수집해 다시 받게 함 (파일마다 stat 한 번)
+        missing_courses = {state["course_id"] for state in states_by_name.values()
+                           if state["local_path"] and not os.path.exists(state["local_path"])}
+        for course_id in missing_courses:
+            sync_state.pop((course_id, "files"), None)
+        if missing_courses:
+            logging.info(f"로컬에 없는 강의자료가 있어 파일 목록 전체 수집: 과목 {len(missing_courses)}개")
+    download_jobs, file_states, renamed_files = [], [], []
+    crawled_courses = await crawl_courses(canvas, planner_submissions, sync_state=sync_state,
+                                          due=scheduler.is_due if scheduler is not None else None, courses=courses)
+    logging.info(f"수집한 과목/리소스: {sum(len(cursors) for *_, cursors in crawled_courses)}개 "
+                 f"(과목 {len(crawled_courses)}개 x {len(SYNC_RESOURCES)})")
+    logging.info(
+        f"과제 제출 여부 일괄 조회: 개별 요청 {crawl_stats.get('submission_requests_avoided')}건 절약, "
+        f"개별 요청 {crawl_stats.get('submission_requests')}건"
+    )
+    if HTTP_CACHE_ENABLED:
+        logging.info(
+            f"Canvas API 조건부 요청: 304 {crawl_stats.get('http_cache_hits')}건, "
+            f"200/기타 {crawl_stats.get('http_cache_misses')}건, "
+            f"절약 {crawl_stats.get('http_cache_bytes_saved') / 1024:.1f}KB"
+        )
+
+    listed_submissions = []  # [(account_id, assignment_id, submitted)] - 추가 계정 토큰으로 받은 과제 목록의 제출 여부
+    for course, course_name, course_code, announcements, assignments, files, _ in crawled_courses:
+        course_list.append((course.id, course_name, course_code))
+        announcement_list.extend(announcements)
+        if enrollments is not None and primary.id not in enrollments.get(course.id, ()):
+            # 기본 계정이 수강하지 않는 과목은 추가 계정 토큰으로 받았으므로, 목록의 제출 여부는 그 계정의 것:
+            # assignment.submitted(기본 계정)에는 쓰지 않고 account_submission에 그 계정 것으로 기록
+            listing_account = enrollments[course.id][0]
+            listed_submissions.extend((listing_account, row[0], row[-1]) for row in assignments if row[-1] is not None)
+            assignments = [row[:-1] + (None,) for row in assignments]
+        assignment_list.extend(assignments)
 
-        files = list(course.get_files())
         if files:
             make_dir(os.path.join(path, course_name))
         for file in files:
@@ -675,135 +3952,180 @@ async def main(canvas, course_db, assignment_db, announcement_db, lecture_db, no
             make_dir(os.path.join(path, course_name, sub_dir))
 
             save_path = os.path.join(path, course_name, sub_dir, file.display_name)
-            if os.path.exists(save_path) and file.size is not None:
-                if os.path.getsize(save_path) == file.size:
-                    logging.info(f"✅ 이미 존재하는 파일이며 크기 동일: {file.display_name}, 다운로드 생략")
+            updated_at = getattr(file, "updated_at", None)
+            modified_at = getattr(file, "modified_at", None)
+            # Canvas 파일 ID로 먼저 찾고, ID가 기록되기 전의 행은 (과목, 파일명)으로 찾음
+            state = states_by_id.get(file.id) or states_by_name.get((course.id, LectureDB.key_name(file.display_name)))
+            file_state = (course.id, file.display_name, file.id, None, updated_at,
+                          getattr(file, "content-type", None), save_path, modified_at)
+            # updated_at은 이름 변경/폴더 이동에도 바뀌므로, 내용이 바뀔 때만 바뀌는 modified_at과 크기로 먼저 판단
+            # (modified_at이 기록되기 전의 행은 updated_at으로 판단)
+            same_content = state is not None and (
+                (state["file_id"] == file.id and state["modified_at"] is not None
+                 and state["modified_at"] == modified_at and state["file_size"] == file.size)
+                or (state["file_id"] in (None, file.id) and state["updated_at"] is not None
+                    and state["updated_at"] == updated_at)
+            )
+            if same_content:
+                # Canvas 메타데이터가 같으면 내용도 같음: 로컬 파일이 있는지만 확인하고 네트워크는 건드리지 않음
+                # (로컬 파일이 지워졌거나 없어졌으면 아래에서 새로 받음)
+                old_path = state["local_path"] or save_path
+                renamed = state["file_name"] != LectureDB.key_name(file.display_name)
+                if renamed:
+                    renamed_files.append((course.id, state["file_name"].replace("''", "'"), file.display_name))
+                if os.path.exists(old_path):
+                    if renamed:
+                        logging.info(f"📝 LMS에서 파일 이름 변경: {state['file_name']} → {file.display_name}, 다운로드 생략")
+                    else:
+                        logging.info(f"✅ Canvas 메타데이터 동일: {file.display_name}, 다운로드 생략")
+                    if old_path != save_path:
+                        shutil.move(old_path, save_path)
+                    if old_path != save_path or state["local_path"] is None or state["file_id"] is None \
+                            or state["updated_at"] != updated_at or state["modified_at"] != modified_at:
+                        file_states.append(file_state[:3] + (state["content_hash"],) + file_state[4:])
                     continue
-                else:
-                    if file.display_name.lower().endswith('.pdf'):
-                        old_base = os.path.join(linux_parent_path, "tmp/old_file")
-                        new_base = os.path.join(linux_parent_path, "tmp/new_file")
-                        diff_base = os.path.join(linux_parent_path, "tmp/diff")
-
-                        tmp_new_pdf = os.path.join(linux_parent_path, "tmp/new_file.pdf")
-                        cleanup_pdf_images(old_base, new_base, diff_base)
-                        if os.path.exists(tmp_new_pdf):
-                            os.remove(tmp_new_pdf)
-                        if not download_canvas_file(file, tmp_new_pdf, course_name):
-                            continue
 
-                        old_pdf_error = render_pdf_pages(save_path, old_base)
-                        new_pdf_error = render_pdf_pages(tmp_new_pdf, new_base)
-                        if old_pdf_error or new_pdf_error:
-                            errors = []
-                            if old_pdf_error:
-                                errors.append(f"기존 PDF: {old_pdf_error}")
-                            if new_pdf_error:
-                                errors.append(f"새 PDF: {new_pdf_error}")
-                            error_detail = " / ".join(errors)
-                            logging.warning(
-                                f"PDF 페이지 비교 생략 ({course_name} / {file.display_name}): {error_detail}"
-                            )
-                            shutil.move(tmp_new_pdf, save_path)
-                            cleanup_pdf_images(old_base, new_base, diff_base)
-                            await send_telegram_message(
-                                f"{course_name} 강의 {file.display_name} 파일이 변경되었습니다. "
-                                f"PDF 암호화 또는 손상으로 페이지 비교는 생략했습니다."
-                            )
-                            send_ntfy_signal(f"DOWNLOAD_TRIGGER:{course_name}:{file.display_name}")
-                            continue
-
-                        # 🔹 4️⃣ 모든 페이지 비교
-                        old_pages = sorted(glob.glob(f"{old_base}-*.png"))
-                        changed_pages = []
-
-                        for old_img in old_pages:
-                            # old_file-1.png → 1 추출
-                            page_num = os.path.basename(old_img).split('-')[-1].split('.')[0]
-                            new_img = f"{new_base}-{page_num}.png"
-                            diff_img = f"{diff_base}-{page_num}.png"
-
-                            if not os.path.exists(new_img):
-                                continue  # 새 파일에 해당 페이지 없음 → skip
-
-                            diff_result = subprocess.run(
-                                f"diff -q '{old_img}' '{new_img}' > /dev/null",
-                                shell=True
-                            )
-
-                            # 다를 때만 diff 이미지 생성
-                            if diff_result.returncode != 0:
-                                subprocess.run(
-                                    f"compare '{old_img}' '{new_img}' '{diff_img}'",
-                                    shell=True
-                                )
-                                changed_pages.append(page_num)
-                        # 🔹 5️⃣ 결과 처리
-                        if changed_pages:
-                            page_str = ", ".join(changed_pages)
-                            logging.info(f"⚠️ {file.display_name} 변경 감지 (페이지: {page_str})")
-                            await send_telegram_message(
-                                f"📄 {course_name} 강의 '{file.display_name}' 변경 감지됨 (페이지: {page_str})"
-                            )
-                        else:
-                            logging.info(f"✅ {file.display_name} 내용 동일 (크기만 다름)")
-
-                        # 🔹 6️⃣ 새 파일로 교체
-                        # os.replace(tmp_new_pdf, save_path)
-                        shutil.move(tmp_new_pdf, save_path)
-
-                        # 🔹 7️⃣ 임시 PNG 정리
-                        cleanup_pdf_images(old_base, new_base, diff_base)
-                        await send_telegram_message(f"{course_name} 강의 {file.display_name} {', '.join(changed_pages)} 페이지 변경됨")
-                        continue
-                        
-                    else:
-                        logging.info(f"🔄 파일 크기 다름, 다시 다운로드: {file.display_name}")
-                        download_message = f"{course_name} 강의 {file.display_name} 파일 크기가 다름"
-            else:
+            old_path = state["local_path"] if state is not None and state["local_path"] else save_path
+            job = {
+                "file": file,
+                "course_id": course.id,
+                "course_name": course_name,
+                "save_path": save_path,
+                "old_path": old_path,
+                "old_hash": state["content_hash"] if state is not None else None,
+                "file_state": file_state,
+                # 여러 계정 모드: 과목 데이터를 받은 계정의 토큰으로 다운로드
+                "headers": account_headers[enrollments[course.id][0]] if enrollments else None,
+            }
+            if not os.path.exists(old_path):
                 logging.info(f"⬇️ 새 파일 다운로드: {file.display_name}")
-                download_message = f"{course_name} 강의 {file.display_name} 파일 다운로드"
+                download_jobs.append(dict(job, kind="new", destination=save_path))
+            elif (state is None or state["updated_at"] is None) and file.size is not None \
+                    and old_path == save_path and os.path.getsize(save_path) == file.size:
+                # 해시가 기록되기 전의 파일: 크기로 판단하고 현재 파일의 해시와 메타데이터를 기록
+                logging.info(f"✅ 이미 존재하는 파일이며 크기 동일: {file.display_name}, 다운로드 생략")
+                file_states.append(file_state[:3] + (file_sha256(save_path),) + file_state[4:])
+            else:
+                # 수정 시각이 다르거나 크기가 다름: 임시 파일로 받아 해시로 실제 변경 여부 확인
+                download_jobs.append(dict(job, kind="check", destination=os.path.join(tmp_dir, f"{file.id}.new")))
 
-            if not download_canvas_file(file, save_path, course_name):
-                continue
-            await send_telegram_message(download_message)
-            send_ntfy_signal(f"DOWNLOAD_TRIGGER:{course_name}:{file.display_name}")
+    downloader = FileDownloader(session, headers, tmp_dir)
+    with PdfDiffPipeline(tmp_dir) as pdf_pipeline:
+        await sync_downloads(downloader, download_jobs, pdf_pipeline, file_states)
 
-        await asyncio.sleep(1)
+    # 한 주기의 DB 반영은 하나의 트랜잭션으로 처리
+    with crawl_stats.phase("db_upsert"), course_db.storage.transaction():
+        lecture_db.rename_files(renamed_files)
+        changed_data = {
+            "courses": course_db.set_database(course_list),
+            "assignments": assignment_db.set_database(assignment_list),
+            "announcements": announcement_db.set_database(announcement_list),
+            "lectures": lecture_db.set_database(lecture_list),
+        }
+        lecture_db.set_file_states(file_states)
+        if len(accounts) > 1:
+            AccountDB(db_path).set_submissions(listed_submissions + [
+                (account.id, assignment_id, submitted)
+                for account in accounts[1:]
+                for assignment_id, submitted in planners[account.id][0].items()
+            ])
+        if sync_cursor_db is not None:
+            # DB 반영과 같은 트랜잭션에서만 커서를 전진시켜, 중간에 실패한 주기의 항목을 놓치지 않게 함
+            synced_at = now_kst.isoformat()
+            sync_cursor_db.set_database([
+                (course.id, resource, cursor, synced_at if full_sync else None)
+                for course, *_, cursors in crawled_courses
+                for resource, (cursor, full_sync) in cursors.items()
+            ])
+    if announcement_db.search_index is not None:
+        with crawl_stats.phase("search_index"):
+            await index_lecture_texts(announcement_db.search_index, lecture_db)
+    if scheduler is not None:
+        scheduler.record_success(crawled_courses, upcoming_due)
 
-    changed_data = {
-        "courses": course_db.set_database(course_list),
-        "assignments": assignment_db.set_database(assignment_list),
-        "announcements": announcement_db.set_database(announcement_list),
-        "lectures": lecture_db.set_database(lecture_list),
-    }
+    # 마감 알림 예약: 이번 주기에 받은 과제(새 과제, 마감 변경 포함)와 planner 항목만 다시 계산
+    for assignment_id, course_id, course_name, assignment_name, _, end_date, _, submitted in assignment_list:
+        if enrollments is not None and primary.id not in enrollments.get(course_id, ()):
+            continue
+        due_at = end_date if isinstance(end_date, datetime) else parse_canvas_dt(end_date)
+        reminders.setdefault(assignment_id, (assignment_id, course_name, assignment_name, due_at, submitted))
+    running = reminder_engine is not None
+    if not running:
+        # 알림 타이머가 따로 돌지 않으면 수집할 때 시각이 된 알림만 보냄
+        reminder_engine = ReminderEngine(notification_db, assignment_db, account_db=AccountDB(db_path))
+    reminder_engine.set_accounts(accounts)
+    with crawl_stats.phase("reminders"):
+        reminder_engine.schedule(list(reminders.values()), account_id=primary.id)
+        for account in accounts[1:]:
+            # 추가 계정은 planner 항목 기준 (제출 여부가 계정마다 다름)
+            reminder_engine.schedule(list(planners[account.id][2].values()), account_id=account.id)
+    if not running:
+        await reminder_engine.fire_due()
     return changed_data
 
-async def loop_main():
+async def loop_main(max_cycles=None):
+    """
+    수집 루프. max_cycles를 주면 (벤치마크/점검용) 그 수만큼 수집한 뒤 대기 중인 알림을 보내고 종료하며
+    마지막 주기의 측정값 (counts, phases)를 반환
+    """
     course_db = CourseDB(db_path)
     assignment_db = AssignmentDB(db_path)
     announcement_db = AnnouncementDB(db_path)
     lecture_db = LectureDB(db_path)
     notification_db = NotificationDB(db_path)
+    sync_cursor_db = SyncCursorDB(db_path)
+    account_db = AccountDB(db_path)
+    metrics_db = MetricsDB(db_path)
+    if HTTP_CACHE_ENABLED:
+        pruned = HttpCacheDB(db_path).prune()
+        if pruned:
+            logging.info(f"오래된 HTTP 캐시 {pruned}개 삭제")
+    pruned = metrics_db.prune()
+    if pruned:
+        logging.info(f"오래된 수집 측정값 {pruned}개 삭제")
+    metrics_exporter = MetricsExporter(METRICS_PORT) if METRICS_PORT else None
+    metrics_task = asyncio.create_task(metrics_exporter.run()) if metrics_exporter is not None else None
 
-    assignment_watcher = DatabaseWatcher(assignment_db)
-    announcement_watcher = DatabaseWatcher(announcement_db)
-    lecture_watcher = DatabaseWatcher(lecture_db)
+    global telegram_dispatcher
+    telegram_dispatcher = TelegramDispatcher(OutboxDB(db_path), bot, chat_id)
+    dispatcher_task = asyncio.create_task(telegram_dispatcher.run())  # 참조를 유지해야 태스크가 GC되지 않음
 
+    global ntfy_notifier
+    ntfy_notifier = NtfyNotifier()
+    ntfy_task = asyncio.create_task(ntfy_notifier.run())
+
+    # 본문은 저장할 때 만든 평문 컬럼을 읽음 (알림마다 HTML을 다시 파싱하지 않음)
+    assignment_watcher = DatabaseWatcher(
+        assignment_db, ("assignment_id", "course_name", "assignment_name", "start_date", "end_date", "description_text"))
+    announcement_watcher = DatabaseWatcher(
+        announcement_db, ("course_name", "announcement_title", "announcement_text", "posted_at"))
+    lecture_watcher = DatabaseWatcher(lecture_db, ("course_name", "file_name"))
+
+    scheduler = PollScheduler()
+    reminder_engine = ReminderEngine(notification_db, assignment_db, account_db=account_db)
+    reminder_task = asyncio.create_task(reminder_engine.run())
+    # 명령 응답은 DB 읽기만 하므로 수집 주기와 별개로 항상 실행 (휴식 시간 포함)
+    command_handler = TelegramCommandHandler(bot, CommandReader(db_path), scheduler) if TELEGRAM_COMMANDS else None
+    command_task = asyncio.create_task(command_handler.run()) if command_handler is not None else None
+    cycles, last_metrics = 0, None
     while True:
         now = datetime.now()
-        current_hour = now.hour
-
-        if 2 <= current_hour < 6:
-            logging.info(f"🛌 현재 {current_hour}시: 휴식 시간입니다. 1시간 후 다시 확인합니다.")
-            await asyncio.sleep(3600)
+        quiet_left = scheduler.quiet_seconds_left()
+        if quiet_left:
+            logging.info(f"🛌 현재 {now.hour}시: 휴식 시간({QUIET_HOURS}시)입니다. {quiet_left / 60:.0f}분 후 다시 확인합니다.")
+            await asyncio.sleep(quiet_left)
             continue
 
+        cycle_started = time.perf_counter()
         try:
             logging.info(f"작업 시작 ({now.strftime('%Y-%m-%d %H:%M:%S')})")
             canvas = Canvas(API_URL, API_KEY)
-            changed_data = await main(canvas, course_db, assignment_db, announcement_db, lecture_db, notification_db)
-            logging.info(f"작업 완료 ({now.strftime('%Y-%m-%d %H:%M:%S')})")
+            # 추가 계정은 매 주기 다시 읽으므로 실행 중에 `account add`로 추가해도 다음 주기부터 반영
+            accounts = [default_account()] + account_db.get_enabled()
+            changed_data = await main(canvas, course_db, assignment_db, announcement_db, lecture_db, notification_db,
+                                      sync_cursor_db, scheduler, reminder_engine, accounts)
+            logging.info(f"작업 완료 ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, "
+                         f"{time.perf_counter() - cycle_started:.1f}초)")
 
             for changed in changed_data["announcements"]:
                 logging.info(f"공지 변경 감지: {changed['announcement_id']}, {changed['announcement_title']}")
@@ -819,10 +4141,10 @@ async def loop_main():
                         "announcement_message": "게시글",
                         "posted_at": "게시일",
                     },
-                    html_fields={"announcement_message"},
                     date_fields={"posted_at"},
+                    diff_fields={"announcement_message"},
                 )
-                await send_telegram_message(message)
+                await send_telegram_message(message, changed["course_name"])
 
             for changed in changed_data["assignments"]:
                 logging.info(f"과제 변경 감지: {changed['assignment_id']}, {changed['assignment_name']}")
@@ -839,10 +4161,10 @@ async def loop_main():
                         "end_date": "마감일",
                         "description": "내용",
                     },
-                    html_fields={"description"},
                     date_fields={"start_date", "end_date"},
+                    diff_fields={"description"},
                 )
-                await send_telegram_message(message)
+                await send_telegram_message(message, changed["course_name"])
 
             for changed in changed_data["courses"]:
                 logging.info(f"강의 변경 감지: {changed['course_id']}, {changed['course_name']}")
@@ -856,7 +4178,7 @@ async def loop_main():
                         "course_code": "과목 코드",
                     },
                 )
-                await send_telegram_message(message)
+                await send_telegram_message(message, changed["course_name"])
 
             for changed in changed_data["lectures"]:
                 logging.info(f"강의자료 DB 변경 감지: {changed['course_name']}, {changed['file_name']}")
@@ -870,40 +4192,174 @@ async def loop_main():
                         "file_size": "파일 크기",
                     },
                 )
-                await send_telegram_message(message)
-
-            new_announcements = announcement_watcher.check_for_update()
-            for row in new_announcements:
-                logging.info(f"과목명: {row[3]}, 공지명: {row[4]}")
-                posted_at = format_to_kst(row[6])
-                soup_description = BeautifulSoup(row[5], 'html.parser')
-                # <p> 태그 기준으로 텍스트 추출
-                paragraphs = [p.get_text(strip=True) for p in soup_description.find_all('p') if p.get_text(strip=True)]
-
-                # '\n'으로 구분된 문자열로 출력
-                result = "\n".join(paragraphs)
-                await send_telegram_message(f"{row[3]} 과목에 새로운 공지 {row[4]}이 등록됨\n게시글: {result}\n게시일: {posted_at}")
-            new_assignments = assignment_watcher.check_for_update()
-            for row in new_assignments:
-                logging.info(f"과제 ID: {row[2]}, 과목명: {row[3]}, 과제명: {row[4]}")
-                start_time = format_to_kst(row[5])
-                end_time = format_to_kst(row[6])
-                description = row[7] if row[7] else "없음"
-                soup_description = BeautifulSoup(description, 'html.parser')
-                description_text = soup_description.get_text().strip()
-                # description_text = description_text.replace("&nbsp;", "\n")
-                await send_telegram_message(f"{row[3]} 과목에 새로운 과제 {row[4]}이 등록됨\n시작일: {start_time}\n마감일: {end_time}\n내용:\n{description_text}")
-
-            new_lectures = lecture_watcher.check_for_update()
-            for row in new_lectures:
-                logging.info(f"과목명: {row[2]}, 파일명: {row[3]}")
-                # await send_telegram_message(f"{row[2]} 과목에 새로운 강의자료 {row[3]}이 등록됨")
+                await send_telegram_message(message, changed["course_name"])
+
+            # 새 행 알림의 outbox 기록과 watcher 커서 저장을 한 트랜잭션으로 (커서는 페이지마다 한 번 저장).
+            # 트랜잭션 안에서는 await하지 않음: 공유 연결의 락과 쓰기 트랜잭션을 잡은 채 다른 코루틴으로 넘어가지 않게 함
+            new_row_messages = []
+            with announcement_db.storage.transaction():
+                for course_name, announcement_title, result, posted_at in announcement_watcher.iter_new_rows():
+                    logging.info(f"과목명: {course_name}, 공지명: {announcement_title}")
+                    posted_at = format_to_kst(posted_at)
+                    new_row_messages.append((f"{course_name} 과목에 새로운 공지 {announcement_title}이 등록됨\n게시글: {result}\n게시일: {posted_at}", course_name))
+                for assignment_id, course_name, assignment_name, start_date, end_date, description_text in assignment_watcher.iter_new_rows():
+                    logging.info(f"과제 ID: {assignment_id}, 과목명: {course_name}, 과제명: {assignment_name}")
+                    start_time = format_to_kst(start_date)
+                    end_time = format_to_kst(end_date)
+                    description_text = description_text or "없음"
+                    new_row_messages.append((f"{course_name} 과목에 새로운 과제 {assignment_name}이 등록됨\n시작일: {start_time}\n마감일: {end_time}\n내용:\n{description_text}", course_name))
+
+                for course_name, file_name in lecture_watcher.iter_new_rows():
+                    logging.info(f"과목명: {course_name}, 파일명: {file_name}")
+                    # new_row_messages.append((f"{course_name} 과목에 새로운 강의자료 {file_name}이 등록됨", course_name))
+
+                if telegram_dispatcher is not None:
+                    for message, course_name in new_row_messages:
+                        enqueue_telegram_message(message, course_name)
+                    new_row_messages = []
+            # 디스패처 없이 바로 보내는 모드: 커서 저장 후 트랜잭션 밖에서 전송
+            for message, course_name in new_row_messages:
+                await send_telegram_message(message, course_name)
 
         except Exception as e:
-            logging.error(f"에러 발생: {traceback.format_exc()}")
+            retry_in = scheduler.record_failure()
+            logging.error(f"에러 발생 ({scheduler.failures}회 연속, {retry_in:.0f}초 후 재시도): {traceback.format_exc()}")
             await send_telegram_message(f"❗ LMS Bot 에러 발생: {e}")
 
-        await asyncio.sleep(600)
+        cycle_seconds = time.perf_counter() - cycle_started
+        cycles += 1
+        finished = max_cycles is not None and cycles >= max_cycles
+        if finished:
+            # 마지막 주기의 알림 전송까지 측정값에 포함되도록 먼저 보냄
+            if not await telegram_dispatcher.wait_idle(NOTIFY_FLUSH_TIMEOUT):
+                logging.warning("종료 전 텔레그램 알림을 모두 보내지 못했습니다 (다음 실행 때 이어서 전송)")
+            try:
+                await asyncio.wait_for(ntfy_notifier.queue.join(), NOTIFY_FLUSH_TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.warning("종료 전 ntfy 신호를 모두 보내지 못했습니다")
+        last_metrics = save_cycle_metrics(metrics_db, now.astimezone(KST), cycle_seconds, metrics_exporter)
+        if finished:
+            break
+        wait = scheduler.seconds_until_next()
+        logging.info(f"다음 수집까지 {wait:.0f}초 대기")
+        await asyncio.sleep(wait)
+
+    tasks = [task for task in (dispatcher_task, ntfy_task, reminder_task, metrics_task, command_task) if task is not None]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if command_handler is not None:
+        command_handler.close()
+    telegram_dispatcher, ntfy_notifier = None, None
+    return last_metrics
+
+def account_command(args):
+    """`python main.py account add|list|remove` - 여러 계정 모드의 추가 계정 관리"""
+    account_db = AccountDB(db_path)
+    if args.action == "add":
+        api_key = os.environ.get('LMS_ACCOUNT_API_KEY') or getpass.getpass(f"{args.name} 계정의 Canvas API 토큰: ")
+        account_db.add(args.name, api_key.strip(), args.chat_id)
+        print(f"계정 추가: {args.name} (chat_id={args.chat_id})")
+    elif args.action == "remove":
+        print(f"계정 삭제: {args.name}" if account_db.remove(args.name) else f"계정 없음: {args.name}")
+    else:
+        print(f"0\tdefault\tchat_id={chat_id}\t(환경변수)")
+        for account, enabled in account_db.get_all():
+            print(f"{account.id}\t{account.name}\tchat_id={account.chat_id}\t{'' if enabled else '(비활성)'}")
+
+def metrics_command(args):
+    """`python main.py metrics` - 최근 수집 주기에서 오래 걸린 단계와 과목 요약"""
+    cycle_count, phases, courses = MetricsDB(db_path).summary(args.cycles, args.top)
+    if not cycle_count:
+        print("기록된 수집 측정값이 없습니다.")
+        return
+    print(f"최근 {cycle_count}개 수집 주기 (시간은 주기당 평균, 병렬 실행 단계는 스레드별 합계)")
+    print(f"{'단계':<14}{'초':>9}{'횟수':>8}{'요청':>8}{'KB':>10}{'재시도':>7}")
+    for phase, seconds, calls, requests_count, received, retries in phases:
+        print(f"{phase:<14}{seconds / cycle_count:>9.2f}{calls / cycle_count:>8.1f}{requests_count / cycle_count:>8.1f}"
+              f"{received / cycle_count / 1024:>10.1f}{retries / cycle_count:>7.1f}")
+    if courses:
+        print(f"\n느린 과목 상위 {len(courses)}개")
+        for course_name, seconds, requests_count, received, retries in courses:
+            print(f"  {course_name}: {seconds / cycle_count:.2f}초, 요청 {requests_count / cycle_count:.1f}건, "
+                  f"{received / cycle_count / 1024:.1f}KB, 재시도 {retries / cycle_count:.1f}회")
+
+def history_command(args):
+    """`python main.py history list|show|stats` - 공지/과제 변경 이력 조회와 과거 본문 복원"""
+    history = RevisionDB(db_path)
+    if args.action == "stats":
+        stats = history.stats()
+        print(f"리비전 {stats['revisions']}개, 본문 {stats['blobs']}개 (중복 제거)")
+        print(f"전체 사본으로 저장할 때 {stats['logical_bytes'] / 1024:.1f}KB, 중복 제거 {stats['original_bytes'] / 1024:.1f}KB, "
+              f"실제 저장 {stats['stored_bytes'] / 1024:.1f}KB")
+        return
+    if args.action == "list":
+        rows = history.revisions(args.item_type, args.item_id)
+        if not rows:
+            print("기록된 이력이 없습니다.")
+        for revision_id, field, recorded_at, size, kind, stored in rows:
+            stored_text = "None" if size is None else f"{size}B → {kind} {stored}B"
+            print(f"{revision_id}\t{recorded_at}\t{field}\t{stored_text}")
+        return
+    values = history.version(args.item_type, args.item_id, at=args.at, revision_id=args.revision)
+    if not values:
+        print("해당 시점의 이력이 없습니다.")
+    html_columns = {"announcement": AnnouncementDB.html_columns, "assignment": AssignmentDB.html_columns}[args.item_type]
+    for field, value in values.items():
+        if field in html_columns and not args.raw:
+            value = html_to_text(value)
+        print(f"[{field}]\n{value}\n")
+
+def search_command(args):
+    """`python main.py search <검색어>` - 공지/과제/강의자료 PDF 전문 검색"""
+    search_index = open_search_index(db_path)
+    if search_index is None:
+        print("검색 색인을 사용할 수 없습니다 (LMS_SEARCH=0 또는 SQLite FTS5 없음).")
+        return
+    started = time.perf_counter()
+    hits = search_index.search(args.query, limit=args.limit, course=args.course)
+    print(f"'{args.query}' 검색 결과 {len(hits)}건 ({(time.perf_counter() - started) * 1000:.1f}ms)")
+    for hit in hits:
+        print(format_search_hit(hit))
+
+def build_cli_parser():
+    parser = argparse.ArgumentParser(description="LMS 알림 봇 (인자 없이 실행하면 수집 루프 시작)")
+    sub = parser.add_subparsers(dest="command")
+    account = sub.add_parser("account", help="여러 계정 모드의 추가 계정 관리")
+    account_sub = account.add_subparsers(dest="action", required=True)
+    add = account_sub.add_parser("add", help="계정 추가 (토큰은 LMS_ACCOUNT_API_KEY 또는 입력)")
+    add.add_argument("name")
+    add.add_argument("chat_id")
+    remove = account_sub.add_parser("remove", help="계정 삭제")
+    remove.add_argument("name")
+    account_sub.add_parser("list", help="계정 목록")
+    account.set_defaults(func=account_command)
+    metrics = sub.add_parser("metrics", help="최근 수집 주기의 단계/과목별 소요 시간 요약")
+    metrics.add_argument("--cycles", type=int, default=20, help="요약할 최근 수집 주기 수")
+    metrics.add_argument("--top", type=int, default=10, help="표시할 느린 과목 수")
+    metrics.set_defaults(func=metrics_command)
+    history = sub.add_parser("history", help="공지/과제 변경 이력 조회와 과거 본문 복원")
+    history_sub = history.add_subparsers(dest="action", required=True)
+    for action, help_text in (("list", "항목의 리비전 목록"), ("show", "항목의 과거 값 복원 (기본: 최신)")):
+        action_parser = history_sub.add_parser(action, help=help_text)
+        action_parser.add_argument("item_type", choices=("announcement", "assignment"))
+        action_parser.add_argument("item_id", type=int)
+        if action == "show":
+            action_parser.add_argument("--at", help='이 시각(KST, "YYYY-MM-DD HH:MM:SS")까지의 값')
+            action_parser.add_argument("--revision", type=int, help="이 리비전 ID까지의 값")
+            action_parser.add_argument("--raw", action="store_true", help="HTML 본문을 평문으로 바꾸지 않고 출력")
+    history_sub.add_parser("stats", help="이력 저장 용량")
+    history.set_defaults(func=history_command)
+    search = sub.add_parser("search", help="공지/과제/강의자료 PDF 전문 검색")
+    search.add_argument("query")
+    search.add_argument("--course", help="과목명 일부로 결과 제한")
+    search.add_argument("--limit", type=int, default=10)
+    search.set_defaults(func=search_command)
+    return parser
 
 if __name__ == "__main__":
-    asyncio.run(loop_main())
+    cli_args = build_cli_parser().parse_args()
+    if cli_args.command is None:
+        asyncio.run(loop_main())
+    else:
+        cli_args.func(cli_args)
@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# main.py는 import 시점에 환경변수와 로그 경로를 확인하므로 먼저 설정
+TEST_DIR = tempfile.mkdtemp(prefix="lms-test-")
+os.environ.setdefault("TELEGRAM_TOKEN", "0:test")
+os.environ.setdefault("CHAT_ID", "0")
+os.environ.setdefault("LMS_API_KEY", "test")
+os.environ.setdefault("LMS_PARENT_PATH", TEST_DIR)
+os.environ.setdefault("LMS_FILE_PATH", os.path.join(TEST_DIR, "Univ"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as lms  # noqa: E402
+
+
+@pytest.fixture
+def memory_db():
+    """테스트마다 새 in-memory SQLite (Storage.shared가 경로별로 연결을 공유하므로 비우고 시작)"""
+    lms.Storage._shared.pop(":memory:", None)
+    yield ":memory:"
+    storage = lms.Storage._shared.pop(":memory:", None)
+    if storage is not None:
+        storage.con.close()
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from conftest import lms
+
+
+def set_created_at(outbox, row_id, days_ago):
+    created_at = (datetime.now(lms.KST) - timedelta(days=days_ago)).strftime("%Y-%m-%d %H:%M:%S")
+    with outbox.storage.transaction() as cur:
+        cur.execute("UPDATE telegram_outbox SET created_at=? WHERE id=?", (created_at, row_id))
+
+
+def statuses(outbox):
+    with outbox.storage.cursor() as cur:
+        cur.execute("SELECT id, status FROM telegram_outbox ORDER BY id")
+        return cur.fetchall()
+
+
+def test_prune_removes_only_old_finished_rows(memory_db):
+    outbox = lms.OutboxDB(memory_db)
+    for message in ("old sent", "old failed", "old pending", "new sent"):
+        outbox.enqueue("1", message)
+    outbox.mark_sent([1, 4])
+    outbox.mark_retry([2], 0, "error", give_up=True)
+    for row_id in (1, 2, 3):
+        set_created_at(outbox, row_id, 30)
+
+    assert outbox.prune(timedelta(days=7)) == 2
+    assert statuses(outbox) == [(3, "pending"), (4, "sent")]
+
+
+def test_dispatcher_prunes_at_most_once_per_interval(memory_db):
+    outbox = lms.OutboxDB(memory_db)
+    dispatcher = lms.TelegramDispatcher(outbox, bot=None, default_chat_id="1")
+    outbox.enqueue("1", "sent long ago")
+    outbox.mark_sent([1])
+    set_created_at(outbox, 1, 30)
+
+    assert dispatcher.prune_if_due() == 1
+    outbox.enqueue("1", "sent long ago too")
+    outbox.mark_sent([2])
+    set_created_at(outbox, 2, 30)
+    assert dispatcher.prune_if_due() == 0  # OUTBOX_PRUNE_INTERVAL 안에서는 다시 정리하지 않음
+    assert [row_id for row_id, _ in statuses(outbox)] == [2]
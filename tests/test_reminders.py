@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from conftest import lms
+
+OFFSETS = [4320, 1440, 180, 60]  # 72h, 24h, 3h, 1h
+NOW = datetime(2026, 3, 2, 12, 0, tzinfo=timezone.utc)
+
+
+def rows(notification_db, assignment_id=1):
+    with notification_db.storage.cursor() as cur:
+        cur.execute("""SELECT offset_minutes, due_at, status FROM assignment_notify
+                       WHERE assignment_id=? ORDER BY id""", (assignment_id,))
+        return cur.fetchall()
+
+
+def by_offset(notification_db, assignment_id=1):
+    return {offset: status for offset, _, status in rows(notification_db, assignment_id)}
+
+
+def test_parse_reminder_offsets():
+    assert lms.parse_reminder_offsets("72h, 24h,3h,1h") == OFFSETS
+    assert lms.parse_reminder_offsets("3d,90m,2,,1h") == [4320, 120, 90, 60]
+
+
+def test_schedule_is_idempotent(memory_db):
+    db = lms.NotificationDB(memory_db)
+    due_at = NOW + timedelta(days=5)
+    assignments = [(1, "과목", "과제", due_at, False)]
+
+    scheduled = db.schedule(assignments, OFFSETS, now=NOW)
+    assert len(scheduled) == 4
+    assert sorted(fire_at for fire_at, _ in scheduled) == sorted(
+        (due_at - timedelta(minutes=offset)).timestamp() for offset in OFFSETS)
+    assert db.schedule(assignments, OFFSETS, now=NOW) == []
+    assert len(rows(db)) == 4
+
+
+def test_late_poll_sends_only_nearest_overdue_offset(memory_db):
+    """마감 2시간 전에 처음 본 과제: 72h/24h는 건너뛰고 3h는 바로, 1h는 제시각에"""
+    db = lms.NotificationDB(memory_db)
+    due_at = NOW + timedelta(hours=2)
+
+    scheduled = db.schedule([(1, "과목", "과제", due_at, False)], OFFSETS, now=NOW)
+    assert by_offset(db) == {4320: "skipped", 1440: "skipped", 180: "pending", 60: "pending"}
+    fire_times = sorted(fire_at for fire_at, _ in scheduled)
+    assert fire_times[0] <= NOW.timestamp() < fire_times[1]
+
+
+def test_late_poll_does_not_resend_offsets_earlier_than_already_sent(memory_db):
+    """3h 알림을 보낸 뒤 24h 알림이 설정에 추가돼도 지금 보내지 않음"""
+    db = lms.NotificationDB(memory_db)
+    due_at = NOW + timedelta(hours=2)
+    db.schedule([(1, "과목", "과제", due_at, False)], [180, 60], now=NOW)
+    (reminder_id,) = [row_id for fire_at, row_id in db.get_pending() if fire_at <= NOW.timestamp()]
+    assert db.claim(reminder_id, "2026-03-02 21:00:00") is not None
+
+    later = NOW + timedelta(minutes=30)
+    assert db.schedule([(1, "과목", "과제", due_at, False)], [1440, 180, 60], now=later) == []
+    assert by_offset(db) == {180: "sent", 60: "pending", 1440: "skipped"}
+
+
+def test_due_change_and_submission_cancel_pending(memory_db):
+    db = lms.NotificationDB(memory_db)
+    due_at = NOW + timedelta(days=5)
+    db.schedule([(1, "과목", "과제", due_at, False)], OFFSETS, now=NOW)
+
+    moved = due_at + timedelta(days=1)
+    assert len(db.schedule([(1, "과목", "과제", moved, False)], OFFSETS, now=NOW)) == 4
+    statuses = [(due, status) for _, due, status in rows(db)]
+    assert statuses.count((due_at.isoformat(), "cancelled")) == 4
+    assert statuses.count((moved.isoformat(), "pending")) == 4
+
+    assert db.schedule([(1, "과목", "과제", moved, True)], OFFSETS, now=NOW) == []
+    assert db.get_pending() == []
+
+
+def test_legacy_d_day_rows_are_migrated(memory_db):
+    """이전 (assignment_id, d_day, sent_at) 기록은 sent 행으로 남고, 그보다 이른 알림은 다시 보내지 않음"""
+    storage = lms.Storage.shared(memory_db)
+    with storage.transaction() as cur:
+        cur.execute("""CREATE TABLE assignment_notify (
+                           id INTEGER PRIMARY KEY AUTOINCREMENT,
+                           assignment_id INTEGER NOT NULL,
+                           d_day INTEGER NOT NULL,
+                           sent_at TEXT NOT NULL)""")
+        cur.execute("CREATE UNIQUE INDEX idx_assignment_notify_unique ON assignment_notify (assignment_id, d_day)")
+        cur.executemany("INSERT INTO assignment_notify (assignment_id, d_day, sent_at) VALUES (?, ?, ?)",
+                        [(1, 3, "2026-02-27 09:00:00"), (1, 1, "2026-03-01 09:00:00")])
+
+    db = lms.NotificationDB(memory_db)
+    assert rows(db) == [(4320, None, "sent"), (1440, None, "sent")]
+
+    due_at = NOW + timedelta(hours=20)
+    scheduled = db.schedule([(1, "과목", "과제", due_at, False)], OFFSETS, now=NOW)
+    assert len(scheduled) == 2
+    assert {offset: status for offset, due, status in rows(db) if due is not None} == {180: "pending", 60: "pending"}
+
+
+def test_engine_fire_skips_submitted_and_sends_others(memory_db, monkeypatch):
+    sent = []
+
+    async def fake_send(message, course_name, target_chat_id=None):
+        sent.append((message, target_chat_id))
+
+    monkeypatch.setattr(lms, "send_telegram_message", fake_send)
+    account_db = lms.AccountDB(memory_db)
+    account_db.set_submissions([(2, 1, True)])
+    engine = lms.ReminderEngine(lms.NotificationDB(memory_db), lms.AssignmentDB(memory_db), [60], account_db)
+    engine.set_accounts([lms.Account(2, "friend", "key", "222")])
+
+    due_at = datetime.now(timezone.utc) + timedelta(minutes=30)  # 1h 알림은 이미 지남 → 바로 전송 대상
+    engine.schedule([(1, "과목", "과제", due_at, False)], account_id=0)
+    engine.schedule([(1, "과목", "과제", due_at, False)], account_id=2)
+    asyncio.run(engine.fire_due())
+
+    assert len(sent) == 1
+    assert "[과제 마감 알림] 1시간 전" in sent[0][0]
+    assert sent[0][1] == lms.chat_id
+    assert engine.db.get_pending() == []
@@ -0,0 +1,106 @@
+import random
+
+import pytest
+
+from conftest import lms
+
+
+def make_versions(count, seed=0):
+    """앞부분은 같고 매번 한 줄씩 바뀌거나 늘어나는 공지 본문들"""
+    rng = random.Random(seed)
+    words = ["과제", "제출", "마감", "강의", "자료", "시험", "범위", "공지", "변경", "안내", "week", "lab", "quiz"]
+    lines = [" ".join(rng.choice(words) for _ in range(12)) for _ in range(40)]
+    versions = []
+    for index in range(count):
+        lines[rng.randrange(len(lines))] = f"{index}번째 수정 " + " ".join(rng.choice(words) for _ in range(8))
+        lines.append(f"추가 {index}: " + " ".join(rng.choice(words) for _ in range(6)))
+        versions.append("\n".join(lines))
+    return versions
+
+
+def record(revision_db, item_id, value):
+    with revision_db.storage.transaction() as cur:
+        return revision_db.record(cur, "announcement", ("content",), [(item_id, {"content": value})])
+
+
+def blob_rows(revision_db):
+    with revision_db.storage.cursor() as cur:
+        cur.execute("SELECT id, kind, base_id, depth FROM revision_blob ORDER BY id")
+        return cur.fetchall()
+
+
+def assert_restores(revision_db, item_id, expected):
+    revision_ids = [row[0] for row in revision_db.revisions("announcement", item_id)]
+    assert len(revision_ids) == len(expected)
+    for revision_id, value in zip(revision_ids, expected):
+        assert revision_db.version("announcement", item_id, revision_id=revision_id) == {"content": value}
+
+
+def test_delta_chain_restores_every_version(memory_db, monkeypatch):
+    monkeypatch.setattr(lms, "HISTORY_MAX_DELTA_CHAIN", 4)
+    versions = make_versions(10)
+    revision_db = lms.RevisionDB(memory_db)
+    for value in versions:
+        assert record(revision_db, 1, value) == 1
+    assert record(revision_db, 1, versions[-1]) == 0  # 같은 값은 기록하지 않음
+
+    blobs = blob_rows(revision_db)
+    assert [kind for _, kind, _, _ in blobs].count("delta") >= 8
+    assert max(depth for _, _, _, depth in blobs) == 4
+    for blob_id, kind, base_id, depth in blobs:
+        if kind == "delta":
+            assert base_id == blob_id - 1 and depth >= 1
+    stats = revision_db.stats()
+    assert stats["stored_bytes"] < stats["original_bytes"] / 4
+
+    assert_restores(lms.RevisionDB(memory_db), 1, versions)  # 캐시 없이 기준 본문부터 풀어서 복원
+
+
+def test_reverted_value_reuses_blob_and_new_item_deltas_against_recent(memory_db):
+    versions = make_versions(3)
+    revision_db = lms.RevisionDB(memory_db)
+    for value in versions + [versions[0]]:
+        record(revision_db, 1, value)
+    assert len(blob_rows(revision_db)) == 3  # 되돌린 본문은 기존 blob 공유
+
+    record(revision_db, 2, versions[-1] + "\n다른 분반 공지")
+    new_blob = blob_rows(revision_db)[-1]
+    assert new_blob[1] == "delta"
+    assert_restores(lms.RevisionDB(memory_db), 1, versions + [versions[0]])
+    assert lms.RevisionDB(memory_db).version("announcement", 2) == {"content": versions[-1] + "\n다른 분반 공지"}
+
+
+def test_rolled_back_revisions_do_not_corrupt_later_deltas(memory_db):
+    """롤백된 blob ID가 다음 트랜잭션에서 재사용돼도 캐시/기준 본문이 섞이지 않음"""
+    versions = make_versions(8)
+    revision_db = lms.RevisionDB(memory_db)
+    record(revision_db, 1, versions[0])
+    record(revision_db, 1, versions[1])
+
+    with pytest.raises(RuntimeError):
+        with revision_db.storage.transaction() as cur:
+            for value in versions[2:5]:
+                revision_db.record(cur, "announcement", ("content",), [(1, {"content": value})])
+            revision_db.record(cur, "announcement", ("content",), [(3, {"content": versions[4] + "\n새 공지"})])
+            raise RuntimeError("수집 중단")
+    assert len(revision_db.revisions("announcement", 1)) == 2
+    assert revision_db.version("announcement", 3) == {}
+
+    for value in versions[5:]:
+        record(revision_db, 1, value)
+    record(revision_db, 4, versions[-1] + "\n새 공지")
+    expected = versions[:2] + versions[5:]
+
+    assert_restores(revision_db, 1, expected)
+    assert_restores(lms.RevisionDB(memory_db), 1, expected)
+    assert lms.RevisionDB(memory_db).version("announcement", 4) == {"content": versions[-1] + "\n새 공지"}
+
+
+def test_none_value_is_recorded_only_after_a_value(memory_db):
+    revision_db = lms.RevisionDB(memory_db)
+    assert record(revision_db, 1, None) == 0
+    record(revision_db, 1, "본문")
+    assert record(revision_db, 1, None) == 1
+    assert revision_db.version("announcement", 1) == {"content": None}
+    first = revision_db.revisions("announcement", 1)[0][0]
+    assert revision_db.version("announcement", 1, revision_id=first) == {"content": "본문"}
@@ -0,0 +1,88 @@
+from conftest import lms
+
+
+def announce(announcement_db, message, title="공지"):
+    return announcement_db.set_database([(1, 10, "과목", title, message, "2026-03-02T09:00:00Z")])
+
+
+def stored_message(announcement_db):
+    with announcement_db.storage.cursor() as cur:
+        cur.execute("SELECT announcement_message FROM announcement WHERE announcement_id=1")
+        return cur.fetchone()[0]
+
+
+def test_text_diff_marks_changed_words_inline():
+    old = "1주차 안내\n과제 마감은 3월 10일 23:59입니다.\n제출은 LMS로 해 주세요."
+    new = "1주차 안내\n과제 마감은 3월 12일 23:59입니다.\n제출은 LMS로 해 주세요."
+    assert lms.text_diff(old, new) == "  1주차 안내\n~ 과제 마감은 3월 [-10일-]{+12일+} 23:59입니다.\n  제출은 LMS로 해 주세요."
+
+
+def test_text_diff_added_and_removed_lines():
+    old = "첫 줄\n지울 줄\n끝 줄"
+    new = "첫 줄\n끝 줄\n새 줄"
+    assert lms.text_diff(old, new, context=0) == "- 지울 줄\n ⋯\n+ 새 줄"
+
+
+def test_text_diff_ignores_whitespace_and_line_breaks():
+    old = "과제 마감은   3월 10일입니다.\n제출은 LMS로"
+    new = "과제 마감은 3월 10일입니다.\n\n제출은\nLMS로"
+    assert lms.text_diff(old, new) == ""
+    assert lms.text_diff(None, "") == ""
+
+
+def test_text_diff_keeps_only_context_around_distant_changes():
+    lines = [f"{index}번 줄 내용" for index in range(100)]
+    changed = list(lines)
+    changed[5] = "5번 줄 수정"
+    changed[90] = "90번 줄 수정"
+    diff = lms.text_diff("\n".join(lines), "\n".join(changed), context=1)
+    assert diff.count("\n ⋯\n") == 1
+    assert "50번 줄" not in diff
+    assert "~ 5번 줄 [-내용-]{+수정+}" in diff and "~ 90번 줄 [-내용-]{+수정+}" in diff
+
+
+def test_text_diff_truncates_to_limit():
+    old = "\n".join(f"줄 {index}" for index in range(200))
+    new = "\n".join(f"바뀐 줄 {index}" for index in range(200))
+    diff = lms.text_diff(old, new, limit=100)
+    assert len(diff) <= 100 + len("\n ⋯") and diff.endswith("\n ⋯")
+
+
+def test_html_links_in_document_order():
+    html = '<p>회의 <a href=" https://zoom.us/j/1 ">링크</a></p><img src="/files/2/preview"><a name="x">앵커</a>'
+    assert lms.html_links(html) == ["https://zoom.us/j/1", "/files/2/preview"]
+    assert lms.html_links("") == []
+
+
+def test_upsert_reports_text_change_as_plain_text(memory_db):
+    announcement_db = lms.AnnouncementDB(memory_db)
+    assert announce(announcement_db, "<p>시험은 <b>월요일</b>입니다.</p>") == []
+    (row,) = announce(announcement_db, "<p>시험은 <b>화요일</b>입니다.</p>")
+    assert row["changed_fields"] == [("announcement_message", "시험은\n월요일\n입니다.", "시험은\n화요일\n입니다.")]
+
+
+def test_upsert_markup_only_change_is_saved_without_alert(memory_db):
+    announcement_db = lms.AnnouncementDB(memory_db)
+    announce(announcement_db, '<p>시험은 월요일입니다. <a href="https://a.example/1">자료</a></p>')
+    new_html = '<div><p>시험은   월요일입니다.</p><p><a href="https://a.example/1" class="btn">자료</a></p></div>'
+    assert announce(announcement_db, new_html) == []
+    assert stored_message(announcement_db) == new_html
+
+
+def test_upsert_reports_link_only_change(memory_db):
+    announcement_db = lms.AnnouncementDB(memory_db)
+    announce(announcement_db, '<p>수업 <a href="https://zoom.us/j/111">Zoom</a></p><img src="/files/1/preview">')
+    (row,) = announce(announcement_db, '<p>수업 <a href="https://zoom.us/j/222">Zoom</a></p><img src="/files/1/preview">')
+    assert row["changed_fields"] == [(
+        "announcement_message",
+        "🔗 https://zoom.us/j/111\n🔗 /files/1/preview",
+        "🔗 https://zoom.us/j/222\n🔗 /files/1/preview",
+    )]
+
+
+def test_upsert_reports_image_only_change(memory_db):
+    announcement_db = lms.AnnouncementDB(memory_db)
+    announce(announcement_db, '<p>시간표</p><img src="/files/1/preview">')
+    (row,) = announce(announcement_db, '<p>시간표</p><img src="/files/2/preview">')
+    assert row["changed_fields"] == [("announcement_message", "🔗 /files/1/preview", "🔗 /files/2/preview")]
+    assert announce(announcement_db, '<p>시간표</p><img src="/files/2/preview">') == []